@@ -1,351 +1,4322 @@
+import argparse
+import asyncio
+import bisect
+import codecs
+import copy
+import gc
+import glob
+import hashlib
+import io
+import itertools
+import json
+import math
+import mmap
+import os
+import platform
+import random
+import queue
 import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
+import tracemalloc
+import uuid
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from tkinter import filedialog, messagebox, simpledialog, ttk
+
+try:
+    import resource  # Pico de memória (RSS) no benchmark; não existe no Windows
+except ImportError:
+    resource = None
+
+try:
+    import numpy as np  # Estimativa do tempo de ciclo (subcomando tempo); opcional
+except ImportError:
+    np = None
+
+_PARAM_RE = re.compile(r'([A-Z])(-?\d+\.?\d*)')
+_WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_COMMENT_RE = re.compile(r'\([^)]*\)?|;.*')
+_ARC_K_RE = re.compile(r'\s+K-?\d+\.?\d*', re.IGNORECASE)
+
+# Bloco tokenizado: número da linha (1-based), texto original, parâmetros
+# {letra: valor} (a última ocorrência vence), códigos G em ordem e comentário
+GCodeBlock = namedtuple('GCodeBlock', 'line_number text params g_codes comment')
 
 def parse_gcode_params(line):
     """Extrai os parâmetros (X, Y, Z, R, F, Q) de uma linha de G-code."""
+    return {letter: float(value) for letter, value in _PARAM_RE.findall(line.upper())}
+
+def iter_gcode_lines(source):
+    """Itera as linhas de um texto ou arquivo aberto, uma por vez, sem carregar tudo na memória."""
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    for raw_line in source:
+        # Mesmo particionamento de str.splitlines(), linha física por linha física
+        yield from (raw_line.splitlines() or ('',))
+
+def tokenize_gcode_line(line, line_number=0):
+    """Tokeniza uma linha em uma única passada; retorna None para linhas em branco."""
+    stripped = line.strip()
+    if not stripped:
+        return None
+    comment = ''
+    if '(' in stripped or ';' in stripped:
+        comment = ' '.join(_COMMENT_RE.findall(stripped))
+        stripped = _COMMENT_RE.sub(' ', stripped)
     params = {}
-    matches = re.findall(r'([A-Z])(-?\d+\.?\d*)', line.upper())
-    for match in matches:
-        params[match[0]] = float(match[1])
-    return params
+    g_codes = []
+    for letter, value in _WORD_RE.findall(stripped.upper()):
+        value = float(value)
+        if letter == 'G':
+            g_codes.append(value)
+        params[letter] = value
+    return GCodeBlock(line_number, line, params, g_codes, comment)
+
+def tokenize_gcode(lines, first_line_number=1):
+    """Gera um GCodeBlock por linha não vazia, tokenizando cada linha uma única vez."""
+    for line_number, line in enumerate(lines, first_line_number):
+        block = tokenize_gcode_line(line, line_number)
+        if block is not None:
+            yield block
+
+class _SpindleProbe:
+    """Repassa as linhas de entrada registrando a primeira velocidade S, sem pré-varredura."""
+
+    def __init__(self, lines):
+        self.speed = None
+        self._lines = lines
+
+    def __iter__(self):
+        lines = iter(self._lines)
+        for line in lines:
+            yield line
+            if 'S' in line.upper():
+                params = parse_gcode_params(line)
+                if 'S' in params:
+                    self.speed = int(params['S'])
+                    break
+        yield from lines
+
+# Saída retida em memória enquanto o cabeçalho não é resolvido; acima disso vai para disco
+HEADER_LOOKAHEAD_BYTES = 8 * 1024 * 1024
+
+def _iter_with_deferred_header(make_header, body, probe, default_speed=1000):
+    """Emite o cabeçalho assim que a velocidade do spindle é conhecida, retendo a saída anterior.
+
+    Programas comuns definem S nas primeiras linhas, então a janela de retenção é
+    pequena; se o S demorar (ou não existir), a saída retida transborda para um
+    arquivo temporário e a entrada continua sendo lida uma única vez.
+    """
+    pending = None
+    for chunk in body:
+        if probe.speed is None:
+            if pending is None:
+                pending = tempfile.SpooledTemporaryFile(
+                    max_size=HEADER_LOOKAHEAD_BYTES, mode='w+', encoding='utf-8', newline='')
+            pending.write(chunk)
+            continue
+        if pending is not False:
+            yield make_header(probe.speed)
+            if pending is not None:
+                yield from _drain(pending)
+            pending = False
+        yield chunk
+    if pending is not False:
+        yield make_header(default_speed if probe.speed is None else probe.speed)
+        if pending is not None:
+            yield from _drain(pending)
+
+def _drain(spool, chunk_size=1 << 20):
+    """Devolve o conteúdo retido em blocos e descarta o arquivo temporário."""
+    with spool:
+        spool.seek(0)
+        yield from iter(lambda: spool.read(chunk_size), '')
+
+# --- Instrumentação opcional das conversões ---
+class ConversionStats:
+    """Tempos por etapa e contadores de uma conversão, para descobrir onde o tempo vai.
+
+    É opcional: passada como stats=ConversionStats() às funções de conversão, que
+    então usam versões medidas dos laços internos; sem ela (stats=None) os
+    caminhos rápidos não medem nada. Várias conversões podem somar no mesmo objeto.
+    """
+    # Nomes das etapas, na ordem do relatório
+    STAGES = ('tokenizacao', 'estado modal', 'modelos', 'formatacao', 'interface')
+
+    def __init__(self):
+        self.stage_seconds = {}
+        self.cycles = {}  # 'G81' -> {'blocks', 'holes', 'output_lines'}
+        self.k_words_removed = 0
+        self.conversions = 0
+        self.total_seconds = 0.0
+        self.input_lines = 0
+        self.input_bytes = 0
+        self.output_lines = 0
+        self.output_bytes = 0
+
+    def add_time(self, stage, seconds):
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def count_cycle(self, cycle, holes, output_lines):
+        counters = self.cycles.setdefault(f"G{cycle:g}", {'blocks': 0, 'holes': 0, 'output_lines': 0})
+        counters['blocks'] += 1
+        counters['holes'] += holes
+        counters['output_lines'] += output_lines
+
+    def record(self, seconds, input_lines, input_bytes, output_lines, output_bytes):
+        """Registra os totais de uma conversão completa."""
+        self.conversions += 1
+        self.total_seconds += seconds
+        self.input_lines += input_lines
+        self.input_bytes += input_bytes
+        self.output_lines += output_lines
+        self.output_bytes += output_bytes
+
+    def merge(self, report):
+        """Soma um relatório (report()) de outra conversão, por exemplo de outro processo."""
+        for stage, seconds in report['stages'].items():
+            self.add_time(stage, seconds)
+        for cycle, counters in report['cycles'].items():
+            total = self.cycles.setdefault(cycle, {'blocks': 0, 'holes': 0, 'output_lines': 0})
+            for key in total:
+                total[key] += counters[key]
+        self.k_words_removed += report['k_words_removed']
+        self.conversions += report['conversions']
+        self.total_seconds += report['seconds']
+        for key in ('input_lines', 'input_bytes', 'output_lines', 'output_bytes'):
+            setattr(self, key, getattr(self, key) + report[key])
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        return {
+            'conversions': self.conversions,
+            'seconds': self.total_seconds,
+            'stages': dict(self.stage_seconds),
+            'cycles': {cycle: dict(counters) for cycle, counters in sorted(self.cycles.items())},
+            'k_words_removed': self.k_words_removed,
+            'input_lines': self.input_lines,
+            'input_bytes': self.input_bytes,
+            'output_lines': self.output_lines,
+            'output_bytes': self.output_bytes,
+            'amplification': self.output_bytes / self.input_bytes if self.input_bytes else 0.0,
+        }
+
+    def format(self):
+        """Relatório em texto, uma informação por linha."""
+        lines = [f"Tempo total: {self.total_seconds:.3f}s ({self.input_lines} linhas de entrada)"]
+        order = {stage: position for position, stage in enumerate(self.STAGES)}
+        for stage in sorted(self.stage_seconds, key=lambda stage: (order.get(stage, len(order)), stage)):
+            seconds = self.stage_seconds[stage]
+            share = f" ({100 * seconds / self.total_seconds:.0f}%)" if self.total_seconds else ""
+            lines.append(f"  {stage}: {seconds:.3f}s{share}")
+        for cycle, counters in sorted(self.cycles.items()):
+            lines.append(f"{cycle}: {counters['blocks']} blocos, {counters['holes']} furos, "
+                         f"{counters['output_lines']} linhas geradas")
+        if self.k_words_removed:
+            lines.append(f"Palavras K removidas: {self.k_words_removed}")
+        amplification = self.output_bytes / self.input_bytes if self.input_bytes else 0.0
+        lines.append(f"Saída: {self.output_lines} linhas, {self.output_bytes} bytes "
+                     f"({amplification:.2f}x a entrada)")
+        return "\n".join(lines)
+
+def _convert_text_profiled(converter, gcode_text, stats):
+    """Converte um texto com stats, registrando os totais da conversão."""
+    start = time.perf_counter()
+    output_text = "".join(converter(iter_gcode_lines(gcode_text), stats=stats))
+    stats.record(time.perf_counter() - start, len(gcode_text.splitlines()), len(gcode_text.encode('utf-8')),
+                 output_text.count('\n'), len(output_text.encode('utf-8')))
+    return output_text
+
+def _mach3_header(spindle_speed):
+    """Rotina de inicialização segura do Mach3."""
+    return ("; ========================================\n"
+            "; Rotina de Inicialização Mach3\n"
+            "; ========================================\n"
+            "G21 ; Modo métrico (mm)\n"
+            "G90 ; Modo absoluto\n"
+            "G94 ; Avanço em mm/min\n"
+            "G17 ; Plano XY\n"
+            f"M3 S{spindle_speed} ; Liga spindle a {spindle_speed} RPM\n"
+            "G4 P2.0 ; Aguarda 2 segundos para estabilizar\n"
+            "; ========================================\n"
+            "\n")
+
+def _safe_return_footer(initial_z):
+    """Rotina de retorno seguro para home, comum às duas conversões."""
+    return ("\n"
+            "; ========================================\n"
+            "; Rotina de Retorno Seguro para Home\n"
+            "; ========================================\n"
+            f"G0 Z{initial_z:.6f} ; Sobe Z para altura segura\n"
+            "G0 X0.000000 Y0.000000 ; Move para X0 Y0\n"
+            "; Z permanece em altura segura para evitar colisão\n"
+            "M5 ; Desliga fuso\n"
+            "M30 ; Fim do programa\n"
+            "; ========================================\n")
+
+def iter_convert_gcode_for_mach3(lines, spindle_speed=None, stats=None):
+    """Gera, linha a linha, o G-code convertido para Mach3 (sem parâmetro K e com rotinas de segurança).
+
+    Sem spindle_speed, a velocidade é resolvida durante a própria passagem (primeiro S).
+    """
+    if spindle_speed is not None:
+        yield _mach3_header(spindle_speed)
+        yield from _iter_mach3_body(lines, stats)
+    else:
+        probe = _SpindleProbe(lines)
+        yield from _iter_with_deferred_header(_mach3_header, _iter_mach3_body(probe, stats), probe)
+
+def _iter_mach3_body(lines, stats=None):
+    """Corpo da conversão Mach3 seguido da rotina de retorno seguro."""
+    initial_z = yield from _iter_mach3_lines(lines, stats=stats)
+    if initial_z is None:
+        initial_z = 15.0  # Altura Z segura padrão
+    
+    # Adiciona rotina de retorno seguro ao final
+    yield _safe_return_footer(initial_z)
+
+def _iter_mach3_lines(lines, first_line_number=1, stats=None):
+    """Converte as linhas para Mach3; retorna a altura do primeiro G0 Z isolado (ou None).
+
+    Com stats, mede a tokenização das linhas que precisam dela e conta as palavras K removidas.
+    """
+    initial_z = None  # Primeiro movimento G0 Z isolado, resolvido durante a passagem
+    
+    # Processa cada linha removendo o parâmetro K
+    for line_number, line in enumerate(lines, first_line_number):
+        line_stripped = line.strip()
+        
+        if not line_stripped:
+            continue
+        
+        # Comentários de linha inteira passam sem alteração
+        if line_stripped[0] in '(;':
+            yield line + '\n'
+            continue
+        
+        # Só linhas com K (ou candidatas à altura Z inicial) precisam ser tokenizadas
+        line_upper = line_stripped.upper()
+        if 'K' not in line_upper and (initial_z is not None or 'Z' not in line_upper):
+            yield line + '\n'
+            continue
+        if stats is None:
+            block = tokenize_gcode_line(line, line_number)
+        else:
+            start = time.perf_counter()
+            block = tokenize_gcode_line(line, line_number)
+            stats.add_time('tokenizacao', time.perf_counter() - start)
+        params = block.params
+        g_codes = block.g_codes
+        
+        # Detecta altura Z inicial
+        if initial_z is None and 0 in g_codes and 'Z' in params \
+                and 'X' not in params and 'Y' not in params:
+            initial_z = params['Z']
+        
+        # Verifica se é um comando de arco (G2 ou G3) e remove o parâmetro K
+        if 'K' in params and (2 in g_codes or 3 in g_codes):
+            # O K só sai quando vem separado por espaço, como na versão original
+            text, removed = _ARC_K_RE.subn('', line_stripped)
+            if stats is not None:
+                stats.k_words_removed += removed
+            yield text + '\n'
+        else:
+            yield line + '\n'
+    return initial_z
+
+def convert_gcode_for_mach3(gcode_text, stats=None, compactor=None):
+    """Converte G-code para Mach3: remove parâmetro K e adiciona rotinas de segurança."""
+    if stats is not None:
+        return _compacted(_convert_text_profiled(iter_convert_gcode_for_mach3, gcode_text, stats), compactor)
+    return _compacted(iter_convert_gcode_for_mach3(iter_gcode_lines(gcode_text)), compactor)
+
+def _compacted(output, compactor):
+    """Junta a saída (texto ou pedaços), reduzida pelo compactor (OutputCompactor) se houver um."""
+    if isinstance(output, str):
+        output = [output]
+    return "".join(output if compactor is None else compactor.compact(output))
+
+# --- Modelos de expansão dos ciclos enlatados ---
+# Cada função recebe os parâmetros do ciclo e a altura de retração já resolvida
+# (altura inicial em G98, plano R em G99) e devolve o bloco linearizado como
+# modelo %-format em que só os campos de X e Y (e o X deslocado por Q nos
+# ciclos com deslocamento do fuso) variam de um furo para outro.
+
+def _template_g73(params, retract_z):
+    """G73 - Furação pica-pau de alta velocidade."""
+    z, r, f, q = params.get('Z'), params.get('R'), params.get('F'), params.get('Q')
+    if q is None:
+        q = _G73_DEFAULT_Q
+    parts = ["; --- Conversão G73 para X%s Y%s ---\nG0 X%.6f Y%.6f\n"]
+    current_depth = r
+    while current_depth > z:
+        next_peck_depth = max(current_depth - q, z)
+        # Retrai ligeiramente antes de cada bicada
+        parts.append(f"G0 Z{current_depth + 1.0:.6f}\nG1 Z{next_peck_depth:.6f} F{f:.6f}\n")
+        current_depth = next_peck_depth
+    parts.append(f"G0 Z{retract_z:.6f}\n; --- Fim da conversão G73 ---\n")
+    return "".join(parts)
+
+def _template_g76(params, retract_z):
+    """G76 - Mandrilamento fino com deslocamento do fuso (Q)."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G76 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            "; M5 ; Parar fuso (orientado)\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "G0 X%.6f Y%.6f\n"
+            "; M3 ; Religar fuso\n"
+            "; --- Fim da conversão G76 ---\n")
+
+def _template_g81(params, retract_z):
+    """G81 - Furação simples."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G81 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G81 ---\n")
+
+def _template_g82(params, retract_z):
+    """G82 - Furação com temporização (P em segundos)."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    p = params.get('P', 0.0)
+    dwell = f"G4 P{p:.3f} ; Pausa de {p}s\n" if p > 0 else ""
+    return ("; --- Conversão G82 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            f"{dwell}"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G82 ---\n")
+
+def _template_g83(params, retract_z):
+    """G83 - Furação pica-pau com retorno ao plano R a cada bicada."""
+    z, r, f, q = params.get('Z'), params.get('R'), params.get('F'), params.get('Q')
+    parts = ["; --- Conversão G83 para X%s Y%s ---\nG0 X%.6f Y%.6f\n"]
+    current_depth = r
+    while current_depth > z:
+        next_peck_depth = max(current_depth - q, z)
+        parts.append(f"G0 Z{r:.6f}\nG1 Z{next_peck_depth:.6f} F{f:.6f}\n")
+        current_depth = next_peck_depth
+    parts.append(f"G0 Z{retract_z:.6f}\n; --- Fim da conversão G83 ---\n")
+    return "".join(parts)
+
+def _template_g84(params, retract_z):
+    """G84 - Rosqueamento com macho."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G84 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            "; M3 ; Fuso horário\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            "; M4 ; Fuso anti-horário para retirada\n"
+            f"G1 Z{r:.6f} F{f:.6f}\n"
+            "; M3 ; Fuso horário novamente\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G84 ---\n")
+
+def _template_g85(params, retract_z):
+    """G85 - Mandrilamento/alargamento com retração em avanço."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G85 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            f"G1 Z{r:.6f} F{f:.6f}\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G85 ---\n")
+
+def _template_g86(params, retract_z):
+    """G86 - Mandrilamento com parada do fuso."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G86 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            "; M5 ; Parar fuso\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; M3 ; Religar fuso\n"
+            "; --- Fim da conversão G86 ---\n")
+
+def _template_g87(params, retract_z):
+    """G87 - Mandrilamento reverso."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    return ("; --- Conversão G87 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            "; M4 ; Fuso anti-horário\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            "; M5 ; Parar fuso\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            "G0 X%.6f Y%.6f\n"
+            "; M3 ; Fuso horário\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G87 ---\n")
+
+def _template_g88(params, retract_z):
+    """G88 - Mandrilamento com parada manual."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    p = params.get('P', 0.0)
+    dwell = f"G4 P{p:.3f}\n" if p > 0 else ""
+    return ("; --- Conversão G88 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            f"{dwell}"
+            "; M0 ; Parada programada - retirar ferramenta manualmente\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G88 ---\n")
+
+def _template_g89(params, retract_z):
+    """G89 - Mandrilamento com temporização e retração em avanço."""
+    z, r, f = params.get('Z'), params.get('R'), params.get('F')
+    p = params.get('P', 0.0)
+    dwell = f"G4 P{p:.3f}\n" if p > 0 else ""
+    return ("; --- Conversão G89 para X%s Y%s ---\n"
+            "G0 X%.6f Y%.6f\n"
+            f"G0 Z{r:.6f}\n"
+            f"G1 Z{z:.6f} F{f:.6f}\n"
+            f"{dwell}"
+            f"G1 Z{r:.6f} F{f:.6f}\n"
+            f"G0 Z{retract_z:.6f}\n"
+            "; --- Fim da conversão G89 ---\n")
+
+# Tabela de despacho: código G do ciclo -> construtor do modelo de expansão
+CYCLE_TEMPLATES = {
+    73: _template_g73,
+    76: _template_g76,
+    81: _template_g81,
+    82: _template_g82,
+    83: _template_g83,
+    84: _template_g84,
+    85: _template_g85,
+    86: _template_g86,
+    87: _template_g87,
+    88: _template_g88,
+    89: _template_g89,
+}
+
+# Ciclos que deslocam o fuso em X pelo valor de Q (padrão 0.5) antes de retrair
+_SHIFT_CYCLES = (76, 87)
+
+class CycleTemplateCache:
+    """Cache LRU dos modelos de ciclo, compilados uma vez por (ciclo, R, Z, Q, P, F, retração)."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._last = (None, None, None, None)  # (ciclo, params, retração, render) do último acesso
+
+    def get(self, cycle, params, retract_z):
+        """Retorna a função render(x, y) do ciclo, compilando o modelo na primeira vez."""
+        # Furos seguidos compartilham o mesmo dicionário de parâmetros do ModalState,
+        # que é substituído (nunca alterado) quando a definição do ciclo muda
+        last_cycle, last_params, last_retract_z, render = self._last
+        if params is last_params and cycle == last_cycle and retract_z == last_retract_z:
+            self.hits += 1
+            return render
+        key = (cycle, params.get('R'), params.get('Z'), params.get('Q'),
+               params.get('P'), params.get('F'), retract_z)
+        render = self._entries.get(key)
+        if render is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._last = (cycle, params, retract_z, render)
+            return render
+        self.misses += 1
+        template = CYCLE_TEMPLATES[cycle](params, retract_z)
+        if cycle in _SHIFT_CYCLES:
+            shift = params.get('Q', 0.5)
+            render = lambda x, y: template % (x, y, x, y, x + shift, y, x, y)
+        else:
+            render = lambda x, y: template % (x, y, x, y)
+        self._entries[key] = render
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        self._last = (cycle, params, retract_z, render)
+        return render
+
+    def clear(self):
+        """Descarta os modelos e zera os contadores."""
+        self._entries.clear()
+        self._last = (None, None, None, None)
+        self.hits = 0
+        self.misses = 0
+
+# Códigos do grupo modal de movimento que cancelam o ciclo enlatado ativo
+_CYCLE_CANCEL_CODES = frozenset((0, 1, 2, 3, 80))
+
+# Palavras que definem o ciclo (mais o avanço F) e permanecem ativas até o G80
+_CYCLE_WORDS = ('R', 'Z', 'Q', 'P', 'F')
+
+# Palavras obrigatórias dos ciclos, como aparecem nas mensagens de erro
+_REQUIRED_CYCLE_WORDS = {
+    'R': "R (plano de retração)",
+    'Z': "Z (profundidade final)",
+    'F': "avanço F",
+}
+_PECK_CYCLES = (73, 83)  # Q é a profundidade de cada bicada
+_G73_DEFAULT_Q = 1.0  # G73 sem Q: bicadas de 1 mm, como na versão original (no G83 o Q é obrigatório)
+
+def _cycle_errors(cycle, params):
+    """Problemas da definição de um ciclo que impedem a expansão (lista vazia se estiver completa)."""
+    missing = [name for word, name in _REQUIRED_CYCLE_WORDS.items() if params.get(word) is None]
+    if cycle == 83 and params.get('Q') is None:
+        missing.append("Q (profundidade de cada bicada)")
+    errors = [f"ciclo G{cycle:g} sem {', '.join(missing)}"] if missing else []
+    if cycle in _PECK_CYCLES and params.get('Q') is not None and params['Q'] <= 0:
+        errors.append(f"ciclo G{cycle:g} com Q{params['Q']:g}: a bicada precisa ser positiva")
+    return errors
+
+# Passada de estado da conversão em blocos: linhas que podem mudar algo além da
+# posição e do avanço. Sem ciclo ativo, só um código G que não seja G1/G2/G3;
+# com ciclo, qualquer palavra de ciclo (R, Z, Q, P, L/K), de modo ou de avanço.
+# Linhas não ASCII sempre passam pela leitura completa.
+_SCAN_COMMENT_RE = re.compile(r'\([^)\n]*\)?|;[^\n]*')  # _COMMENT_RE sem atravessar linhas
+_SCAN_MODE_LINE_RE = re.compile(r'[Gg](?![^\S\n]*\+?0*[123](?:\.0*)?(?![\d.]))')
+_SCAN_MODE_LINE_UNICODE_RE = re.compile(r'[\x80-\U0010ffff]|' + _SCAN_MODE_LINE_RE.pattern)
+_SCAN_CYCLE_LINE_RE = re.compile(r'[GFRZQPLKgfrzqplk\x80-\U0010ffff]')
+_SCAN_STATE_RE = re.compile(r'[GFRZQPLKgfrzqplk]')
+_SCAN_MODE_RE = re.compile(r'([GFZgfz])[^\S\n]*([-+]?(?:\d+\.?\d*|\.\d+))')
+_SCAN_X_RE = re.compile(r'[Xx][^\S\n]*([-+]?(?:\d+\.?\d*|\.\d+))')
+_SCAN_Y_RE = re.compile(r'[Yy][^\S\n]*([-+]?(?:\d+\.?\d*|\.\d+))')
+_SCAN_F_RE = re.compile(r'[Ff][^\S\n]*([-+]?(?:\d+\.?\d*|\.\d+))')
+_SCAN_XY_RE = re.compile(r'([XYxy])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_SCAN_BREAK_RE = re.compile('[\x0b\x0c\x1c-\x1e\x85\u2028\u2029]')  # Quebras de str.splitlines além de LF e CR
+_SCAN_MOTION_CODES = frozenset((0, 1, 2, 3))
+
+def _has_other_line_breaks(text):
+    """Verdadeiro se text tem quebras de linha que str.splitlines separa além de LF e CR+LF."""
+    if '\r' in text and text.count('\r') != text.count('\r\n'):
+        return True
+    if text.isascii():
+        return any(char in text for char in '\x0b\x0c\x1c\x1d\x1e')
+    return _SCAN_BREAK_RE.search(text) is not None
+
+def _last_word(pattern, letter, text, start, end):
+    """Valor da última palavra letter (maiúscula ou minúscula) em text[start:end], ou None."""
+    index = end
+    while True:
+        index = max(text.rfind(letter, start, index), text.rfind(letter.lower(), start, index))
+        if index < 0:
+            return None
+        match = pattern.match(text, index, end)
+        if match:
+            return float(match.group(1))
+
+class ModalState:
+    """Estado modal da linearização: retração, altura inicial, posição e ciclo enlatado ativo."""
+
+    def __init__(self):
+        self.retract_mode = 'G98'
+        self.initial_z = 15.0  # Altura Z segura padrão
+        self.incremental = False  # G91
+        self.x = None  # Posição XY atual (None enquanto desconhecida)
+        self.y = None
+        self.feed = None
+        self.cycle = None  # Código do ciclo ativo (G73-G89) ou None
+        self.cycle_words = {}  # R, Z, Q, P como escritos no programa
+        self.cycle_params = {}  # Parâmetros absolutos prontos para a expansão
+        self.cycle_incremental = False  # Modo G90/G91 em que cycle_params foi resolvido
+
+    def __eq__(self, other):
+        return isinstance(other, ModalState) and vars(self) == vars(other)
+
+    def apply(self, block):
+        """Aplica um bloco ao estado; retorna o ciclo a executar, 80 no G80 ou None."""
+        g_codes = block.g_codes
+        params = block.params
+
+        if 98 in g_codes:
+            self.retract_mode = 'G98'
+        elif 99 in g_codes:
+            self.retract_mode = 'G99'
+        if 90 in g_codes:
+            self.incremental = False
+        elif 91 in g_codes:
+            self.incremental = True
+        if 'F' in params:
+            self.feed = params['F']
+
+        # Captura a altura Z inicial segura a partir de movimentos G0 Z isolados
+        if 0 in g_codes and 'Z' in params and 'X' not in params and 'Y' not in params \
+                and not self.incremental:
+            self.initial_z = params['Z']
+
+        motion = None
+        for g in g_codes:
+            if g in CYCLE_TEMPLATES or g in _CYCLE_CANCEL_CODES:
+                motion = g
+                break
+
+        if motion in _CYCLE_CANCEL_CODES:
+            self.cycle = None
+            self.cycle_words = {}
+            self.cycle_params = {}
+            self._move(params)  # "G80 G0 X10 Y10" ainda move
+            return 80 if motion == 80 else None
+        previous_cycle = self.cycle
+        if motion is not None:
+            self.cycle = motion
+        elif self.cycle is None or not ('X' in params or 'Y' in params or 'Z' in params or 'R' in params):
+            self._move(params)
+            return None
+
+        # Bloco de ciclo: a definição só é recalculada quando alguma palavra dela (ou o
+        # avanço modal, que pode ter mudado numa linha F solta) muda, ou quando outro
+        # ciclo passa a usá-la (G81 -> G83 precisa de Q)
+        changed = self.cycle != previous_cycle or self.incremental != self.cycle_incremental \
+            or self.feed != self.cycle_params.get('F')
+        cycle_words = self.cycle_words
+        for word in _CYCLE_WORDS[:-1]:
+            if word in params and cycle_words.get(word) != params[word]:
+                cycle_words[word] = params[word]
+                changed = True
+        if changed or not self.cycle_params:
+            # Definição nova (ou vazia depois do G80): validada antes de qualquer furo ser expandido
+            self._resolve_cycle()
+            errors = _cycle_errors(self.cycle, self.cycle_params)
+            if errors:
+                self.cycle_params = {}
+                raise ValueError(f"Linha {block.line_number}: {'; '.join(errors)}")
+        return self.cycle
+
+    def _resolve_cycle(self):
+        """Converte R e Z do ciclo para coordenadas absolutas (em G91, R é relativo à altura inicial e Z ao plano R)."""
+        params = dict(self.cycle_words)
+        if self.incremental:
+            if 'R' in params:
+                params['R'] = self.initial_z + params['R']
+                if 'Z' in params:
+                    params['Z'] = params['R'] + params['Z']
+        if self.feed is not None:
+            params['F'] = self.feed
+        self.cycle_params = params
+        self.cycle_incremental = self.incremental
+
+    def _move(self, params):
+        """Atualiza a posição XY a partir das palavras X e Y de um bloco."""
+        if self.incremental:
+            if 'X' in params and self.x is not None:
+                self.x += params['X']
+            if 'Y' in params and self.y is not None:
+                self.y += params['Y']
+        else:
+            self.x = params.get('X', self.x)
+            self.y = params.get('Y', self.y)
+
+    def holes(self, block):
+        """Posições dos furos de um bloco de ciclo, respeitando L/K (repetições) e G91."""
+        params = block.params
+        repeat = int(params.get('L', params.get('K', 1)))
+        positions = []
+        for _ in range(repeat):
+            if self.incremental:
+                if self.x is None or self.y is None:
+                    raise ValueError(f"Linha {block.line_number}: posição inicial desconhecida para o ciclo incremental (G91)")
+                self.x += params.get('X', 0.0)
+                self.y += params.get('Y', 0.0)
+            else:
+                self.x = params.get('X', self.x)
+                self.y = params.get('Y', self.y)
+                if self.x is None or self.y is None:
+                    raise ValueError(f"Linha {block.line_number}: posição X/Y do furo não definida")
+            positions.append((self.x, self.y))
+        return positions
+
+    def retract_z(self):
+        """Altura de retração ao fim de cada furo: altura inicial em G98, plano R em G99."""
+        return self.initial_z if self.retract_mode == 'G98' else self.cycle_params.get('R')
+
+    def scan(self, text, first_line_number=1):
+        """Avança o estado por um trecho de texto sem gerar saída; retorna quantas linhas ele tem.
+
+        É a primeira passada (serial) da conversão em blocos, então só acompanha o
+        estado: os comentários saem de uma vez, as linhas que podem mudar algo além
+        da posição e do avanço são achadas por busca de expressão regular e
+        aplicadas uma a uma e, nos trechos entre elas, em G90, só a última palavra X,
+        a última Y e o último F contam, sem ler linha por linha. O texto deve
+        terminar num fim de linha (ou no fim da entrada).
+        """
+        if not text:
+            return 0
+        if _has_other_line_breaks(text):
+            lines = text.splitlines()
+            for line_number, line in enumerate(lines, first_line_number):
+                self._scan_line(line, line_number)
+            return len(lines)
+        line_count = text.count('\n') + (not text.endswith('\n'))
+        if '(' in text or ';' in text:
+            text = _SCAN_COMMENT_RE.sub(' ', text)  # Comentários não mudam o estado
+        mode_pattern = _SCAN_MODE_LINE_RE if text.isascii() else _SCAN_MODE_LINE_UNICODE_RE
+        position = 0
+        line_number = first_line_number  # Linha que começa em position
+        while True:
+            match = (mode_pattern if self.cycle is None else _SCAN_CYCLE_LINE_RE).search(text, position)
+            start = len(text) if match is None else text.rfind('\n', 0, match.start()) + 1
+            if start > position:
+                if not self.incremental and self._moves_only():
+                    self._scan_position(text, position, start)
+                else:
+                    for offset, line in enumerate(text[position:start].splitlines()):
+                        self._scan_line(line, line_number + offset)
+            if match is None:
+                break
+            line_number += text.count('\n', position, start)
+            end = text.find('\n', match.start())
+            if end < 0:
+                end = len(text)
+            self._scan_line(text[start:end], line_number)
+            position = end + 1
+            line_number += 1
+        return line_count
+
+    def _moves_only(self):
+        """Verdadeiro se uma linha só com X/Y apenas muda a posição (sem recalcular o ciclo nem erro)."""
+        if self.cycle is None:
+            return True
+        return self.x is not None and self.y is not None and bool(self.cycle_params) \
+            and self.feed == self.cycle_params.get('F') and self.incremental == self.cycle_incremental
+
+    def _scan_position(self, text, start, end):
+        """Aplica a última palavra X, a última Y e o último F de um trecho que só move (em G90)."""
+        params = {}
+        x = _last_word(_SCAN_X_RE, 'X', text, start, end)
+        if x is not None:
+            params['X'] = x
+        y = _last_word(_SCAN_Y_RE, 'Y', text, start, end)
+        if y is not None:
+            params['Y'] = y
+        if params:
+            self._move(params)
+        feed = _last_word(_SCAN_F_RE, 'F', text, start, end)
+        if feed is not None:
+            self.feed = feed
+
+    def _scan_words(self, line):
+        """Aplica as palavras X e Y de uma única linha (a última de cada letra vence)."""
+        words = _SCAN_XY_RE.findall(line)
+        if words:
+            self._move({letter.upper(): float(value) for letter, value in words})
+
+    def _scan_line(self, line, line_number):
+        """Aplica uma linha na passada de estado, tokenizando só quando ela define ou cancela algo."""
+        if '(' in line or ';' in line:
+            line = _COMMENT_RE.sub(' ', line)
+        if line.isascii():
+            if _SCAN_STATE_RE.search(line) is None:
+                if self._moves_only():
+                    self._scan_words(line)
+                    return
+            elif self.cycle is None:
+                # G0-G3 ou palavras soltas fora de ciclo: só o avanço, a posição e a altura do G0 Z contam
+                g_codes = []
+                feed = z = None
+                for letter, value in _SCAN_MODE_RE.findall(line):
+                    if letter in 'Gg':
+                        g_codes.append(float(value))
+                    elif letter in 'Ff':
+                        feed = float(value)
+                    else:
+                        z = float(value)
+                if _SCAN_MOTION_CODES.issuperset(g_codes):
+                    if feed is not None:
+                        self.feed = feed
+                    words = _SCAN_XY_RE.findall(line)
+                    if words:
+                        self._move({letter.upper(): float(value) for letter, value in words})
+                    elif 0 in g_codes and z is not None and not self.incremental:
+                        self.initial_z = z
+                    return
+        block = tokenize_gcode_line(line, line_number)
+        if block is None or not block.params:
+            return
+        cycle = self.apply(block)
+        if cycle is not None and cycle != 80:
+            self.holes(block)
+
+def _linear_header(spindle_speed):
+    """Rotina de inicialização segura da conversão linear."""
+    return ("; ========================================\n"
+            "; Rotina de Inicialização\n"
+            "; ========================================\n"
+            "G21 ; Modo métrico (mm)\n"
+            "G90 ; Modo absoluto\n"
+            "G94 ; Avanço em mm/min\n"
+            "G17 ; Plano XY\n"
+            f"M3 S{spindle_speed} ; Liga spindle a {spindle_speed} RPM\n"
+            "G4 P2.0 ; Aguarda 2 segundos para estabilizar\n"
+            "; ========================================\n"
+            "\n")
+
+def iter_convert_gcode_text(lines, spindle_speed=None, template_cache=None, stats=None, optimizer=None):
+    """Gera, linha a linha, o G-code com os ciclos G73-G89 expandidos.
+
+    Sem spindle_speed, a velocidade é resolvida durante a própria passagem (primeiro S).
+    Com optimizer (HoleOrderOptimizer), os furos de cada grupo saem reordenados.
+    """
+    if template_cache is None:
+        template_cache = CycleTemplateCache()
+    if spindle_speed is not None:
+        yield _linear_header(spindle_speed)
+        yield from _iter_linear_body(lines, template_cache, stats, optimizer)
+    else:
+        probe = _SpindleProbe(lines)
+        yield from _iter_with_deferred_header(
+            _linear_header, _iter_linear_body(probe, template_cache, stats, optimizer), probe)
+
+def _iter_linear_body(lines, template_cache, stats=None, optimizer=None):
+    """Corpo da conversão linear seguido da rotina de retorno seguro."""
+    state = ModalState()
+    if optimizer is not None:
+        # Os tempos por etapa de stats não são separados aqui; o optimizer mede o seu
+        yield from _iter_linear_blocks_optimized(tokenize_gcode(lines), state, template_cache, optimizer)
+    else:
+        yield from _iter_linear_blocks(lines, state, template_cache, stats=stats)
+    
+    # Adiciona rotina de retorno seguro ao final
+    yield _safe_return_footer(state.initial_z)
+
+def _iter_linear_blocks(lines, state, template_cache, first_line_number=1, stats=None):
+    """Lineariza as linhas a partir do estado modal informado (atualizado no lugar)."""
+    if stats is not None:
+        yield from _iter_linear_blocks_profiled(lines, state, template_cache, first_line_number, stats)
+        return
+    for block in tokenize_gcode(lines, first_line_number):
+        yield _linear_block_output(block, state, template_cache)
+
+def _iter_linear_blocks_profiled(lines, state, template_cache, first_line_number, stats):
+    """_iter_linear_blocks medindo cada etapa e contando os ciclos expandidos (mesma saída)."""
+    clock = time.perf_counter
+    for line_number, line in enumerate(lines, first_line_number):
+        start = clock()
+        block = tokenize_gcode_line(line, line_number)
+        stats.add_time('tokenizacao', clock() - start)
+        if block is not None:
+            yield _linear_block_output_profiled(block, state, template_cache, stats)
+
+def _linear_block_output(block, state, template_cache):
+    """Saída linearizada de um bloco tokenizado (atualiza o estado modal)."""
+    # Comentários de linha inteira e blocos sem palavras passam sem alteração
+    if not block.params:
+        return block.text + '\n'
+
+    cycle = state.apply(block)
+    if cycle is None:
+        return block.text + '\n'
+    if cycle == 80:
+        return _g80_output(block)
+
+    # Cada furo reutiliza o modelo compilado do ciclo; só X e Y mudam
+    render = template_cache.get(cycle, state.cycle_params, state.retract_z())
+    output = "".join([render(x, y) for x, y in state.holes(block)])
+    if state.incremental:
+        output = _INCREMENTAL_ENTER + output + _INCREMENTAL_EXIT
+    return output
+
+def _linear_block_output_profiled(block, state, template_cache, stats):
+    """_linear_block_output separando estado modal, modelos e formatação nos tempos de stats."""
+    if not block.params:
+        return block.text + '\n'
+    clock = time.perf_counter
+    start = clock()
+    cycle = state.apply(block)
+    if cycle is None or cycle == 80:
+        stats.add_time('estado modal', clock() - start)
+        return block.text + '\n' if cycle is None else _g80_output(block)
+    holes = state.holes(block)
+    resolved = clock()
+    render = template_cache.get(cycle, state.cycle_params, state.retract_z())
+    compiled = clock()
+    output = "".join([render(x, y) for x, y in holes])
+    if state.incremental:
+        output = _INCREMENTAL_ENTER + output + _INCREMENTAL_EXIT
+    stats.add_time('estado modal', resolved - start)
+    stats.add_time('modelos', compiled - resolved)
+    stats.add_time('formatacao', clock() - compiled)
+    stats.count_cycle(cycle, len(holes), output.count('\n'))
+    return output
+
+_G80_NOTE = "; G80 ignorado (ciclo cancelado manualmente)\n"
+
+def _g80_output(block):
+    """Saída de um bloco com G80: a nota só quando o G80 está sozinho na linha (além de N).
+
+    Com outras palavras ("G17 G40 G80 G90", "G91 G28 Z0 G80", "G80 G0 X10"), o ciclo
+    é cancelado no estado modal e a linha passa sem alteração.
+    """
+    if len(block.g_codes) == 1 and block.params.keys() <= {'G', 'N'}:
+        return _G80_NOTE
+    return block.text + '\n'
+_INCREMENTAL_ENTER = "G90 ; Furos expandidos em coordenadas absolutas\n"
+_INCREMENTAL_EXIT = "G91 ; Retorna ao modo incremental\n"
+
+def convert_gcode_text(gcode_text, stats=None, optimizer=None, compactor=None):
+    """Converte o texto do G-code, expandindo ciclos G73-G89."""
+    if stats is not None:
+        return _compacted(_convert_text_profiled(_linear_converter(optimizer), gcode_text, stats), compactor)
+    return _compacted(iter_convert_gcode_text(iter_gcode_lines(gcode_text), optimizer=optimizer), compactor)
+
+CONVERTERS = {
+    'linear': iter_convert_gcode_text,
+    'mach3': iter_convert_gcode_for_mach3,
+}
+
+def _linear_converter(optimizer):
+    """iter_convert_gcode_text com o optimizer já ligado (mesma assinatura de CONVERTERS)."""
+    if optimizer is None:
+        return iter_convert_gcode_text
+    return lambda lines, **options: iter_convert_gcode_text(lines, optimizer=optimizer, **options)
+
+# --- Otimização da ordem dos furos (conversão linear) ---
+def _hole_grid(xs, ys, nodes, per_cell=2.0):
+    """Grade espacial uniforme: {(coluna, linha): [nós]}, com cerca de per_cell nós por célula.
+
+    Retorna também o lado da célula e a origem (canto inferior esquerdo) da grade.
+    """
+    min_x, max_x = min(xs[node] for node in nodes), max(xs[node] for node in nodes)
+    min_y, max_y = min(ys[node] for node in nodes), max(ys[node] for node in nodes)
+    width, height = max_x - min_x, max_y - min_y
+    if width > 0 and height > 0:
+        cell = math.sqrt(width * height * per_cell / len(nodes))
+    else:
+        cell = max(width, height) * per_cell / len(nodes) or 1.0
+    grid = {}
+    for node in nodes:
+        grid.setdefault((int((xs[node] - min_x) // cell), int((ys[node] - min_y) // cell)), []).append(node)
+    return grid, cell, (min_x, min_y)
+
+def _ring(cx, cy, r):
+    """Células no anel de raio r (distância de Chebyshev) em volta de (cx, cy)."""
+    if r == 0:
+        yield cx, cy
+        return
+    for i in range(cx - r, cx + r + 1):
+        yield i, cy - r
+        yield i, cy + r
+    for j in range(cy - r + 1, cy + r):
+        yield cx - r, j
+        yield cx + r, j
+
+def _ring_block(cx, cy, r):
+    """Células a até r de distância de Chebyshev de (cx, cy)."""
+    for i in range(r + 1):
+        yield from _ring(cx, cy, i)
+
+def _nearest_neighbour_path(xs, ys, first, last, nodes):
+    """Caminho guloso de first a last pelos nós, sempre para o nó livre mais próximo.
+
+    Os nós livres ficam numa grade espacial; a busca abre anéis de células em volta
+    da posição atual e para quando nenhum anel seguinte pode ter nó mais próximo.
+    Quando restam poucas células ocupadas, elas são percorridas diretamente.
+    """
+    grid, cell, (min_x, min_y) = _hole_grid(xs, ys, nodes)
+    path = [first]
+    x, y = xs[first], ys[first]
+    for _ in range(len(nodes)):
+        cx, cy = int((x - min_x) // cell), int((y - min_y) // cell)
+        best = best_d = best_key = None
+        r = 0
+        while best is None or best_d > (r - 1) * cell:
+            if 8 * r >= len(grid):
+                keys = list(grid)  # Mais barato olhar todas as células ocupadas
+            else:
+                keys = [key for key in _ring(cx, cy, r) if key in grid]
+            for key in keys:
+                for node in grid[key]:
+                    d = math.hypot(xs[node] - x, ys[node] - y)
+                    if best is None or d < best_d:
+                        best, best_d, best_key = node, d, key
+            if 8 * r >= len(grid):
+                break
+            r += 1
+        members = grid[best_key]
+        members.remove(best)
+        if not members:
+            del grid[best_key]
+        path.append(best)
+        x, y = xs[best], ys[best]
+    path.append(last)
+    return path
+
+def _neighbour_lists(xs, ys, nodes, count):
+    """Os count vizinhos mais próximos de cada nó, do mais perto para o mais longe.
+
+    Com count / 2 nós por célula, os vizinhos de quase todos os nós estão no bloco
+    3x3 de células em volta da célula deles, montado uma vez por célula; os demais
+    (bordas e regiões esparsas) olham blocos maiores até ter certeza.
+    """
+    grid, cell, (min_x, min_y) = _hole_grid(xs, ys, nodes, per_cell=max(count / 2, 1.0))
+    reach = max(max(key[0] for key in grid), max(key[1] for key in grid)) + 1
+    hypot = math.hypot
+    neighbours = {}
+    for (cx, cy), members in grid.items():
+        blocks = {}  # raio -> (nós, xs, ys) do bloco de células em volta desta
+        for node in members:
+            x, y = xs[node], ys[node]
+            r = 1
+            while True:
+                if r not in blocks:
+                    block = [other for key in _ring_block(cx, cy, r) for other in grid.get(key, ())]
+                    blocks[r] = block, [xs[other] for other in block], [ys[other] for other in block]
+                block, block_xs, block_ys = blocks[r]
+                distances = list(map(hypot, [v - x for v in block_xs], [v - y for v in block_ys]))
+                ranked = sorted(range(len(block)), key=distances.__getitem__)[:count + 1]
+                # Nós fora do bloco estão pelo menos à distância do nó até a borda do bloco
+                margin = min(x - min_x - (cx - r) * cell, (cx + r + 1) * cell - (x - min_x),
+                             y - min_y - (cy - r) * cell, (cy + r + 1) * cell - (y - min_y))
+                if r > reach or (len(ranked) > count and distances[ranked[count]] <= margin):
+                    break
+                r += 1
+            neighbours[node] = [block[i] for i in ranked if block[i] != node][:count]
+    return neighbours
+
+def _two_opt(tour, xs, ys, neighbours, fixed, max_reversal):
+    """Melhora o ciclo tour no lugar com movimentos 2-opt restritos às listas de vizinhos.
+
+    Arestas que tocam o nó fixed (que não tem coordenadas) nunca são trocadas. Cada
+    nó volta à fila só quando uma aresta dele muda (don't-look bits), e movimentos
+    que invertem mais de max_reversal nós são ignorados, o que limita o custo total
+    em grupos com dezenas de milhares de furos.
+    """
+    size = len(tour)
+    position = [0] * (max(tour) + 1)
+    for i, node in enumerate(tour):
+        position[node] = i
+    pending = deque(tour)
+    queued = set(tour)
+    dist = lambda a, b: math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    def reverse(i, j):
+        # Inverte o trecho cíclico tour[i..j]; se o complemento for menor, inverte ele
+        if 2 * ((j - i) % size + 1) > size:
+            i, j = (j + 1) % size, (i - 1) % size
+        if i <= j:
+            segment = tour[i:j + 1]
+            segment.reverse()
+            tour[i:j + 1] = segment
+            indices = range(i, j + 1)
+        else:
+            segment = tour[i:] + tour[:j + 1]
+            segment.reverse()
+            tour[i:] = segment[:size - i]
+            tour[:j + 1] = segment[size - i:]
+            indices = itertools.chain(range(i, size), range(j + 1))
+        # Atualiza as posições sem laço em Python (trechos longos são comuns partindo do caminho guloso)
+        deque(map(position.__setitem__, segment, indices), maxlen=0)
+
+    while pending:
+        a = pending.popleft()
+        queued.discard(a)
+        if a == fixed:
+            continue
+        for step in (1, -1):
+            b = tour[(position[a] + step) % size]
+            if b == fixed:
+                continue
+            d_ab = dist(a, b)
+            for c in neighbours[a]:
+                d_ac = dist(a, c)
+                if d_ac >= d_ab:
+                    break
+                d = tour[(position[c] + step) % size]
+                if d == fixed or c == b or d == a:
+                    continue
+                delta = d_ac + dist(b, d) - d_ab - dist(c, d)
+                if delta >= -1e-9:
+                    continue
+                # Para frente: a b ... c d -> a c ... b d; para trás: d c ... b a -> d b ... c a
+                i, j = (position[b], position[c]) if step == 1 else (position[c], position[b])
+                if min((j - i) % size + 1, size - (j - i) % size - 1) > max_reversal:
+                    continue
+                reverse(i, j)
+                for node in (a, b, c, d):
+                    if node not in queued:
+                        queued.add(node)
+                        pending.append(node)
+                break
+            else:
+                continue
+            break
+
+def _path_length(points, order, start=None):
+    """Comprimento do percurso XY pelos furos na ordem dada, a partir de start (se conhecido)."""
+    if not order:
+        return 0.0
+    total = 0.0
+    x, y = start if start is not None else points[order[0]]
+    for i in order:
+        hole_x, hole_y = points[i]
+        total += math.hypot(hole_x - x, hole_y - y)
+        x, y = hole_x, hole_y
+    return total
+
+class HoleOrderOptimizer:
+    """Reordena os furos de cada grupo de ciclo para encurtar os deslocamentos rápidos em XY.
+
+    Como ConversionStats, é opcional: passado como optimizer=HoleOrderOptimizer() à
+    conversão linear, os furos seguidos de um mesmo ciclo (mesmo código, mesmos
+    R/Z/Q/P/F e mesma altura de retração) são juntados num grupo e reordenados;
+    qualquer outra linha, um G80, uma troca de ferramenta ou de G98/G99 fecha o
+    grupo. Dentro do grupo todo furo retrai à mesma altura, então só o percurso XY
+    muda. O primeiro furo parte da posição anterior ao grupo e o último furo do
+    grupo continua sendo o último, para que as linhas seguintes (inclusive as
+    incrementais) partam do mesmo ponto. A ordem nova nunca é mais longa que a
+    original. Várias conversões podem somar no mesmo objeto.
+    """
+
+    # Nós invertidos por movimento 2-opt: REVERSAL_BUDGET / nº de furos, no mínimo MIN_REVERSAL
+    REVERSAL_BUDGET = 10 ** 8
+    MIN_REVERSAL = 1000
+
+    def __init__(self, neighbours=8, max_reversal=None):
+        self.neighbours = neighbours
+        self.max_reversal = max_reversal
+        self.groups = 0
+        self.holes = 0
+        self.rapid_before = 0.0  # Percurso XY entre furos (mm) na ordem original
+        self.rapid_after = 0.0
+        self.seconds = 0.0
+
+    def optimize(self, points, start=None):
+        """Ordem (índices de points) em que os furos de um grupo devem ser feitos.
+
+        start é a posição XY antes do grupo; se for desconhecida, o primeiro furo
+        também fica no lugar.
+        """
+        began = time.perf_counter()
+        count = len(points)
+        order = list(range(count))
+        before = _path_length(points, order, start)
+        after = before
+        if count > 2:
+            # Nós: furos 0..count-1, a posição inicial (count) e o nó fixo que fecha o ciclo
+            xs = [x for x, _ in points]
+            ys = [y for _, y in points]
+            first = 0
+            if start is not None:
+                xs.append(start[0])
+                ys.append(start[1])
+                first = count
+            last = count - 1
+            fixed = count + 1
+            free = [node for node in range(count - 1) if node != first]
+            path = _nearest_neighbour_path(xs, ys, first, last, free)
+            original = [first] + free + [last]
+            nodes = list(zip(xs, ys))
+            if _path_length(nodes, path) > _path_length(nodes, original):
+                path = original
+            tour = path + [fixed]
+            max_reversal = self.max_reversal or max(self.REVERSAL_BUDGET // count, self.MIN_REVERSAL)
+            _two_opt(tour, xs, ys, _neighbour_lists(xs, ys, free + [first, last], self.neighbours),
+                     fixed, max_reversal)
+            # Lê o ciclo a partir do nó fixo, no sentido em que vem o nó inicial
+            k = tour.index(fixed)
+            path = tour[k + 1:] + tour[:k]
+            if path[0] != first:
+                path.reverse()
+            candidate = [node for node in path if node < count]
+            length = _path_length(points, candidate, start)
+            if length < before:
+                order, after = candidate, length
+        self.groups += 1
+        self.holes += count
+        self.rapid_before += before
+        self.rapid_after += after
+        self.seconds += time.perf_counter() - began
+        return order
+
+    def merge(self, report):
+        """Soma um relatório (report()) de outra conversão, por exemplo de outro processo."""
+        self.groups += report['groups']
+        self.holes += report['holes']
+        self.rapid_before += report['rapid_before']
+        self.rapid_after += report['rapid_after']
+        self.seconds += report['seconds']
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        return {
+            'groups': self.groups,
+            'holes': self.holes,
+            'rapid_before': self.rapid_before,
+            'rapid_after': self.rapid_after,
+            'seconds': self.seconds,
+        }
+
+    def format(self):
+        """Resumo em texto: grupos, furos e o percurso rápido antes e depois."""
+        saved = 100 * (1 - self.rapid_after / self.rapid_before) if self.rapid_before else 0.0
+        return (f"Ordem dos furos: {self.groups} grupos, {self.holes} furos; "
+                f"deslocamento rápido XY {self.rapid_before:.1f} mm -> {self.rapid_after:.1f} mm "
+                f"(-{saved:.1f}%) em {self.seconds:.2f}s")
+
+# Furos renderizados por pedaço de saída de um grupo reordenado
+HOLE_GROUP_CHUNK = 4096
+
+def _iter_hole_group(holes, start, key, template_cache, optimizer):
+    """Saída de um grupo de furos na ordem escolhida pelo optimizer."""
+    cycle, params, retract_z, incremental = key
+    order = optimizer.optimize(holes, start)
+    render = template_cache.get(cycle, params, retract_z)
+    if incremental:
+        yield _INCREMENTAL_ENTER
+    for i in range(0, len(order), HOLE_GROUP_CHUNK):
+        yield "".join([render(*holes[k]) for k in order[i:i + HOLE_GROUP_CHUNK]])
+    if incremental:
+        yield _INCREMENTAL_EXIT
+
+def _iter_linear_blocks_optimized(blocks, state, template_cache, optimizer):
+    """_iter_linear_blocks sobre blocos já tokenizados, juntando os furos de cada grupo para reordená-los.
+
+    Em G91, o grupo inteiro fica entre um G90 e um G91, em vez de cada bloco.
+    """
+    key = start = None  # (ciclo, parâmetros, retração, G91) e posição antes do grupo
+    holes = []
+    for block in blocks:
+        if not block.params:
+            output = block.text + '\n'
+        else:
+            x, y = state.x, state.y
+            cycle = state.apply(block)
+            if cycle is not None and cycle != 80:
+                block_key = (cycle, state.cycle_params, state.retract_z(), state.incremental)
+                if block_key != key:
+                    if holes:
+                        yield from _iter_hole_group(holes, start, key, template_cache, optimizer)
+                        holes = []
+                    key = block_key
+                    start = (x, y) if x is not None and y is not None else None
+                holes.extend(state.holes(block))
+                continue
+            output = _g80_output(block) if cycle == 80 else block.text + '\n'
+        if holes:
+            yield from _iter_hole_group(holes, start, key, template_cache, optimizer)
+            holes = []
+        key = None
+        yield output
+    if holes:
+        yield from _iter_hole_group(holes, start, key, template_cache, optimizer)
+
+# --- Redução do tamanho da saída (pós-processamento opcional) ---
+# Linha de movimento simples, já sem comentários: só palavras G, X, Y, Z e F
+_SIMPLE_MOVE_RE = re.compile(r'(?:[GXYZF]\s*[-+]?(?:\d+\.?\d*|\.\d+)\s*)+', re.IGNORECASE)
+_MOVE_WORD_RE = re.compile(r'([GXYZF])\s*([-+]?(?:\d+\.?\d*|\.\d+))', re.IGNORECASE)
+# A mesma linha com as palavras na ordem da saída dos conversores (caminho rápido)
+_CANONICAL_MOVE_RE = re.compile(
+    r'(?:G\s*0*([01])(?![\d.])\s*)?(?:X\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*)?(?:Y\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*)?'
+    r'(?:Z\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*)?(?:F\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*)?', re.IGNORECASE)
+# Qualquer letra fora de G, X, Y, Z e F (evita o retrocesso de _SIMPLE_MOVE_RE em linhas comuns)
+_OTHER_LETTER_RE = re.compile(r'[A-EH-Wa-eh-w]')
+# Palavras de uma linha de ciclo enlatado que pode ser encurtada
+_CYCLE_LINE_LETTERS = frozenset('GXYZRQPF')
+# Códigos que invalidam a posição conhecida: G fora desta lista (e de G0-G3) e
+# trocas de ferramenta e subprogramas, que podem mover a máquina
+_POSITION_SAFE_G = frozenset((4, 17, 18, 19, 40, 80, 90, 91, 94, 98, 99))
+_POSITION_UNSAFE_M = frozenset((6, 98, 99))
+# Palavras que fazem uma linha depender do G0/G1 e do F modais
+_MOTION_LETTERS = frozenset('XYZABCIJKR')
+_AXIS_NAMES = 'XYZ'
+_MOTION_WORDS = ('G0', 'G1')
+
+def _trimmed(text):
+    """Número formatado sem zeros à direita nem ponto final ("-0" vira "0")."""
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def _continues(start, middle, end, single_axis):
+    """Se middle -> end segue na mesma reta e no mesmo sentido de start -> middle (em passos)."""
+    a = [m - s for m, s in zip(middle, start)]
+    b = [e - m for e, m in zip(end, middle)]
+    if a[1] * b[2] != a[2] * b[1] or a[2] * b[0] != a[0] * b[2] or a[0] * b[1] != a[1] * b[0]:
+        return False
+    if a[0] * b[0] + a[1] * b[1] + a[2] * b[2] <= 0:
+        return False
+    return not single_axis or sum(1 for delta in a if delta) == 1
+
+def _iter_line_batches(chunks):
+    """Listas das linhas completas (sem o \n) de pedaços de texto cortados em qualquer ponto."""
+    tail = ''
+    for chunk in chunks:
+        lines = chunk.split('\n')
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        if lines:
+            yield lines
+    if tail:
+        yield [tail]
+
+class OutputCompactor:
+    """Pós-processamento opcional que reduz o tamanho da saída sem mudar o movimento.
+
+    Como HoleOrderOptimizer, é passado às funções de conversão (compactor=
+    OutputCompactor()) e reescreve os movimentos simples da saída, as linhas só
+    com G0/G1 e X/Y/Z/F em G90:
+
+    - G0/G1 e F só aparecem quando mudam, e eixos que não mudam são omitidos
+    - as coordenadas são arredondadas à resolução da máquina, sem zeros à direita
+    - movimentos de comprimento zero são removidos
+    - movimentos seguidos, colineares e no mesmo sentido viram um só: G1 com o
+      mesmo F, e G0 só ao longo de um único eixo, porque muitos controladores não
+      fazem os rápidos em linha reta
+
+    Qualquer outra linha (arcos, ciclos, M/S/T, G90/G91, comentários) passa sem
+    alteração e interrompe a junção; se ela depender do G0/G1 ou do F omitidos
+    antes, eles são restabelecidos numa linha própria. Em G91 nada é reescrito.
+    Um G0 Z isolado define a altura inicial dos ciclos (ModalState): ele mantém o
+    G0, só se junta a outro G0 Z isolado e nenhum outro rápido sai como G0 Z isolado.
+    Com keep_comments=False, os comentários também são removidos. Várias
+    conversões podem somar no mesmo objeto.
+    """
+
+    def __init__(self, resolution=0.001, keep_comments=True):
+        if resolution <= 0:
+            raise ValueError("A resolução da máquina precisa ser positiva")
+        self.resolution = resolution
+        self.decimals = max(0, math.ceil(-math.log10(resolution) - 1e-9))
+        self.keep_comments = keep_comments
+        self.lines_in = 0
+        self.lines_out = 0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.moves_removed = 0  # Movimentos de comprimento zero
+        self.moves_merged = 0  # Movimentos absorvidos pelo anterior, colinear
+        self.seconds = 0.0
+
+    def compact(self, chunks):
+        """Gera a saída reduzida a partir de pedaços de G-code (cortados em qualquer ponto)."""
+        began = time.perf_counter()
+        resolution = self.resolution
+        keep_comments = self.keep_comments
+        number = f"%.{self.decimals}f"
+        # Caches limitados: as mesmas linhas de Z e F se repetem em todos os furos
+        parsed = {}  # Código -> (G, X, Y, Z em passos, F) dos movimentos simples; None nas outras linhas
+        formatted = {}  # Passos -> texto
+        # Estado do programa (o que foi lido) e do controlador (o que já foi gravado):
+        # G0/G1 e F só diferem depois de movimentos removidos ou de um F adiado num G0
+        position = [None, None, None]  # Em passos da resolução; None = desconhecida
+        motion = feed = absolute = None
+        emitted_motion = emitted_feed = None
+        cycle = None  # Palavras modais do ciclo enlatado ativo (G, R, Z, Q, P)
+        height = None  # Z (em passos) do último G0 Z isolado gravado; None = desconhecida
+        pending = None  # [G, F, início, fim, G0 Z isolado]: movimento retido para juntar ao seguinte
+        out = []
+
+        def emit_move(move_motion, move_feed, start, end, is_height, comment=''):
+            nonlocal emitted_motion, emitted_feed, height
+            words = [] if move_motion == emitted_motion and not is_height else [_MOTION_WORDS[move_motion]]
+            for axis in (0, 1, 2):
+                steps = end[axis]
+                if steps != start[axis] or is_height and axis == 2:
+                    text = formatted.get(steps)
+                    if text is None:
+                        if len(formatted) >= 65536:
+                            formatted.clear()
+                        text = formatted[steps] = _trimmed(number % (steps * resolution))
+                    words.append(_AXIS_NAMES[axis] + text)
+            if is_height:
+                height = end[2]
+            elif move_motion == 0 and words[0] == 'G0' and len(words) == 2 and words[1][0] == 'Z':
+                # Rápido só em Z sem G0 Z isolado na entrada: um eixo parado evita a nova altura inicial
+                if end[0] is not None:
+                    words.insert(1, 'X' + _trimmed(number % (end[0] * resolution)))
+                elif end[1] is not None:
+                    words.insert(1, 'Y' + _trimmed(number % (end[1] * resolution)))
+                else:
+                    out.append(words.pop(0))
+            if move_motion == 1 and move_feed != emitted_feed and move_feed is not None:
+                words.append('F' + _trimmed('%.6f' % move_feed))
+                emitted_feed = move_feed
+            emitted_motion = move_motion
+            if comment:
+                words.append(comment)
+            out.append(" ".join(words))
+
+        def drain():
+            text = "\n".join(out) + "\n"
+            self.lines_out += len(out)
+            self.chars_out += len(text)
+            out.clear()
+            return text
+
+        for lines in _iter_line_batches(chunks):
+            self.lines_in += len(lines)
+            self.chars_in += sum(map(len, lines)) + len(lines)
+            for line in lines:
+                if line[:1] == ';':  # Comentário de linha inteira (a maior parte dos da saída)
+                    if keep_comments:
+                        if pending is not None:
+                            emit_move(*pending)
+                            pending = None
+                        out.append(line.rstrip())
+                    continue
+                code, comment = line, ''
+                if ';' in line or '(' in line:
+                    match = _COMMENT_RE.search(line)
+                    code = _COMMENT_RE.sub('', line)
+                    comment = line[match.start():].strip() if keep_comments else ''
+                    if code[match.start():].strip():
+                        comment = None  # Código depois de um comentário: a linha não é reescrita
+                code = code.strip()
+                if not code:
+                    if comment:
+                        if pending is not None:
+                            emit_move(*pending)
+                            pending = None
+                        out.append(comment)
+                    continue
+
+                move_motion = None
+                if absolute and comment is not None:
+                    words = parsed.get(code, False)
+                    if words is False:
+                        words = self._parse_move(code)
+                        if len(parsed) >= 65536:
+                            parsed.clear()
+                        parsed[code] = words
+                    if words is not None:
+                        g, x, y, z, f = words
+                        move_motion = motion if g is None else g
+
+                if move_motion == 0 or move_motion == 1:
+                    # Movimento simples em G90
+                    motion = move_motion
+                    cycle = None
+                    if f is not None:
+                        feed = f
+                    is_height = g == 0 and x is None and y is None and z is not None
+                    end = list(position)
+                    if x is not None:
+                        end[0] = x
+                    if y is not None:
+                        end[1] = y
+                    if z is not None:
+                        end[2] = z
+                    if end == position and (not is_height or z == height):
+                        self.moves_removed += 1
+                        if comment:
+                            if pending is not None:
+                                emit_move(*pending)
+                                pending = None
+                            out.append(comment)
+                        continue
+                    if pending is not None and not comment and pending[0] == move_motion and \
+                            pending[4] == is_height and end != position and \
+                            (move_motion == 0 or pending[1] == feed) and \
+                            _continues(pending[2], position, end, move_motion == 0):
+                        pending[3] = end
+                        self.moves_merged += 1
+                    else:
+                        if pending is not None:
+                            emit_move(*pending)
+                            pending = None
+                        if comment or None in position or None in end or end == position:
+                            emit_move(move_motion, feed, position, end, is_height, comment)
+                        else:
+                            pending = [move_motion, feed, position, end, is_height]
+                    position = end
+                    continue
+
+                # Linha mantida; antes dela, G0/G1 e F omitidos são restabelecidos se preciso
+                if pending is not None:
+                    emit_move(*pending)
+                    pending = None
+                text = line.strip() if keep_comments else code
+                line_words = _WORD_RE.findall(code.upper())
+                g_codes = [float(value) for letter, value in line_words if letter == 'G']
+                letters = {letter for letter, _ in line_words}
+                if comment is not None and letters <= _CYCLE_LINE_LETTERS and len(letters) == len(line_words) \
+                        and (cycle is not None and not g_codes
+                             or len(g_codes) == 1 and 73 <= g_codes[0] <= 89 and g_codes[0] != 80):
+                    # Repetição de ciclo enlatado: G8x, R, Z, Q, P e F iguais aos modais são omitidos
+                    if cycle is None or g_codes and cycle['G'] != g_codes[0]:
+                        cycle = {}
+                    kept = []
+                    for letter, value in line_words:
+                        if letter == 'X' or letter == 'Y':
+                            kept.append(letter + value)
+                            continue
+                        value_number = float(value)
+                        if value_number != (feed if letter == 'F' else cycle.get(letter)):
+                            kept.append(letter + value)
+                        if letter != 'F':
+                            cycle[letter] = value_number
+                    if any(word[0] in 'XY' for word in kept):
+                        letters = {word[0] for word in kept}
+                        text = " ".join(kept + [comment] if comment else kept)
+                else:
+                    cycle = None
+                moves = bool(letters & _MOTION_LETTERS)
+                sets_motion = any(g in (0, 1, 2, 3) or 73 <= g <= 89 for g in g_codes)
+                # G80 e ciclos sem G0-G3 na linha: o G0/G1 omitido antes ainda vale depois deles
+                keeps_motion = not any(g in (0, 1, 2, 3) for g in g_codes)
+                if moves or sets_motion:
+                    sync = []
+                    if motion != emitted_motion and motion is not None and (not sets_motion or keeps_motion):
+                        sync.append(f"G{motion}")
+                        emitted_motion = motion
+                    if feed != emitted_feed and feed is not None and 'F' not in letters and 80 not in g_codes:
+                        sync.append('F' + _trimmed('%.6f' % feed))
+                        emitted_feed = feed
+                    if sync:
+                        out.append(" ".join(sync))
+                out.append(text)
+                for g in g_codes:
+                    if g in (0, 1, 2, 3):
+                        motion = int(g)
+                    elif 73 <= g <= 89:
+                        motion = None  # G80 ou ciclo enlatado: sem G0/G1 modal
+                    elif g == 90:
+                        absolute = True
+                    elif g == 91:
+                        absolute = False
+                if sets_motion:
+                    emitted_motion = motion
+                if 0 in g_codes and 'Z' in letters:
+                    height = None  # Pode ter sido um G0 Z isolado não reescrito
+                for letter, value in line_words:
+                    if letter == 'F':
+                        feed = emitted_feed = float(value)
+                if (motion is None and moves) or \
+                        any(g not in _POSITION_SAFE_G and g not in (0, 1, 2, 3) for g in g_codes) or \
+                        'M' in letters and any(letter == 'M' and float(value) in _POSITION_UNSAFE_M
+                                               for letter, value in line_words):
+                    position = [None, None, None]
+                elif moves:
+                    position = list(position)
+                    for letter, value in line_words:
+                        axis = _AXIS_NAMES.find(letter)
+                        if axis >= 0:
+                            position[axis] = round(float(value) / resolution) if absolute else None
+            if out:
+                yield drain()
+        if pending is not None:
+            emit_move(*pending)
+        if out:
+            yield drain()
+        self.seconds += time.perf_counter() - began
+
+    def _parse_move(self, code):
+        """(G, X, Y, Z em passos, F) de uma linha de movimento simples, com None nas palavras
+        ausentes; None se a linha tiver outras palavras ou palavras repetidas."""
+        match = _CANONICAL_MOVE_RE.fullmatch(code)
+        if match is not None:
+            g, x, y, z, f = match.groups()
+        elif not _OTHER_LETTER_RE.search(code) and _SIMPLE_MOVE_RE.fullmatch(code):
+            words = {}
+            for letter, value in _MOVE_WORD_RE.findall(code):
+                words.setdefault(letter.upper(), []).append(value)
+            if any(len(values) > 1 for values in words.values()):
+                return None
+            g, x, y, z, f = [words.get(letter, (None,))[0] for letter in 'GXYZF']
+            if g is not None and float(g) not in (0, 1):
+                return None
+        else:
+            return None
+        resolution = self.resolution
+        return (None if g is None else int(float(g)),
+                None if x is None else round(float(x) / resolution),
+                None if y is None else round(float(y) / resolution),
+                None if z is None else round(float(z) / resolution),
+                None if f is None else float(f))
+
+    def merge(self, report):
+        """Soma um relatório (report()) de outra conversão, por exemplo de outro processo."""
+        for key in ('lines_in', 'lines_out', 'chars_in', 'chars_out', 'moves_removed', 'moves_merged', 'seconds'):
+            setattr(self, key, getattr(self, key) + report[key])
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        return {
+            'resolution': self.resolution,
+            'lines_in': self.lines_in,
+            'lines_out': self.lines_out,
+            'chars_in': self.chars_in,
+            'chars_out': self.chars_out,
+            'moves_removed': self.moves_removed,
+            'moves_merged': self.moves_merged,
+            'seconds': self.seconds,
+        }
+
+    def format(self):
+        """Resumo em texto: tamanho antes e depois e os movimentos eliminados."""
+        saved = 100 * (1 - self.chars_out / self.chars_in) if self.chars_in else 0.0
+        return (f"Saída compactada (resolução {self.resolution:g}): {self.chars_in} -> {self.chars_out} caracteres "
+                f"(-{saved:.1f}%), {self.lines_in} -> {self.lines_out} linhas; "
+                f"{self.moves_removed} movimentos nulos removidos, {self.moves_merged} colineares juntados "
+                f"em {self.seconds:.2f}s")
+
+# --- Reconversão incremental (interface gráfica) ---
+def _line_speed(line):
+    """Primeira velocidade S de uma linha, ou None (mesmo critério de _SpindleProbe)."""
+    if 'S' in line.upper():
+        for subline in line.splitlines():
+            params = parse_gcode_params(subline)
+            if 'S' in params:
+                return int(params['S'])
+    return None
+
+class IncrementalConverter:
+    """Guarda a última conversão de um texto para refazer só as linhas editadas.
+
+    As linhas são as linhas físicas do editor. Para cada uma ficam guardadas a saída
+    e a velocidade S; na conversão linear, a cada CHECKPOINT_INTERVAL linhas, também
+    uma cópia do estado modal. Uma edição é reconvertida a partir do ponto de
+    controle anterior a ela e para assim que o estado volta a coincidir com o da
+    conversão antiga num ponto de controle: dali em diante a saída antiga continua
+    válida. Na conversão Mach3 a saída de uma linha não depende das anteriores,
+    então só as linhas editadas são refeitas.
+    """
+    CHECKPOINT_INTERVAL = 256
+    YIELD_INTERVAL = 256  # Linhas entre devoluções de controle dos geradores iter_*
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.lines = []
+        self.outputs = []
+        self.out_counts = []  # Linhas de saída geradas por linha de entrada
+        self.speeds = []
+        self.initial_zs = []  # Mach3: altura de cada linha G0 Z isolada (ou None)
+        self.checkpoint_lines = [0]  # Linear: índice da linha e estado modal antes dela
+        self.checkpoint_states = [ModalState()]
+        self.final_z = 15.0  # Linear: altura inicial ao fim do programa
+        self._template_cache = CycleTemplateCache()
+
+    def header(self):
+        speed = next((s for s in self.speeds if s is not None), 1000)
+        return _mach3_header(speed) if self.mode == 'mach3' else _linear_header(speed)
+
+    def footer(self):
+        if self.mode == 'mach3':
+            return _safe_return_footer(next((z for z in self.initial_zs if z is not None), 15.0))
+        return _safe_return_footer(self.final_z)
+
+    def output(self):
+        """Texto convertido completo, igual ao de CONVERTERS[mode] sobre as mesmas linhas."""
+        return self.header() + "".join(self.outputs) + self.footer()
+
+    def iter_convert(self, lines):
+        """Converte o texto inteiro (lista de linhas físicas) no lugar do anterior."""
+        return self.iter_update(0, len(self.lines), lines)
+
+    def update(self, start, old_end, new_lines):
+        """Troca as linhas [start, old_end) por new_lines; retorna as correções da saída."""
+        job = self.iter_update(start, old_end, new_lines)
+        while True:
+            try:
+                next(job)
+            except StopIteration as stop:
+                return stop.value
+
+    def iter_update(self, start, old_end, new_lines):
+        """Gerador de update(): devolve o controle a cada YIELD_INTERVAL linhas reconvertidas.
+
+        As correções são tuplas (linha inicial, nº de linhas, texto novo) em linhas de
+        saída (base 0) do texto convertido anterior, da última para a primeira, de modo
+        que aplicá-las em ordem não desloca as seguintes. Se a conversão falhar (por
+        exemplo, ValueError de um ciclo sem posição), nada é alterado.
+        """
+        old_header = self.header()
+        old_footer = self.footer()
+        if self.mode == 'mach3':
+            resume, old_stop = start, old_end
+            outputs, initial_zs = yield from self._iter_mach3_range(new_lines)
+        else:
+            resume, old_stop, outputs, commit_checkpoints = yield from self._iter_linear_range(
+                start, old_end, new_lines)
+
+        # Saídas iguais às antigas no começo e no fim do trecho reconvertido ficam fora da correção
+        new_body = outputs[start - resume:]
+        old_body = self.outputs[start:old_stop]
+        limit = min(len(new_body), len(old_body))
+        same_tail = 0
+        while same_tail < limit and new_body[-1 - same_tail] == old_body[-1 - same_tail]:
+            same_tail += 1
+        same_head = 0
+        while same_head < limit - same_tail and new_body[same_head] == old_body[same_head]:
+            same_head += 1
+        body_patch = "".join(new_body[same_head:len(new_body) - same_tail])
+        out_start = sum(self.out_counts[:start + same_head])
+        out_old_count = sum(self.out_counts[start + same_head:old_stop - same_tail])
+        body_lines = sum(self.out_counts)
+        header_lines = old_header.count('\n')
+
+        self.lines[start:old_end] = new_lines
+        self.speeds[start:old_end] = [_line_speed(line) for line in new_lines]
+        self.outputs[resume:old_stop] = outputs
+        self.out_counts[resume:old_stop] = [output.count('\n') for output in outputs]
+        if self.mode == 'mach3':
+            self.initial_zs[start:old_end] = initial_zs
+        else:
+            commit_checkpoints()
+
+        patches = []
+        new_footer = self.footer()
+        if new_footer != old_footer:
+            patches.append((header_lines + body_lines, old_footer.count('\n'), new_footer))
+        patches.append((header_lines + out_start, out_old_count, body_patch))
+        new_header = self.header()
+        if new_header != old_header:
+            patches.append((0, header_lines, new_header))
+        return patches
+
+    def _iter_mach3_range(self, new_lines):
+        """Converte só as linhas novas; devolve as saídas e as alturas Z de cada uma."""
+        outputs = []
+        initial_zs = []
+        for i, line in enumerate(new_lines, 1):
+            body = _iter_mach3_lines(line.splitlines() or ('',))
+            output = []
+            while True:
+                try:
+                    output.append(next(body))
+                except StopIteration as stop:
+                    initial_zs.append(stop.value)
+                    break
+            outputs.append("".join(output))
+            if i % self.YIELD_INTERVAL == 0:
+                yield
+        return outputs, initial_zs
+
+    def _iter_linear_range(self, start, old_end, new_lines):
+        """Reconverte a partir do ponto de controle anterior a start até o estado convergir."""
+        checkpoint_lines = self.checkpoint_lines
+        k = bisect.bisect_right(checkpoint_lines, start) - 1
+        resume = checkpoint_lines[k]
+        state = copy.deepcopy(self.checkpoint_states[k])
+        delta = len(new_lines) - (old_end - start)
+        new_end = start + len(new_lines)
+
+        # Pontos de controle antigos depois do trecho editado são os candidatos à convergência
+        candidate = max(bisect.bisect_left(checkpoint_lines, old_end), k + 1)
+        new_checkpoint_lines = []
+        new_checkpoint_states = []
+        outputs = []
+        converged = False
+        lines = itertools.chain(self.lines[resume:start], new_lines, itertools.islice(self.lines, old_end, None))
+        i = resume
+        for line in lines:
+            if i >= new_end:
+                while candidate < len(checkpoint_lines) and checkpoint_lines[candidate] + delta < i:
+                    candidate += 1
+                if candidate < len(checkpoint_lines) and checkpoint_lines[candidate] + delta == i \
+                        and state == self.checkpoint_states[candidate]:
+                    converged = True
+                    break
+            if i > resume and (i - resume) % self.CHECKPOINT_INTERVAL == 0:
+                new_checkpoint_lines.append(i)
+                new_checkpoint_states.append(copy.deepcopy(state))
+            output = []
+            for subline in line.splitlines() or ('',):
+                block = tokenize_gcode_line(subline, i + 1)
+                if block is not None:
+                    output.append(_linear_block_output(block, state, self._template_cache))
+            outputs.append("".join(output))
+            i += 1
+            if (i - resume) % self.YIELD_INTERVAL == 0:
+                yield
+
+        def commit_checkpoints():
+            if converged:
+                later_lines = [line + delta for line in checkpoint_lines[candidate:]]
+                later_states = self.checkpoint_states[candidate:]
+            else:
+                later_lines = later_states = []
+                self.final_z = state.initial_z
+            self.checkpoint_lines = checkpoint_lines[:k + 1] + new_checkpoint_lines + later_lines
+            self.checkpoint_states = self.checkpoint_states[:k + 1] + new_checkpoint_states + later_states
+
+        old_stop = i - delta if converged else len(self.lines)
+        return resume, old_stop, outputs, commit_checkpoints
+
+# --- Leitura de arquivos mapeados em memória ---
+def detect_encoding(data, limit=None):
+    """Codificação de um arquivo de G-code a partir dos bytes: 'utf-8' ou, se não for UTF-8 válido, 'latin-1'.
+
+    Pós-processadores de CAM brasileiros gravam comentários acentuados numa das
+    duas. Blocos só com ASCII são pulados sem decodificar; os demais passam por um
+    decodificador incremental, um bloco por vez. Com limit, só os primeiros limit
+    bytes são examinados (uma amostra rápida).
+    """
+    end = len(data) if limit is None else min(limit, len(data))
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for start in range(0, end, 1 << 20):
+            chunk = data[start:min(start + (1 << 20), end)]
+            if not chunk.isascii() or decoder.getstate()[0]:
+                decoder.decode(chunk)
+        decoder.decode(b'', final=end == len(data))
+    except UnicodeDecodeError:
+        return 'latin-1'
+    return 'utf-8'
+
+@contextmanager
+def mapped_input(path, encoding=None):
+    """Mapeia path em memória (somente leitura); devolve (dados, codificação informada ou detectada)."""
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            yield b'', encoding or 'utf-8'  # mmap não mapeia arquivos vazios
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data, encoding or detect_encoding(data)
+
+def iter_mapped_lines(data, encoding, start=0, end=None):
+    """Itera as linhas de data[start:end] (bytes ou mmap) como iter_gcode_lines, decodificando uma por vez."""
+    end = len(data) if end is None else end
+    while start < end:
+        next_start = data.find(b'\n', start, end) + 1 or end
+        yield from (data[start:next_start].decode(encoding).splitlines() or ('',))
+        start = next_start
+
+def _iter_mapped_text(data, encoding, start=0, end=None, size=1 << 20):
+    """Decodifica data[start:end] em pedaços de cerca de size bytes, cada um terminando num fim de linha."""
+    end = len(data) if end is None else end
+    while start < end:
+        next_start = data.find(b'\n', min(start + size, end) - 1, end) + 1 or end
+        yield data[start:next_start].decode(encoding)
+        start = next_start
+
+def convert_gcode_file(input_path, output_path, mode='linear', stats=None, optimizer=None, compactor=None):
+    """Converte um arquivo para outro em fluxo contínuo, com uso de memória constante.
+
+    A entrada é lida por mmap e a saída é gravada na codificação detectada nela.
+    Um programa tokenizado (ParsedProgram.save) também serve de entrada: é
+    convertido sem reler texto e a saída sai em UTF-8. optimizer (só no modo
+    linear) reordena os furos, retendo na memória um grupo de furos por vez;
+    compactor (OutputCompactor) reduz a saída antes de gravá-la.
+    Retorna o número de linhas lidas da entrada.
+    """
+    if optimizer is not None:
+        if mode != 'linear':
+            raise ValueError("A otimização da ordem dos furos só se aplica à conversão linear")
+        converter = _linear_converter(optimizer)
+    else:
+        converter = CONVERTERS[mode]
+    line_count = 0
+    output_lines = 0
+    start = time.perf_counter()
+
+    def counted(lines):
+        nonlocal line_count
+        for line_count, line in enumerate(lines, 1):
+            yield line
+
+    def counted_output(chunks):
+        nonlocal output_lines
+        for chunk in chunks:
+            output_lines += chunk.count('\n')
+            yield chunk
+
+    if is_program_file(input_path):
+        program = ParsedProgram.load(input_path)
+        try:
+            with atomic_output(output_path, encoding='utf-8') as f_out:
+                output = iter_convert_program(program, mode, stats, optimizer)
+                if compactor is not None:
+                    output = compactor.compact(output)
+                f_out.writelines(output if stats is None else counted_output(output))
+            line_count = program.line_numbers[-1] if len(program) else 0
+        finally:
+            program.close()
+    else:
+        with mapped_input(input_path) as (data, encoding), \
+                atomic_output(output_path, encoding=encoding) as f_out:
+            if stats is None:
+                output = converter(counted(iter_mapped_lines(data, encoding)))
+            else:
+                output = converter(counted(iter_mapped_lines(data, encoding)), stats=stats)
+            if compactor is not None:
+                output = compactor.compact(output)
+            f_out.writelines(output if stats is None else counted_output(output))
+    if stats is not None:
+        stats.record(time.perf_counter() - start, line_count, os.path.getsize(input_path),
+                     output_lines, os.path.getsize(output_path))
+    return line_count
+
+# --- Conversão de um único arquivo em blocos paralelos ---
+def _line_aligned_offsets(path, chunk_count):
+    """Divide o arquivo em até chunk_count faixas de bytes que começam sempre no início de uma linha."""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, chunk_count):
+            position = size * i // chunk_count
+            if position <= offsets[-1]:
+                continue
+            f.seek(position - 1)
+            f.readline()
+            position = f.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+def _write_all(f, chunks):
+    """Escreve todos os pedaços de um gerador e devolve o valor de retorno dele."""
+    while True:
+        try:
+            f.write(next(chunks))
+        except StopIteration as stop:
+            return stop.value
+
+def _convert_chunk(input_path, start, end, mode, state, first_line_number, encoding, chunk_path):
+    """Tarefa de um processo: converte uma faixa da entrada, sem cabeçalho nem rodapé, para chunk_path."""
+    line_count = 0
+
+    def counted(lines):
+        nonlocal line_count
+        for line_count, line in enumerate(lines, 1):
+            yield line
+
+    with mapped_input(input_path, encoding) as (data, _), open(chunk_path, 'w', encoding=encoding) as f_out:
+        probe = _SpindleProbe(counted(iter_mapped_lines(data, encoding, start, end)))
+        if mode == 'mach3':
+            initial_z = _write_all(f_out, _iter_mach3_lines(probe, first_line_number))
+        else:
+            f_out.writelines(_iter_linear_blocks(probe, state, CycleTemplateCache(), first_line_number))
+            initial_z = state.initial_z
+    return {'initial_z': initial_z, 'speed': probe.speed, 'lines': line_count}
+
+def convert_gcode_file_parallel(input_path, output_path, mode='linear', jobs=None, chunk_count=None):
+    """Converte um único arquivo grande em blocos processados em paralelo.
+
+    Uma primeira passada barata (ModalState.scan) registra o estado modal no início
+    de cada bloco; os blocos são convertidos por processos separados e emendados em
+    ordem, com saída idêntica byte a byte à de convert_gcode_file. Retorna o número
+    de linhas lidas da entrada.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = _line_aligned_offsets(input_path, chunk_count or jobs * 4)
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+
+    with tempfile.TemporaryDirectory(prefix='.conversor-blocos-', dir=output_dir) as tmp_dir, \
+            ProcessPoolExecutor(max_workers=jobs) as pool, mapped_input(input_path) as (data, encoding):
+        state = ModalState()
+        first_line_number = 1
+        futures = []
+        for i, (start, end) in enumerate(chunks):
+            # O bloco começa a ser convertido enquanto a passada de estado segue para o próximo
+            futures.append(pool.submit(_convert_chunk, input_path, start, end, mode, copy.deepcopy(state),
+                                       first_line_number, encoding, os.path.join(tmp_dir, f"{i}.part")))
+            if mode == 'linear' and i < len(chunks) - 1:
+                for text in _iter_mapped_text(data, encoding, start, end):
+                    first_line_number += state.scan(text, first_line_number)
+        results = [future.result() for future in futures]
+
+        speed = next((r['speed'] for r in results if r['speed'] is not None), 1000)
+        if mode == 'mach3':
+            header = _mach3_header(speed)
+            initial_z = next((r['initial_z'] for r in results if r['initial_z'] is not None), 15.0)
+        else:
+            header = _linear_header(speed)
+            initial_z = results[-1]['initial_z']
+
+        with atomic_output(output_path, 'wb') as f_out:
+            f_out.write(header.replace('\n', os.linesep).encode(encoding))
+            for i in range(len(chunks)):
+                with open(os.path.join(tmp_dir, f"{i}.part"), 'rb') as part:
+                    shutil.copyfileobj(part, f_out, 1 << 20)
+            f_out.write(_safe_return_footer(initial_z).replace('\n', os.linesep).encode(encoding))
+    return sum(r['lines'] for r in results)
+
+@contextmanager
+def atomic_output(path, mode='w', encoding=None):
+    """Abre um arquivo temporário ao lado de path e o renomeia para path só se tudo der certo."""
+    directory, name = os.path.split(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:12]}.tmp")
+    # Aberto fora do try: se nem o temporário puder ser criado, o erro original sobe sozinho
+    f = open(tmp_path, mode.replace('w', 'x'), encoding=encoding)
+    try:
+        with f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# --- Arquivos grandes: índice de linhas e conversão com mapa de linhas ---
+_NEWLINE_RE = re.compile(b'\n')
+
+# Arquivo auxiliar do índice: assinatura (com a ordem dos bytes), tamanho e mtime
+# da fonte, número de linhas e codificação, seguidos dos deslocamentos em array('Q')
+_SIDECAR_HEADER = struct.Struct('<8sQqQ16s')
+_SIDECAR_MAGIC = b'GCIDX1' + sys.byteorder[0].encode() + b'\0'
+
+class LineIndex:
+    """Arquivo mapeado em memória (mmap) com o deslocamento do início de cada linha.
+
+    As linhas são separadas por '\\n', como na leitura binária do arquivo. O índice
+    pode ser construído aos poucos (build) enquanto as primeiras linhas já são lidas;
+    nada além das linhas pedidas é decodificado. Com sidecar, o índice completo é
+    guardado ao lado do arquivo (.nome.idx) e reaproveitado enquanto o tamanho e a
+    data de modificação do arquivo não mudarem.
+    """
+    BUILD_CHUNK_BYTES = 4 * 1024 * 1024
+    ENCODING_SAMPLE_BYTES = 1024 * 1024  # Amostra usada até a detecção completa em build()
+
+    def __init__(self, path, encoding=None, sidecar=True):
+        self.path = path
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self.size = stat.st_size
+        self._mtime_ns = stat.st_mtime_ns
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self._fixed_encoding = encoding
+        self.encoding = encoding or detect_encoding(self._map, self.ENCODING_SAMPLE_BYTES)
+        directory, name = os.path.split(os.path.abspath(path))
+        self.sidecar_path = os.path.join(directory, f".{name}.idx") if sidecar else None
+        self.offsets = array('Q', [0])
+        self.indexed_bytes = 0
+        self.complete = False
+
+    def build(self, progress=None):
+        """Indexa o arquivo inteiro em blocos, chamando progress(fração) a cada bloco.
+
+        Se houver um índice guardado válido, ele é carregado no lugar da indexação.
+        """
+        if self._load_sidecar():
+            return self
+        if self._fixed_encoding is None:
+            self.encoding = detect_encoding(self._map)
+        offsets = self.offsets
+        for start in range(self.indexed_bytes, self.size, self.BUILD_CHUNK_BYTES):
+            end = min(start + self.BUILD_CHUNK_BYTES, self.size)
+            offsets.extend(match.end() for match in _NEWLINE_RE.finditer(self._map, start, end))
+            self.indexed_bytes = end
+            if progress is not None:
+                progress(end / self.size)
+        if offsets[-1] == self.size:
+            offsets.pop()  # Depois do último '\\n' não há outra linha (como em splitlines)
+        self.complete = True
+        self._save_sidecar()
+        return self
+
+    def _load_sidecar(self):
+        """Carrega o índice guardado se ele corresponder ao arquivo atual; retorna se carregou."""
+        if self.sidecar_path is None:
+            return False
+        try:
+            with open(self.sidecar_path, 'rb') as f:
+                magic, size, mtime_ns, count, encoding = _SIDECAR_HEADER.unpack(f.read(_SIDECAR_HEADER.size))
+                if magic != _SIDECAR_MAGIC or size != self.size or mtime_ns != self._mtime_ns:
+                    return False
+                offsets = array('Q')
+                offsets.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return False
+        self.offsets = offsets
+        if self._fixed_encoding is None:
+            self.encoding = encoding.rstrip(b'\0').decode('ascii')
+        self.indexed_bytes = self.size
+        self.complete = True
+        return True
+
+    def _save_sidecar(self):
+        """Guarda o índice completo ao lado do arquivo (falhas de gravação são ignoradas)."""
+        if self.sidecar_path is None:
+            return
+        try:
+            with atomic_output(self.sidecar_path, 'wb') as f:
+                f.write(_SIDECAR_HEADER.pack(_SIDECAR_MAGIC, self.size, self._mtime_ns, len(self.offsets),
+                                             self.encoding.encode('ascii')))
+                self.offsets.tofile(f)
+        except OSError:
+            pass
+
+    def __len__(self):
+        """Número de linhas já indexadas."""
+        return len(self.offsets)
+
+    def estimated_lines(self):
+        """Total de linhas esperado, extrapolado da parte já indexada enquanto o índice cresce."""
+        if self.complete or not self.indexed_bytes:
+            return len(self.offsets)
+        return max(len(self.offsets), round(len(self.offsets) * self.size / self.indexed_bytes))
+
+    def lines(self, first, last):
+        """Linhas [first, last) já indexadas, decodificadas, sem o fim de linha."""
+        last = min(last, len(self.offsets))
+        if first >= last:
+            return []
+        start = self.offsets[first]
+        end = self._map.find(b'\n', self.offsets[last - 1])
+        if end < 0:
+            end = self.size
+        text = self._map[start:end].decode(self.encoding, 'replace')
+        return [line[:-1] if line.endswith('\r') else line for line in text.split('\n')]
+
+    def line_of(self, offset):
+        """Linha (base 0) que contém o byte offset."""
+        return bisect.bisect_right(self.offsets, offset) - 1
+
+    def find(self, text, first_line=0):
+        """Próxima linha a partir de first_line que contém text (sem diferenciar maiúsculas), ou None.
+
+        A busca roda sobre os bytes mapeados, sem decodificar o arquivo, e recomeça do
+        início ao chegar no fim.
+        """
+        if not text or not self.offsets or not self.size:
+            return None
+        pattern = re.compile(re.escape(text.encode(self.encoding, 'replace')), re.IGNORECASE)
+        start = self.offsets[min(first_line, len(self.offsets) - 1)]
+        match = pattern.search(self._map, start) or pattern.search(self._map, 0, start)
+        if match is None or match.start() >= self.indexed_bytes and not self.complete:
+            return None
+        return self.line_of(match.start())
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+def convert_gcode_file_mapped(input_path, output_path, mode='linear', progress=None, stats=None):
+    """Converte como convert_gcode_file e devolve o mapa de linhas da entrada para a saída.
+
+    O mapa é um array('Q') com, para cada linha da entrada (separadas por '\\n', como
+    em LineIndex), a linha de saída (base 0) onde começa a conversão dela. A entrada
+    é lida por mmap e a saída usa a codificação detectada nela. O corpo é
+    gravado num arquivo temporário enquanto a velocidade do spindle e a altura Z
+    final são resolvidas, e depois emendado entre o cabeçalho e o rodapé.
+    """
+    line_map = array('Q')
+    state = ModalState()
+    template_cache = CycleTemplateCache()
+    speed = None
+    initial_z = None  # Mach3: primeiro G0 Z isolado
+    out_line = _linear_header(0).count('\n')  # Os dois cabeçalhos têm o mesmo número de linhas
+    line_number = 0
+    position = 0
+    start = time.perf_counter()
+
+    with mapped_input(input_path) as (data, encoding), \
+            tempfile.TemporaryFile('w+', encoding=encoding) as body:
+        size = len(data)
+        while position < size:
+            line_map.append(out_line)
+            raw_end = data.find(b'\n', position) + 1 or size
+            raw_line = data[position:raw_end]
+            position = raw_end
+            if progress is not None and len(line_map) % 4096 == 0:
+                progress(position / size)
+            for line in raw_line.decode(encoding).splitlines() or ('',):
+                line_number += 1
+                if speed is None:
+                    speed = _line_speed(line)
+                if mode == 'mach3':
+                    if line.strip():
+                        out_line += 1  # Cada linha não vazia gera exatamente uma linha
+                    line_z = _write_all(body, _iter_mach3_lines((line,), line_number, stats))
+                    if initial_z is None:
+                        initial_z = line_z
+                    continue
+                if stats is None:
+                    block = tokenize_gcode_line(line, line_number)
+                    output = block and _linear_block_output(block, state, template_cache)
+                else:
+                    output = "".join(_iter_linear_blocks_profiled((line,), state, template_cache, line_number, stats))
+                if output:
+                    out_line += output.count('\n')
+                    body.write(output)
+
+        speed = 1000 if speed is None else speed
+        if mode == 'mach3':
+            header = _mach3_header(speed)
+            footer = _safe_return_footer(15.0 if initial_z is None else initial_z)
+        else:
+            header = _linear_header(speed)
+            footer = _safe_return_footer(state.initial_z)
+        body.seek(0)
+        with atomic_output(output_path, encoding=encoding) as f_out:
+            f_out.write(header)
+            shutil.copyfileobj(body, f_out, 1 << 20)
+            f_out.write(footer)
+    if stats is not None:
+        stats.record(time.perf_counter() - start, line_number, size,
+                     out_line + footer.count('\n'), os.path.getsize(output_path))
+    return line_map
+
+# --- Programa tokenizado compacto (representação intermediária) ---
+# Arquivo do programa tokenizado: assinatura (com a ordem dos bytes) e o nº de itens de
+# cada seção, seguidos das seções na ordem de _PROGRAM_SECTIONS, alinhadas a 8 bytes
+_PROGRAM_SECTIONS = (
+    ('line_numbers', 'I'), ('opcodes', 'H'), ('flags', 'B'),
+    ('x', 'd'), ('y', 'd'), ('z', 'd'), ('f', 'd'),
+    ('word_offsets', 'I'), ('word_letters', 'B'), ('word_values', 'd'),
+    ('text_blocks', 'I'), ('text_offsets', 'Q'), ('text_data', 'B'),
+    ('code_offsets', 'I'), ('code_values', 'd'),
+)
+_PROGRAM_HEADER = struct.Struct('<8s' + 'Q' * len(_PROGRAM_SECTIONS))
+_PROGRAM_MAGIC = b'GCIR1' + sys.byteorder[0].encode() + b'\0\0'
+PROGRAM_EXTENSION = '.gcir'
+# Blocos por vez nas leituras vetorizadas do programa (estimativa do tempo de ciclo)
+PROGRAM_CHUNK_BLOCKS = 256 * 1024
+
+def _word_number(value):
+    """Valor de uma palavra no texto regenerado: o texto mais curto do valor, sem ".0" nem expoente."""
+    text = repr(value)
+    if text.endswith('.0'):
+        return '0' if text == '-0.0' else text[:-2]
+    return _trimmed(f"{value:.12f}") if 'e' in text else text
+
+def is_program_file(path):
+    """Se path é um programa tokenizado gravado por ParsedProgram.save."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(_PROGRAM_MAGIC)) == _PROGRAM_MAGIC
+    except OSError:
+        return False
+
+class ParsedProgram:
+    """Programa de G-code já tokenizado, guardado em colunas (array) em vez de texto.
+
+    Cada bloco (linha não vazia) ocupa uma posição em cada coluna: número da linha,
+    opcode (índice na tabela codes das combinações de códigos G, em ordem), flags e
+    os valores de X, Y, Z e F (NaN quando ausentes). As demais palavras (I, J, K, R,
+    Q, P, S, M, N...) ficam numa tabela lateral com todas as ocorrências, em ordem
+    (word_offsets aponta o trecho de cada bloco em word_letters/word_values), e os
+    comentários numa tabela de textos indexada pelo bloco. Linhas que o tokenizador
+    não representa por inteiro (%, variáveis, letras sem número) e os arcos com K
+    guardam o texto original nessa mesma tabela (flag RAW) e passam adiante sem alteração.
+
+    Os blocos são regenerados por blocks() como em tokenize_gcode, sem reler texto; o
+    texto de cada bloco é o canônico (N, códigos G, X Y Z, demais palavras, F e o
+    comentário). save() grava as colunas em binário e load() as mapeia de volta
+    (mmap), sem copiá-las: o programa carregado é somente leitura.
+    """
+    COMMENT = 1
+    RAW = 2
+
+    def __init__(self):
+        self.line_numbers = array('I')
+        self.opcodes = array('H')
+        self.flags = array('B')
+        self.x = array('d')
+        self.y = array('d')
+        self.z = array('d')
+        self.f = array('d')
+        self.word_offsets = array('I', [0])
+        self.word_letters = array('B')
+        self.word_values = array('d')
+        self.text_blocks = array('I')
+        self.text_offsets = array('Q', [0])
+        self.text_data = array('B')
+        self.codes = []  # Tupla dos códigos G de cada opcode
+        self._code_index = {}
+        self._numbers = {}  # Valor -> texto nas linhas regeneradas (coordenadas se repetem muito)
+        self._map = None
+        self._views = []
+
+    @classmethod
+    def from_lines(cls, lines, first_line_number=1):
+        """Tokeniza as linhas (como tokenize_gcode) num programa novo."""
+        program = cls()
+        append = program.append
+        for line_number, line in enumerate(lines, first_line_number):
+            append(line, line_number)
+        return program
+
+    @classmethod
+    def from_file(cls, path, encoding=None):
+        """Tokeniza um arquivo de G-code lido por mmap."""
+        with mapped_input(path, encoding) as (data, encoding):
+            return cls.from_lines(iter_mapped_lines(data, encoding))
+
+    def append(self, line, line_number):
+        """Tokeniza uma linha no fim do programa (linhas em branco são ignoradas)."""
+        stripped = line.strip()
+        if not stripped:
+            return
+        comment = ''
+        code = stripped
+        if '(' in stripped or ';' in stripped:
+            comment = ' '.join(_COMMENT_RE.findall(stripped))
+            code = _COMMENT_RE.sub(' ', stripped)
+        code = code.upper()
+        g_codes = []
+        words = []
+        x = y = z = f = math.nan
+        for letter, value in _WORD_RE.findall(code):
+            value = float(value)
+            if letter == 'X':
+                x = value
+            elif letter == 'Y':
+                y = value
+            elif letter == 'Z':
+                z = value
+            elif letter == 'F':
+                f = value
+            elif letter == 'G':
+                g_codes.append(value)
+            else:
+                words.append((ord(letter), value))
+
+        g_codes = tuple(g_codes)
+        opcode = self._code_index.get(g_codes)
+        if opcode is None:
+            opcode = len(self.codes)
+            if opcode > 0xFFFF:
+                raise ValueError(f"Linha {line_number}: combinações de códigos G demais para o programa tokenizado")
+            self.codes.append(g_codes)
+            self._code_index[g_codes] = opcode
+
+        flags = self.COMMENT if comment else 0
+        text = comment
+        # Arcos com K também guardam o texto: a conversão Mach3 remove o K do texto
+        # original, que nem sempre tem a forma que _ARC_K_RE reconhece ("G3X1Y1I1K2")
+        if _WORD_RE.sub('', code).strip() or ((2 in g_codes or 3 in g_codes) and any(letter == 75 for letter, _ in words)):
+            flags |= self.RAW
+            text = stripped
+        if flags:
+            self.text_blocks.append(len(self.opcodes))
+            self.text_data.frombytes(text.encode('utf-8'))
+            self.text_offsets.append(len(self.text_data))
+        self.line_numbers.append(line_number)
+        self.opcodes.append(opcode)
+        self.flags.append(flags)
+        self.x.append(x)
+        self.y.append(y)
+        self.z.append(z)
+        self.f.append(f)
+        for letter, value in words:
+            self.word_letters.append(letter)
+            self.word_values.append(value)
+        self.word_offsets.append(len(self.word_letters))
+
+    def __len__(self):
+        """Número de blocos."""
+        return len(self.opcodes)
+
+    @property
+    def nbytes(self):
+        """Bytes ocupados pelas colunas e tabelas do programa."""
+        return sum(memoryview(data).nbytes for data in self._sections())
+
+    def _text(self, entry):
+        """Texto da entrada entry da tabela de textos."""
+        return bytes(self.text_data[self.text_offsets[entry]:self.text_offsets[entry + 1]]).decode('utf-8')
+
+    def text(self, index):
+        """Texto do bloco index: o original nas linhas RAW, senão o canônico."""
+        return next(self.blocks(index, index + 1)).text
+
+    def blocks(self, start=0, end=None):
+        """Gera um bloco por posição de [start, end), como tokenize_gcode, sem reler texto.
+
+        Os blocos têm os mesmos campos de GCodeBlock; o texto canônico só é montado
+        quando lido (na linearização, os blocos de ciclo nunca precisam dele).
+        """
+        end = len(self) if end is None else min(end, len(self))
+        codes = self.codes
+        line_numbers, opcodes, flags = self.line_numbers, self.opcodes, self.flags
+        xs, ys, zs, fs = self.x, self.y, self.z, self.f
+        word_offsets, letters, values = self.word_offsets, self.word_letters, self.word_values
+        entry = bisect.bisect_left(self.text_blocks, start)
+        for index in range(start, end):
+            g_codes = codes[opcodes[index]]
+            params = {'G': g_codes[-1]} if g_codes else {}
+            x, y, z, f = xs[index], ys[index], zs[index], fs[index]
+            if x == x:
+                params['X'] = x
+            if y == y:
+                params['Y'] = y
+            if z == z:
+                params['Z'] = z
+            if f == f:
+                params['F'] = f
+            for k in range(word_offsets[index], word_offsets[index + 1]):
+                params[chr(letters[k])] = values[k]
+            text = None
+            comment = ''
+            block_flags = flags[index]
+            if block_flags:
+                comment = self._text(entry)
+                entry += 1
+                if block_flags & self.RAW:
+                    text = comment
+                    comment = ' '.join(_COMMENT_RE.findall(text)) if block_flags & self.COMMENT else ''
+            yield _ProgramBlock(self, index, line_numbers[index], text, params, g_codes, comment)
+
+    def _render(self, index, comment):
+        """Texto canônico do bloco index: N, códigos G, X Y Z, demais palavras, F e o comentário."""
+        numbers = self._numbers
+        if len(numbers) >= 65536:
+            numbers.clear()
+        words = []
+        g_codes = self.codes[self.opcodes[index]]
+        if g_codes:
+            words.append(' '.join('G' + _word_number(g) for g in g_codes))
+        for letter, column in (('X', self.x), ('Y', self.y), ('Z', self.z)):
+            value = column[index]
+            if value == value:
+                words.append(letter + (numbers.get(value) or numbers.setdefault(value, _word_number(value))))
+        letters, values = self.word_letters, self.word_values
+        for k in range(self.word_offsets[index], self.word_offsets[index + 1]):
+            value = values[k]
+            word = chr(letters[k]) + (numbers.get(value) or numbers.setdefault(value, _word_number(value)))
+            if letters[k] == 78:
+                words.insert(0, word)  # N vem antes de tudo
+            else:
+                words.append(word)
+        feed = self.f[index]
+        if feed == feed:
+            words.append('F' + (numbers.get(feed) or numbers.setdefault(feed, _word_number(feed))))
+        if comment:
+            words.append(comment)
+        return ' '.join(words)
+
+    def spindle_speed(self, default=1000):
+        """Velocidade da primeira palavra S do programa (ou o padrão)."""
+        k = bytes(self.word_letters).find(b'S')
+        return default if k < 0 else int(self.word_values[k])
+
+    def _sections(self):
+        """Colunas e tabelas na ordem de _PROGRAM_SECTIONS (a tabela de códigos G em dois arrays)."""
+        code_offsets = array('I', [0])
+        code_values = array('d')
+        for g_codes in self.codes:
+            code_values.extend(g_codes)
+            code_offsets.append(len(code_values))
+        return [code_offsets if name == 'code_offsets' else code_values if name == 'code_values'
+                else getattr(self, name) for name, _ in _PROGRAM_SECTIONS]
+
+    def save(self, path):
+        """Grava o programa em binário (nativo desta plataforma), pronto para load()."""
+        sections = self._sections()
+        with atomic_output(path, 'wb') as f:
+            f.write(_PROGRAM_HEADER.pack(_PROGRAM_MAGIC, *(len(data) for data in sections)))
+            for data in sections:
+                size = memoryview(data).nbytes
+                f.write(data)
+                f.write(b'\0' * (-size % 8))
+
+    @classmethod
+    def load(cls, path):
+        """Mapeia (mmap) um programa gravado por save(); as colunas são lidas direto do arquivo.
+
+        Levanta ValueError se o arquivo não for um programa tokenizado desta plataforma.
+        """
+        program = cls()
+        with open(path, 'rb') as f:
+            header = f.read(_PROGRAM_HEADER.size)
+            if len(header) < _PROGRAM_HEADER.size or not header.startswith(_PROGRAM_MAGIC):
+                raise ValueError(f"{path} não é um programa tokenizado (ou foi gravado em outra plataforma)")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        counts = _PROGRAM_HEADER.unpack(header)[1:]
+        view = memoryview(data)
+        views = [view]
+        position = _PROGRAM_HEADER.size
+        for (name, typecode), count in zip(_PROGRAM_SECTIONS, counts):
+            end = position + count * array(typecode).itemsize
+            if end > len(data):
+                for section in reversed(views):
+                    section.release()
+                data.close()
+                raise ValueError(f"{path}: programa tokenizado incompleto")
+            section = view[position:end].cast(typecode)
+            views.append(section)
+            setattr(program, name, section)
+            position = end + (-end % 8)
+        code_offsets, code_values = program.code_offsets, program.code_values
+        program.codes = [tuple(code_values[code_offsets[k]:code_offsets[k + 1]])
+                         for k in range(len(code_offsets) - 1)]
+        del program.code_offsets, program.code_values
+        program._map = data
+        program._views = views
+        return program
+
+    def close(self):
+        """Libera o arquivo mapeado por load() (sem efeito num programa construído na memória)."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class _ProgramBlock:
+    """Bloco de um ParsedProgram com os campos de GCodeBlock; o texto é regenerado na primeira leitura."""
+    __slots__ = ('_program', '_index', '_text', 'line_number', 'params', 'g_codes', 'comment')
+
+    def __init__(self, program, index, line_number, text, params, g_codes, comment):
+        self._program = program
+        self._index = index
+        self._text = text
+        self.line_number = line_number
+        self.params = params
+        self.g_codes = g_codes
+        self.comment = comment
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._program._render(self._index, self.comment)
+        return self._text
+
+def iter_convert_program(program, mode='linear', stats=None, optimizer=None):
+    """Como CONVERTERS[mode], a partir de um programa já tokenizado (ParsedProgram), sem reler texto.
+
+    Nas linhas passadas adiante sai o texto canônico dos blocos (ParsedProgram.text):
+    as mesmas palavras e valores da conversão do texto de origem, com outra formatação
+    ("G0 X10 Y5" em vez de "G00X10.000Y5.000"). Os ciclos expandidos, os comentários
+    e as linhas guardadas como estão (RAW) saem iguais.
+    """
+    if optimizer is not None and mode != 'linear':
+        raise ValueError("A otimização da ordem dos furos só se aplica à conversão linear")
+    if mode not in CONVERTERS:
+        raise ValueError(f"Modo de conversão desconhecido: {mode}")
+    speed = program.spindle_speed()
+    if mode == 'mach3':
+        yield _mach3_header(speed)
+        initial_z = yield from _iter_mach3_program(program, stats)
+        yield _safe_return_footer(15.0 if initial_z is None else initial_z)
+        return
+    yield _linear_header(speed)
+    state = ModalState()
+    template_cache = CycleTemplateCache()
+    if optimizer is not None:
+        yield from _iter_linear_blocks_optimized(program.blocks(), state, template_cache, optimizer)
+    elif stats is not None:
+        for block in program.blocks():
+            yield _linear_block_output_profiled(block, state, template_cache, stats)
+    else:
+        for block in program.blocks():
+            yield _linear_block_output(block, state, template_cache)
+    yield _safe_return_footer(state.initial_z)
+
+def _iter_mach3_program(program, stats=None):
+    """_iter_mach3_lines sobre os blocos do programa; retorna a altura do primeiro G0 Z isolado (ou None)."""
+    initial_z = None
+    for block in program.blocks():
+        params = block.params
+        g_codes = block.g_codes
+        if initial_z is None and 0 in g_codes and 'Z' in params \
+                and 'X' not in params and 'Y' not in params:
+            initial_z = params['Z']
+        if 'K' in params and (2 in g_codes or 3 in g_codes):
+            text, removed = _ARC_K_RE.subn('', block.text)
+            if stats is not None:
+                stats.k_words_removed += removed
+            yield text + '\n'
+        else:
+            yield block.text + '\n'
+    return initial_z
+
+def convert_program(program, mode='linear', stats=None, optimizer=None):
+    """Converte um programa tokenizado e devolve a saída também tokenizada (outro ParsedProgram)."""
+    output = iter_convert_program(program, mode, stats, optimizer)
+    return ParsedProgram.from_lines(line for chunk in output for line in chunk.splitlines())
+
+# --- Estimativa do tempo de ciclo (vetorizada com NumPy) ---
+# Comentários sem atravessar linhas: um "(" sem ")" vale só até o fim da linha
+_BYTES_COMMENT_RE = re.compile(rb'\([^)\n]*\)?|;[^\n]*')
+# Tokenização por bytes: números viram sequências separadas por espaço e cada um pertence
+# à última letra antes dele (ignorando espaços)
+_NUMBER_BYTES = b'0123456789.-+'
+_TO_NUMBERS = bytes(c if c in _NUMBER_BYTES else 0x20 for c in range(256))
+if np is not None:
+    _IS_NUMBER = np.zeros(256, dtype=bool)
+    _IS_NUMBER[list(_NUMBER_BYTES)] = True
+    _IS_BLANK = np.zeros(256, dtype=bool)
+    _IS_BLANK[list(b' \t\r')] = True
+
+# Bytes resolvidos de uma vez em arrays; limita a memória dos arrays temporários
+ESTIMATE_CHUNK_BYTES = 2 * 1024 * 1024
+
+def _forward_fill(values, initial):
+    """Repete o último valor definido (não NaN) nas posições NaN; antes do primeiro, initial."""
+    values = np.concatenate(((initial,), values))
+    index = np.where(np.isnan(values), 0, np.arange(values.size))
+    np.maximum.accumulate(index, out=index)
+    return values[index][1:]
+
+def _trapezoid_time(distance, speed, acceleration):
+    """Tempo (s) de cada trecho, partindo e chegando parado, com velocidade e aceleração limitadas."""
+    speed = np.maximum(speed, 1e-9)
+    ramp = speed * speed / acceleration  # Distância gasta acelerando até speed e freando de volta
+    return np.where(distance >= ramp, distance / speed + speed / acceleration, 2 * np.sqrt(distance / acceleration))
+
+def _format_duration(seconds):
+    """Duração legível: 1h02min03s, 4min05s ou 6.2s."""
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}min{seconds:02d}s" if hours else f"{minutes}min{seconds:02d}s"
+
+def _tokenize_bytes(data):
+    """Palavras de um trecho de G-code em arrays: (letra, linha, valor) e o nº de linhas.
+
+    Tudo em NumPy sobre os bytes, sem laço em Python: os números são separados com
+    bytes.translate/split e cada um é ligado ao último caractere não branco antes
+    dele (a letra da palavra) e à linha em que começa.
+    """
+    data = _BYTES_COMMENT_RE.sub(b'', data.upper())
+    chars = np.frombuffer(data, dtype=np.uint8)
+    newline = chars == 0x0A
+    line_count = int(np.count_nonzero(newline)) + 1
+    number = _IS_NUMBER[chars]
+    starts = np.flatnonzero(number & ~np.concatenate(((False,), number[:-1])))
+    if starts.size == 0:
+        return np.zeros(0, np.uint8), np.zeros(0, np.int64), np.zeros(0), line_count
+    texts = np.array(data.translate(_TO_NUMBERS).split())
+    try:
+        values = texts.astype(np.float64)
+    except ValueError:
+        # Sequências que não são números ("-", "1-2"): valem NaN, o resto é aproveitado
+        values = np.array([_float_or_nan(text) for text in texts.tolist()])
+    last_filled = np.where(_IS_BLANK[chars], 0, np.arange(1, chars.size + 1))
+    np.maximum.accumulate(last_filled, out=last_filled)
+    previous = np.where(starts > 0, last_filled[starts - 1], 0) - 1
+    letters = np.where(previous >= 0, chars[np.maximum(previous, 0)], 0)
+    line = np.cumsum(newline)[starts]
+    return letters, line, values, line_count
+
+def _float_or_nan(text):
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+class CycleTimeEstimate:
+    """Percursos e tempo estimado de um programa convertido (G0/G1/G2/G3 e pausas G4).
+
+    O programa é lido em pedaços de ESTIMATE_CHUNK_BYTES; em cada pedaço as
+    palavras viram arrays NumPy e posição, modo de movimento, G90/G91 e avanço
+    modais são propagados linha a linha com operações vetorizadas, sem laço em
+    Python por linha. Ciclos enlatados não são simulados (ValueError): expanda-os
+    antes, como fazem estimate_gcode_text e estimate_gcode_file.
+
+    Cada segmento parte e chega parado, com a aceleração limitada (estimativa
+    conservadora); nos rápidos cada eixo anda na sua velocidade máxima ao mesmo
+    tempo, e nos arcos a velocidade também fica limitada pela aceleração centrípeta.
+    Unidades: mm, mm/min para avanços e rápidos, mm/s² para a aceleração e P do G4
+    em segundos (como na saída dos conversores).
+    """
+
+    def __init__(self, rapid_rates=(5000.0, 5000.0, 3000.0), acceleration=500.0, max_feed=None):
+        if np is None:
+            raise RuntimeError("A estimativa do tempo de ciclo precisa do NumPy (pip install numpy)")
+        self.rapid_rates = np.asarray(rapid_rates, dtype=np.float64)
+        self.acceleration = float(acceleration)
+        self.max_feed = max_feed
+        self.lines = 0
+        self.segments = 0
+        self.rapid_distance = 0.0
+        self.feed_distance = 0.0  # Inclui os arcos
+        self.arc_distance = 0.0
+        self.rapid_seconds = 0.0
+        self.feed_seconds = 0.0
+        self.dwell_seconds = 0.0
+        self.unfed_moves = 0  # G1/G2/G3 sem avanço F definido (não entram no tempo)
+        # Estado modal entre pedaços; a posição começa desconhecida (NaN)
+        self._position = [np.nan, np.nan, np.nan]
+        self._motion = 0.0
+        self._incremental = 0.0
+        self._feed = np.nan
+
+    @property
+    def total_seconds(self):
+        return self.rapid_seconds + self.feed_seconds + self.dwell_seconds
+
+    def add_text(self, text):
+        """Soma os movimentos de um trecho de programa que termina no fim de uma linha."""
+        self.add_bytes(text.encode('utf-8'))
+
+    def add_bytes(self, data):
+        """Como add_text, com o programa em bytes (UTF-8 ou Latin-1; só os comentários diferem)."""
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start + ESTIMATE_CHUNK_BYTES)
+            end = len(data) if end < 0 else end + 1
+            self._add_chunk(data[start:end])
+            start = end
+
+    def add_program(self, program):
+        """Como add_bytes, com um programa já tokenizado (ParsedProgram): as colunas dele vão direto para os arrays.
 
-def convert_gcode_for_mach3(gcode_text):
-    """Converte G-code para Mach3: remove parâmetro K e adiciona rotinas de segurança."""
-    output_lines = []
-    lines = gcode_text.splitlines()
-    
-    initial_z = 15.0  # Altura Z segura padrão
-    spindle_speed = 1000  # RPM padrão do spindle
-    
-    # Detecta velocidade do spindle no código original
-    for line in lines:
-        if 'S' in line.upper():
-            params = parse_gcode_params(line)
-            if 'S' in params:
-                spindle_speed = int(params['S'])
-                break
-    
-    # Detecta altura Z inicial
-    for line in lines:
-        line_upper = line.strip().upper()
-        if line_upper.startswith('G0') and 'Z' in line_upper:
-            params = parse_gcode_params(line_upper)
+        As linhas contam pelos números de linha dos blocos, como no texto de origem
+        (menos as linhas em branco depois do último bloco).
+        """
+        # Movimento, modo G90/G91 e pausa de cada opcode, resolvidos uma vez na tabela de códigos
+        motion_of = np.full(len(program.codes), np.nan)
+        distance_of = np.full(len(program.codes), np.nan)
+        dwell_of = np.zeros(len(program.codes), dtype=bool)
+        for opcode, g_codes in enumerate(program.codes):
+            for g in g_codes:
+                if g in CYCLE_TEMPLATES:
+                    raise ValueError("Ciclos enlatados precisam ser expandidos antes da estimativa")
+                if g in (0, 1, 2, 3):
+                    motion_of[opcode] = g
+                elif g in (90, 91):
+                    distance_of[opcode] = g - 90
+                elif g == 4:
+                    dwell_of[opcode] = True
+        opcodes = np.frombuffer(program.opcodes, dtype=np.uint16)
+        line_numbers = program.line_numbers
+        dense = {letter: np.frombuffer(column, dtype=np.float64)
+                 for letter, column in zip('XYZF', (program.x, program.y, program.z, program.f))}
+        word_offsets = np.frombuffer(program.word_offsets, dtype=np.uint32)
+        word_letters = np.frombuffer(program.word_letters, dtype=np.uint8)
+        word_values = np.frombuffer(program.word_values, dtype=np.float64)
+        for start in range(0, len(program), PROGRAM_CHUNK_BLOCKS):
+            end = min(start + PROGRAM_CHUNK_BLOCKS, len(program))
+            count = end - start
+            first, last = int(word_offsets[start]), int(word_offsets[end])
+            letters = word_letters[first:last]
+            values = word_values[first:last]
+            owner = np.repeat(np.arange(count), np.diff(word_offsets[start:end + 1]).astype(np.int64))
+
+            def column(letter):
+                if letter in dense:
+                    return dense[letter][start:end]
+                selected = letters == ord(letter)
+                result = np.full(count, np.nan)
+                result[owner[selected]] = values[selected]
+                return result
+
+            chunk_opcodes = opcodes[start:end]
+            self.lines += line_numbers[end - 1] - (line_numbers[start - 1] if start else 0)
+            self._add_blocks(count, column, motion_of[chunk_opcodes], distance_of[chunk_opcodes],
+                             dwell_of[chunk_opcodes])
+
+    def _add_chunk(self, chunk):
+        letters, line, values, line_count = _tokenize_bytes(chunk)
+        g_line, g_value = line[letters == ord('G')], values[letters == ord('G')]
+        if np.isin(g_value, list(CYCLE_TEMPLATES)).any():
+            raise ValueError("Ciclos enlatados precisam ser expandidos antes da estimativa")
+        self.lines += line_count - chunk.endswith(b'\n')
+
+        def column(letter):
+            selected = letters == ord(letter)
+            result = np.full(line_count, np.nan)
+            result[line[selected]] = values[selected]
+            return result
+
+        motion = np.full(line_count, np.nan)
+        selected = np.isin(g_value, (0.0, 1.0, 2.0, 3.0))
+        motion[g_line[selected]] = g_value[selected]
+        distance_mode = np.full(line_count, np.nan)
+        selected = np.isin(g_value, (90.0, 91.0))
+        distance_mode[g_line[selected]] = g_value[selected] - 90.0
+        dwell = np.zeros(line_count, dtype=bool)
+        dwell[g_line[g_value == 4.0]] = True
+        self._add_blocks(line_count, column, motion, distance_mode, dwell)
+
+    def _add_blocks(self, line_count, column, motion, distance_mode, dwell):
+        """Soma os movimentos de line_count linhas já resolvidas em arrays.
+
+        column(letra) dá o valor da palavra em cada linha (NaN se ausente); motion,
+        distance_mode (0 em G90, 1 em G91) e dwell vêm dos códigos G de cada linha.
+        """
+        motion = _forward_fill(motion, self._motion)
+        incremental = _forward_fill(distance_mode, self._incremental) > 0.5
+        feed = _forward_fill(column('F'), self._feed)
+        i, j, r = column('I'), column('J'), column('R')
+        moved = ~(np.isnan(i) & np.isnan(j))
+
+        # Posição absoluta por eixo: G90 redefine, G91 soma ao valor anterior
+        ends, deltas = [], []
+        for axis, letter in enumerate('XYZ'):
+            value = column(letter)
+            given = ~np.isnan(value)
+            moved |= given
+            offset = np.cumsum(np.where(given & incremental, value, 0.0))
+            reset = given & ~incremental
+            base = np.full(line_count, np.nan)
+            base[reset] = value[reset] - offset[reset]
+            end = _forward_fill(base, self._position[axis]) + offset
+            start = np.concatenate(((self._position[axis],), end[:-1]))
+            ends.append(end)
+            deltas.append(np.nan_to_num(end - start))  # Trechos a partir de posição desconhecida valem 0
+            self._position[axis] = end[-1]
+        dx, dy, dz = deltas
+
+        # G0
+        rapid = moved & (motion == 0.0)
+        rapid_dx, rapid_dy, rapid_dz = np.abs(dx[rapid]), np.abs(dy[rapid]), np.abs(dz[rapid])
+        self.rapid_distance += float(np.sqrt(rapid_dx ** 2 + rapid_dy ** 2 + rapid_dz ** 2).sum())
+        rates = self.rapid_rates / 60.0
+        self.rapid_seconds += float(np.maximum.reduce([
+            _trapezoid_time(rapid_dx, rates[0], self.acceleration),
+            _trapezoid_time(rapid_dy, rates[1], self.acceleration),
+            _trapezoid_time(rapid_dz, rates[2], self.acceleration)]).sum()) if rapid.any() else 0.0
+
+        # G1, e G2/G3 no plano XY (centro por I/J ou raio R)
+        cutting = moved & (motion >= 1.0)
+        arc = moved & (motion >= 2.0)
+        length = np.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
+        radius = np.full(line_count, np.inf)
+        if arc.any():
+            ai, aj, ar = np.nan_to_num(i[arc]), np.nan_to_num(j[arc]), r[arc]
+            adx, ady, adz = dx[arc], dy[arc], dz[arc]
+            by_radius = ~np.isnan(ar) & np.isnan(i[arc]) & np.isnan(j[arc])
+            start_angle = np.arctan2(-aj, -ai)
+            end_angle = np.arctan2(ady - aj, adx - ai)
+            sweep = np.where(motion[arc] == 3.0, end_angle - start_angle, start_angle - end_angle) % (2 * np.pi)
+            sweep[sweep <= 1e-12] = 2 * np.pi  # Mesmo ponto de início e fim: círculo completo
+            arc_radius = np.hypot(ai, aj)
+            chord = np.hypot(adx, ady)
+            abs_r = np.abs(np.nan_to_num(ar))
+            r_sweep = 2 * np.arcsin(np.clip(chord / np.maximum(2 * abs_r, 1e-12), 0.0, 1.0))
+            r_sweep = np.where(np.nan_to_num(ar) < 0, 2 * np.pi - r_sweep, r_sweep)
+            sweep = np.where(by_radius, r_sweep, sweep)
+            arc_radius = np.where(by_radius, abs_r, arc_radius)
+            arc_length = np.hypot(arc_radius * sweep, adz)
+            length[arc] = arc_length
+            radius[arc] = arc_radius
+            self.arc_distance += float(arc_length.sum())
+        cut_feed = feed[cutting]
+        fed = cut_feed > 0  # Falso também para NaN
+        self.unfed_moves += int(np.count_nonzero(~fed))
+        speed = cut_feed[fed] / 60.0
+        if self.max_feed is not None:
+            speed = np.minimum(speed, self.max_feed / 60.0)
+        speed = np.minimum(speed, np.sqrt(self.acceleration * radius[cutting][fed]))
+        cut_length = length[cutting]
+        self.feed_distance += float(cut_length.sum())
+        self.feed_seconds += float(_trapezoid_time(cut_length[fed], speed, self.acceleration).sum())
+        self.dwell_seconds += float(np.nansum(column('P')[dwell]))
+        self.segments += int(np.count_nonzero(moved))
+
+        self._motion = motion[-1]
+        self._incremental = float(incremental[-1])
+        self._feed = feed[-1]
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        return {
+            'lines': self.lines,
+            'segments': self.segments,
+            'rapid_distance': self.rapid_distance,
+            'feed_distance': self.feed_distance,
+            'arc_distance': self.arc_distance,
+            'rapid_seconds': self.rapid_seconds,
+            'feed_seconds': self.feed_seconds,
+            'dwell_seconds': self.dwell_seconds,
+            'total_seconds': self.total_seconds,
+            'unfed_moves': self.unfed_moves,
+        }
+
+    def format(self):
+        """Relatório em texto, uma informação por linha."""
+        lines = [f"Tempo estimado: {_format_duration(self.total_seconds)} "
+                 f"(rápidos {_format_duration(self.rapid_seconds)}, avanço {_format_duration(self.feed_seconds)}, "
+                 f"pausas {_format_duration(self.dwell_seconds)})",
+                 f"Percurso: {self.rapid_distance:.1f} mm em rápido, {self.feed_distance:.1f} mm em avanço "
+                 f"(arcos {self.arc_distance:.1f} mm), {self.segments} segmentos"]
+        if self.unfed_moves:
+            lines.append(f"Movimentos de avanço sem F (fora do tempo): {self.unfed_moves}")
+        return "\n".join(lines)
+
+def _iter_joined(chunks, size=ESTIMATE_CHUNK_BYTES):
+    """Junta pedaços de saída (cada um termina no fim de uma linha) em blocos de cerca de size caracteres."""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield "".join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending)
+
+def _estimate_lines(lines, options):
+    """Estimativa com os ciclos enlatados expandidos como na conversão linear (sem cabeçalho nem rodapé)."""
+    estimate = CycleTimeEstimate(**options)
+    for chunk in _iter_joined(_iter_linear_blocks(lines, ModalState(), CycleTemplateCache())):
+        estimate.add_text(chunk)
+    return estimate
+
+def estimate_gcode_text(text, **options):
+    """Estima percursos e tempo de um programa convertido; options vão para CycleTimeEstimate.
+
+    Se ainda houver ciclos enlatados (saída Mach3), o programa é expandido como na
+    conversão linear e a estimativa recomeça.
+    """
+    try:
+        estimate = CycleTimeEstimate(**options)
+        estimate.add_text(text)
+        return estimate
+    except ValueError:
+        return _estimate_lines(iter_gcode_lines(text), options)
+
+def estimate_program(program, **options):
+    """Como estimate_gcode_text, a partir de um programa já tokenizado (ParsedProgram)."""
+    try:
+        estimate = CycleTimeEstimate(**options)
+        estimate.add_program(program)
+        return estimate
+    except ValueError:
+        estimate = CycleTimeEstimate(**options)
+        state = ModalState()
+        template_cache = CycleTemplateCache()
+        output = (_linear_block_output(block, state, template_cache) for block in program.blocks())
+        for chunk in _iter_joined(output):
+            estimate.add_text(chunk)
+        return estimate
+
+def estimate_gcode_file(path, **options):
+    """Como estimate_gcode_text, lendo o arquivo por mmap em pedaços (ou um programa tokenizado)."""
+    if is_program_file(path):
+        program = ParsedProgram.load(path)
+        try:
+            return estimate_program(program, **options)
+        finally:
+            program.close()
+    with mapped_input(path) as (data, encoding):
+        try:
+            estimate = CycleTimeEstimate(**options)
+            estimate.add_bytes(data)
+            return estimate
+        except ValueError:
+            return _estimate_lines(iter_mapped_lines(data, encoding), options)
+
+# --- Verificação de segurança (simulação rápida do movimento) ---
+# Tipos de problema da verificação, na ordem do relatório; só 'aviso' não reprova o programa
+VERIFY_ISSUES = {
+    'ciclo': "Ciclos inválidos",
+    'curso': "Fora do curso da máquina",
+    'rapido': "Rápidos abaixo do Z seguro",
+    'avanco': "Corte sem avanço F",
+    'aviso': "Avisos",
+}
+_QUADRANTS = (0.0, math.pi / 2, math.pi, 3 * math.pi / 2)
+
+def _arc_bounds(start, end, params, clockwise):
+    """Retângulo (x_min, x_max, y_min, y_max) que envolve um arco G2/G3 no plano XY.
+
+    O centro vem de I/J (relativos ao início) ou de R (negativo: arco maior que
+    meia volta); início igual ao fim com I/J é uma volta completa. Devolve None se
+    o arco não puder ser resolvido (sem I/J nem R, ou R menor que meia corda).
+    """
+    (x0, y0), (x1, y1) = start, end
+    if 'I' in params or 'J' in params:
+        cx, cy = x0 + params.get('I', 0.0), y0 + params.get('J', 0.0)
+    elif params.get('R'):
+        r = params['R']
+        dx, dy = x1 - x0, y1 - y0
+        chord = math.hypot(dx, dy)
+        if chord == 0 or chord > 2 * abs(r) + 1e-9:
+            return None
+        h = math.sqrt(max(r * r - chord * chord / 4, 0.0))
+        side = 1.0 if (r > 0) != clockwise else -1.0  # Centro à esquerda da corda em G3 com R positivo
+        cx = (x0 + x1) / 2 - side * h * dy / chord
+        cy = (y0 + y1) / 2 + side * h * dx / chord
+    else:
+        return None
+    radius = math.hypot(x0 - cx, y0 - cy)
+    a0 = math.atan2(y0 - cy, x0 - cx)
+    a1 = math.atan2(y1 - cy, x1 - cx)
+    sweep = ((a0 - a1) if clockwise else (a1 - a0)) % (2 * math.pi)
+    if sweep < 1e-12:
+        sweep = 2 * math.pi
+    xs, ys = [x0, x1], [y0, y1]
+    for angle in _QUADRANTS:
+        # Ponto extremo do círculo em angle, se o arco passar por ele
+        if ((a0 - angle) if clockwise else (angle - a0)) % (2 * math.pi) <= sweep:
+            xs.append(cx + radius * math.cos(angle))
+            ys.append(cy + radius * math.sin(angle))
+    return min(xs), max(xs), min(ys), max(ys)
+
+class MotionVerifier:
+    """Simulação rápida do movimento para verificar limites de curso e segurança, numa só passada.
+
+    Os blocos (tokenize_gcode ou ParsedProgram.blocks) passam pelo mesmo ModalState
+    da conversão linear, então os ciclos enlatados são simulados furo a furo com as
+    mesmas alturas de retração da saída convertida, sem gerar texto; a posição Z e
+    o modo G0/G1/G2/G3 são acompanhados à parte. Verifica:
+
+    - ciclos sem R, Z ou F, G83 sem Q, bicadas não positivas e Z acima do plano R
+      (um G73 sem Q usa bicadas de 1 mm, com um aviso);
+    - posições fora do curso (limits: {'X': (mín, máx), ...}), com os arcos no
+      plano XY pelo retângulo que os envolve;
+    - rápidos G0 que terminam abaixo de safe_z;
+    - movimentos de corte sem avanço F (mergulhos inclusive);
+    - o retorno seguro do rodapé das conversões, feito na altura Z inicial (15.0
+      quando o programa não tem um G0 Z isolado; nesse caso também há um aviso).
+
+    Trechos a partir de posições ainda desconhecidas não são verificados. Todos os
+    problemas são contados, mas só os primeiros examples de cada tipo são guardados,
+    com o número da linha. Numa saída já convertida, o deslocamento lateral do
+    G76/G87 no fundo do furo aparece como rápido abaixo do Z seguro; no programa
+    original, com os ciclos, ele não é contado.
+    """
+
+    def __init__(self, limits=None, safe_z=0.0, examples=5):
+        self.limits = dict(limits or {})
+        self.safe_z = safe_z
+        self.examples = examples
+        self.blocks = 0
+        self.moves = 0
+        self.arcs = 0
+        self.holes = 0
+        self.seconds = 0.0
+        self.envelope = {axis: [math.inf, -math.inf] for axis in 'XYZ'}
+        self.counts = dict.fromkeys(VERIFY_ISSUES, 0)
+        self.issues = {kind: [] for kind in VERIFY_ISSUES}  # (linha ou None no rodapé, mensagem)
+        self._state = ModalState()
+        self._z = None
+        self._motion = None  # 0-3 (G0-G3); None depois de um ciclo ou G80
+        self._plane = 17
+        self._cut_z = None  # Menor Z já cortado em avanço na posição X/Y atual
+        self._initial_z_set = False
+        self._checked_params = None  # Definição de ciclo já verificada
+
+    @property
+    def ok(self):
+        """Se nenhum problema (além dos avisos) foi encontrado."""
+        return not any(count for kind, count in self.counts.items() if kind != 'aviso')
+
+    def _issue(self, kind, line_number, message):
+        self.counts[kind] += 1
+        if len(self.issues[kind]) < self.examples:
+            self.issues[kind].append((line_number, message))
+
+    def _check(self, line_number, axis, low, high):
+        """Soma [low, high] ao envelope do eixo e verifica o curso."""
+        envelope = self.envelope[axis]
+        if low < envelope[0]:
+            envelope[0] = low
+        if high > envelope[1]:
+            envelope[1] = high
+        limit = self.limits.get(axis)
+        if limit is not None and (low < limit[0] or high > limit[1]):
+            value = low if low < limit[0] else high
+            self._issue('curso', line_number, f"{axis}{value:.3f} fora do curso [{limit[0]:g}, {limit[1]:g}]")
+
+    def check(self, blocks):
+        """Simula os blocos, somando os problemas encontrados; devolve self."""
+        start = time.perf_counter()
+        state = self._state
+        safe_z = self.safe_z
+        for block in blocks:
+            params = block.params
+            self.blocks += 1
+            if not params:
+                continue
+            line_number = block.line_number
+            g_codes = block.g_codes
+            x0, y0, z0 = state.x, state.y, self._z
+            try:
+                cycle = state.apply(block)
+                holes = state.holes(block) if cycle is not None and cycle != 80 else None
+            except ValueError as e:
+                self._issue('ciclo', line_number, str(e).partition(': ')[2])
+                continue
+            for g in g_codes:
+                if g in (0, 1, 2, 3):
+                    self._motion = g
+                elif g in (17, 18, 19):
+                    self._plane = g
+                elif g in CYCLE_TEMPLATES or g == 80:
+                    self._motion = None
+            if 0 in g_codes and 'Z' in params and 'X' not in params and 'Y' not in params \
+                    and not state.incremental:
+                self._initial_z_set = True
+            if cycle == 80 and not ('X' in params or 'Y' in params or 'Z' in params):
+                continue
+            if holes is not None:
+                self._check_holes(line_number, holes, z0)
+                continue
+
+            z1 = z0
             if 'Z' in params:
-                if 'X' not in params and 'Y' not in params:
-                    initial_z = params['Z']
-                    break
-    
-    # Adiciona rotina de inicialização segura
-    output_lines.append("; ========================================\n")
-    output_lines.append("; Rotina de Inicialização Mach3\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("G21 ; Modo métrico (mm)\n")
-    output_lines.append("G90 ; Modo absoluto\n")
-    output_lines.append("G94 ; Avanço em mm/min\n")
-    output_lines.append("G17 ; Plano XY\n")
-    output_lines.append(f"M3 S{spindle_speed} ; Liga spindle a {spindle_speed} RPM\n")
-    output_lines.append("G4 P2.0 ; Aguarda 2 segundos para estabilizar\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("\n")
-    
-    # Processa cada linha removendo o parâmetro K
-    for line in lines:
-        line_stripped = line.strip()
-        
-        if not line_stripped:
-            continue
-        
-        # Remove comentários de linha inteira
-        if line_stripped.startswith('(') or line_stripped.startswith(';'):
-            output_lines.append(line + '\n')
+                z1 = params['Z'] if not state.incremental else (None if z0 is None else z0 + params['Z'])
+            self._z = z1
+            motion = self._motion
+            x1, y1 = state.x, state.y
+            if not ('X' in params or 'Y' in params or 'Z' in params
+                    or motion in (2, 3) and ('I' in params or 'J' in params)):
+                continue
+            self.moves += 1
+            moved_xy = x1 != x0 or y1 != y0
+            if motion == 0:
+                # Voltar em rápido a um furo já aberto (as bicadas do G73) não conta
+                if z1 is not None and z1 < safe_z and (moved_xy or self._cut_z is None or z1 < self._cut_z):
+                    self._issue('rapido', line_number, f"G0 termina em Z{z1:.3f}, abaixo do Z seguro {safe_z:g}")
+            elif motion is not None:
+                if not (state.feed or 0) > 0:
+                    plunge = z1 is not None and z0 is not None and z1 < z0
+                    self._issue('avanco', line_number, f"{'mergulho ' if plunge else ''}G{motion:g} sem avanço F")
+                if z1 is not None and (moved_xy or self._cut_z is None or z1 < self._cut_z):
+                    self._cut_z = z1
+            if moved_xy and motion == 0:
+                self._cut_z = None
+            bounds = None
+            if motion in (2, 3) and self._plane == 17 and None not in (x0, y0, x1, y1):
+                self.arcs += 1
+                bounds = _arc_bounds((x0, y0), (x1, y1), params, motion == 2)
+            if bounds is not None:
+                self._check(line_number, 'X', bounds[0], bounds[1])
+                self._check(line_number, 'Y', bounds[2], bounds[3])
+            else:
+                if x1 is not None:
+                    self._check(line_number, 'X', x1, x1)
+                if y1 is not None:
+                    self._check(line_number, 'Y', y1, y1)
+            if z1 is not None:
+                self._check(line_number, 'Z', z1, z1)
+        self.seconds += time.perf_counter() - start
+        return self
+
+    def _check_holes(self, line_number, holes, z0):
+        """Furos de um bloco de ciclo: rápido até X/Y, rápido até R, avanço até Z e retração."""
+        state = self._state
+        params = state.cycle_params
+        retract_z = state.retract_z()
+        r, bottom = params['R'], params['Z']
+        if params is not self._checked_params:
+            # Alturas do ciclo: verificadas uma vez por definição
+            self._checked_params = params
+            if bottom > r:
+                self._issue('ciclo', line_number, f"ciclo G{state.cycle:g} com Z{bottom:g} acima do plano R{r:g}")
+            if state.cycle == 73 and params.get('Q') is None:
+                self._issue('aviso', line_number, f"ciclo G73 sem Q: bicadas de {_G73_DEFAULT_Q:g} mm (padrão)")
+            for name, height in (("plano R", r), ("retração", retract_z)):
+                if height < self.safe_z:
+                    self._issue('rapido', line_number,
+                                f"ciclo G{state.cycle:g}: {name} Z{height:.3f} abaixo do Z seguro {self.safe_z:g}")
+        if z0 is not None and z0 < self.safe_z:
+            self._issue('rapido', line_number, f"G0 até o furo em Z{z0:.3f}, abaixo do Z seguro {self.safe_z:g}")
+        self._check(line_number, 'Z', min(bottom, r, retract_z), max(bottom, r, retract_z))
+        xs = [x for x, _ in holes]
+        ys = [y for _, y in holes]
+        if state.cycle in _SHIFT_CYCLES:
+            xs.append(max(xs) + params.get('Q', 0.5))  # Deslocamento do fuso antes de retrair
+        self._check(line_number, 'X', min(xs), max(xs))
+        self._check(line_number, 'Y', min(ys), max(ys))
+        self.holes += len(holes)
+        self.moves += 4 * len(holes)
+        self._z = retract_z
+        self._cut_z = bottom
+
+    def finish(self):
+        """Verifica o retorno seguro que as conversões acrescentam ao fim (G0 Z inicial e G0 X0 Y0)."""
+        initial_z = self._state.initial_z
+        if not self._initial_z_set:
+            self._issue('aviso', None, f"nenhum G0 Z isolado define a altura segura; o retorno ao fim usa Z{initial_z:g}")
+        if initial_z < self.safe_z:
+            self._issue('rapido', None, f"retorno ao fim em Z{initial_z:.3f}, abaixo do Z seguro {self.safe_z:g}")
+        self._check(None, 'Z', initial_z, initial_z)
+        self._check(None, 'X', 0.0, 0.0)
+        self._check(None, 'Y', 0.0, 0.0)
+        return self
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        return {
+            'blocks': self.blocks,
+            'moves': self.moves,
+            'arcs': self.arcs,
+            'holes': self.holes,
+            'seconds': self.seconds,
+            'envelope': {axis: list(bounds) for axis, bounds in self.envelope.items() if bounds[0] <= bounds[1]},
+            'counts': dict(self.counts),
+            'issues': {kind: [list(issue) for issue in issues] for kind, issues in self.issues.items() if issues},
+            'ok': self.ok,
+        }
+
+    def format(self):
+        """Relatório em texto: resumo, envelope e os primeiros problemas de cada tipo com a linha."""
+        lines = [f"Verificação: {self.blocks} blocos, {self.moves} movimentos, {self.holes} furos, "
+                 f"{self.arcs} arcos em {self.seconds:.2f}s"]
+        envelope = [f"{axis} {low:.3f} a {high:.3f}" for axis, (low, high) in self.envelope.items() if low <= high]
+        if envelope:
+            lines.append("Envelope: " + ", ".join(envelope))
+        for kind, title in VERIFY_ISSUES.items():
+            if self.counts[kind]:
+                lines.append(f"{title}: {self.counts[kind]}")
+                lines.extend(f"  {'fim' if line_number is None else f'linha {line_number}'}: {message}"
+                             for line_number, message in self.issues[kind])
+        lines.append("Nenhum problema encontrado" if self.ok else "Programa REPROVADO na verificação")
+        return "\n".join(lines)
+
+def verify_gcode_text(text, **options):
+    """Verifica um programa (original ou convertido); options vão para MotionVerifier."""
+    return MotionVerifier(**options).check(tokenize_gcode(iter_gcode_lines(text))).finish()
+
+def verify_gcode_file(path, **options):
+    """Como verify_gcode_text, lendo o arquivo por mmap (ou um programa tokenizado, sem reler texto)."""
+    if is_program_file(path):
+        program = ParsedProgram.load(path)
+        try:
+            return MotionVerifier(**options).check(program.blocks()).finish()
+        finally:
+            program.close()
+    with mapped_input(path) as (data, encoding):
+        return MotionVerifier(**options).check(tokenize_gcode(iter_mapped_lines(data, encoding))).finish()
+
+# --- Conversão em lote (linha de comando) ---
+CONVERTER_VERSION = '2.1'
+GCODE_EXTENSIONS = ('.nc', '.gcode', '.txt')
+MANIFEST_NAME = '.conversor-gcode.json'
+
+def _glob_root(pattern):
+    """Início do glob sem caracteres especiais: a pasta a partir da qual as subpastas são preservadas."""
+    root = pattern
+    while glob.escape(root) != root:
+        root = os.path.dirname(root)
+    return root if root != pattern else os.path.dirname(pattern)
+
+def collect_input_files(patterns, output_dir):
+    """Expande globs e diretórios em pares (entrada, saída), preservando subpastas dos diretórios.
+
+    Nos globs, o caminho de saída é relativo ao início do glob sem caracteres
+    especiais ("cam/**/*.nc" grava cam/a/p.nc em saida/a/p.nc); arquivos indicados
+    diretamente vão para a raiz da saída. Programas tokenizados (.gcir) só entram
+    quando indicados por arquivo ou glob; a saída deles recebe a extensão .nc.
+    Duas entradas com o mesmo caminho de saída levantam ValueError.
+    """
+    pairs = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, _, filenames in os.walk(pattern):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(GCODE_EXTENSIONS):
+                        path = os.path.join(dirpath, filename)
+                        pairs[path] = os.path.join(output_dir, os.path.relpath(path, pattern))
             continue
-        
-        line_upper = line_stripped.upper()
-        
-        # Verifica se é um comando de arco (G2 ou G3)
-        if 'G2' in line_upper or 'G3' in line_upper:
-            # Remove o parâmetro K da linha
-            # Usa regex para encontrar e remover K seguido de número
-            cleaned_line = re.sub(r'\s+K-?\d+\.?\d*', '', line_stripped, flags=re.IGNORECASE)
-            output_lines.append(cleaned_line + '\n')
-        else:
-            output_lines.append(line + '\n')
-    
-    # Adiciona rotina de retorno seguro ao final
-    output_lines.append("\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("; Rotina de Retorno Seguro para Home\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append(f"G0 Z{initial_z:.6f} ; Sobe Z para altura segura\n")
-    output_lines.append("G0 X0.000000 Y0.000000 ; Move para X0 Y0\n")
-    output_lines.append("; Z permanece em altura segura para evitar colisão\n")
-    output_lines.append("M5 ; Desliga fuso\n")
-    output_lines.append("M30 ; Fim do programa\n")
-    output_lines.append("; ========================================\n")
-    
-    return "".join(output_lines)
+        root = _glob_root(pattern) or os.curdir
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isfile(path):
+                name = os.path.relpath(path, root)
+                if name.lower().endswith(PROGRAM_EXTENSION):
+                    name = name[:-len(PROGRAM_EXTENSION)] + '.nc'
+                pairs[path] = os.path.join(output_dir, name)
+            else:
+                raise FileNotFoundError(f"Nenhum arquivo encontrado para: {pattern}")
+    sources = {}
+    for path, output_path in pairs.items():
+        other = sources.setdefault(os.path.normpath(output_path), path)
+        if other != path:
+            raise ValueError(f"{other} e {path} iriam para a mesma saída: {output_path}")
+    return list(pairs.items())
 
-def convert_gcode_text(gcode_text):
-    """Converte o texto do G-code, expandindo ciclos G73-G89."""
-    output_lines = []
-    lines = gcode_text.splitlines()
-    
-    retract_mode = 'G98'
-    initial_z = 15.0  # Altura Z segura padrão
-    spindle_speed = 1000  # RPM padrão do spindle
-    
-    # Adiciona rotina de inicialização segura
-    output_lines.append("; ========================================\n")
-    output_lines.append("; Rotina de Inicialização\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("G21 ; Modo métrico (mm)\n")
-    output_lines.append("G90 ; Modo absoluto\n")
-    output_lines.append("G94 ; Avanço em mm/min\n")
-    output_lines.append("G17 ; Plano XY\n")
-    
-    # Detecta velocidade do spindle no código original
-    for line in lines:
-        if 'S' in line.upper():
-            params = parse_gcode_params(line)
-            if 'S' in params:
-                spindle_speed = int(params['S'])
+def file_digest(path, mode):
+    """Hash do conteúdo da entrada, do modo de conversão e da versão do conversor."""
+    digest = hashlib.sha256(f"{mode}\0{CONVERTER_VERSION}\0".encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def text_digest(text, mode):
+    """Hash de um texto convertido pela interface, do modo e da versão do conversor."""
+    digest = hashlib.sha256(f"{mode}\0{CONVERTER_VERSION}\0texto\0".encode())
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+# Tamanho máximo padrão do cache de conversões em disco
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+def default_cache_dir():
+    """Diretório padrão do cache de conversões (XDG_CACHE_HOME ou ~/.cache)."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'conversor-gcode')
+
+class ConversionCache:
+    """Cache em disco de conversões, endereçado pelo hash da entrada, do modo e da versão.
+
+    Cada entrada é um arquivo <hash>.gcode gravado de forma atômica; o mtime marca o
+    último uso e, quando o total passa de max_bytes, as entradas usadas há mais tempo
+    são removidas (LRU). Falhas de disco no cache nunca interrompem a conversão.
+    """
+
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.gcode')
+
+    def _open(self, key):
+        """Abre a entrada para leitura e a marca como usada agora; None se não existir."""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Removida por outro processo depois de aberta: o conteúdo aberto continua válido
+        self.hits += 1
+        return f
+
+    def fetch(self, key, output_path):
+        """Copia a entrada para output_path (de forma atômica); retorna False se não estiver no cache."""
+        f = self._open(key)
+        if f is None:
+            return False
+        with f, atomic_output(output_path, 'wb') as f_out:
+            shutil.copyfileobj(f, f_out, 1 << 20)
+        return True
+
+    def store(self, key, source_path):
+        """Guarda uma cópia de source_path sob a chave key."""
+        with open(source_path, 'rb') as f:
+            self._put(key, f, os.fstat(f.fileno()).st_size)
+
+    def _put(self, key, f, size):
+        """Grava o conteúdo de f como a entrada key e aplica o limite de tamanho."""
+        if size > self.max_bytes:
+            return  # Maior que o cache inteiro: só expulsaria todas as outras entradas
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with atomic_output(self._path(key), 'wb') as f_out:
+                shutil.copyfileobj(f, f_out, 1 << 20)
+            self._evict()
+        except OSError:
+            pass
+
+    def convert_text(self, text, mode, progress=None, stats=None):
+        """Converte um texto como CONVERTERS[mode], reaproveitando o resultado se já estiver no cache.
+
+        progress, se informado, é chamado com a fração do texto já lida pelo conversor.
+        Com stats, a conversão é sempre refeita (e medida), mesmo que esteja no cache.
+        """
+        key = text_digest(text, mode)
+        f = self._open(key) if stats is None else None
+        if f is not None:
+            with f:
+                return f.read().decode('utf-8')
+        start = time.perf_counter()
+        lines = iter_gcode_lines(text)
+        if progress is not None:
+            lines = _report_progress(lines, len(text), progress)
+        output_text = "".join(CONVERTERS[mode](lines, stats=stats))
+        if stats is not None:
+            stats.record(time.perf_counter() - start, len(text.splitlines()), len(text.encode('utf-8')),
+                         output_text.count('\n'), len(output_text.encode('utf-8')))
+        data = output_text.encode('utf-8')
+        self._put(key, io.BytesIO(data), len(data))
+        return output_text
+
+    def _evict(self):
+        """Remove as entradas usadas há mais tempo até o total caber em max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.gcode') and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
                 break
-    
-    output_lines.append(f"M3 S{spindle_speed} ; Liga spindle a {spindle_speed} RPM\n")
-    output_lines.append("G4 P2.0 ; Aguarda 2 segundos para estabilizar\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("\n")
 
-    for line in lines:
-        line_upper = line.strip().upper()
+    def clear(self):
+        """Apaga todas as entradas do cache."""
+        if not os.path.isdir(self.directory):
+            return
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.gcode'):
+                    os.unlink(entry.path)
+
+def _convert_batch_item(input_path, output_path, mode, check, known_digest, cache_dir=None, profile=False,
+                        optimize=False, compact=None, keep_comments=True):
+    """Tarefa de um processo do lote: converte um arquivo, o pula se já estiver atualizado
+    ou o copia do cache de conversões (cache_dir) se a mesma entrada já foi convertida."""
+    start = time.perf_counter()
+    digest = None
+    # Saídas reordenadas ou compactadas têm hash próprio
+    digest_mode = mode + '+furos' if optimize else mode
+    if compact is not None:
+        digest_mode += f"+compacta{compact:g}" + ('' if keep_comments else '-comentarios')
+    if check == 'mtime':
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+            return {'status': 'skipped'}
+    elif check == 'hash':
+        digest = file_digest(input_path, digest_mode)
+        if digest == known_digest and os.path.exists(output_path):
+            return {'status': 'skipped', 'digest': digest}
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    cache = None
+    if cache_dir is not None:
+        cache = ConversionCache(cache_dir)
+        digest = digest or file_digest(input_path, digest_mode)
+        if cache.fetch(digest, output_path):
+            return {'status': 'cached', 'digest': digest}
+    stats = ConversionStats() if profile else None
+    optimizer = HoleOrderOptimizer() if optimize else None
+    compactor = OutputCompactor(compact, keep_comments) if compact is not None else None
+    lines = convert_gcode_file(input_path, output_path, mode, stats, optimizer, compactor)
+    if cache is not None:
+        cache.store(digest, output_path)
+    return {
+        'status': 'converted',
+        'digest': digest,
+        'lines': lines,
+        'bytes': os.path.getsize(input_path),
+        'seconds': time.perf_counter() - start,
+        'stats': stats and stats.report(),
+        'hole_order': optimizer and optimizer.report(),
+        'compaction': compactor and compactor.report(),
+    }
+
+def convert_batch(pairs, output_dir, mode='linear', jobs=None, check='mtime', log=print, cache_dir=None,
+                  profile=False, optimize=False, compact=None, keep_comments=True):
+    """Converte vários arquivos em paralelo (ProcessPoolExecutor) e retorna o resumo do lote.
+
+    Com cache_dir, entradas já convertidas antes (mesmo conteúdo, modo e versão) são
+    copiadas do cache de conversões em vez de convertidas de novo. Com profile, o
+    resumo traz em 'stats' o ConversionStats somado dos arquivos convertidos. Com
+    optimize (só no modo linear), os furos são reordenados e 'hole_order' traz o
+    HoleOrderOptimizer somado dos arquivos convertidos. Com compact (resolução da
+    máquina), as saídas passam pelo OutputCompactor e 'compaction' traz a soma dos
+    arquivos convertidos.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if check == 'hash' and os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    summary = {'converted': 0, 'cached': 0, 'skipped': 0, 'failed': 0, 'lines': 0, 'bytes': 0}
+    stats = ConversionStats() if profile else None
+    hole_order = HoleOrderOptimizer() if optimize else None
+    compaction = OutputCompactor(compact, keep_comments) if compact is not None else None
+    start = time.perf_counter()
+    total = len(pairs)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(_convert_batch_item, input_path, output_path, mode, check,
+                        manifest.get(os.path.relpath(output_path, output_dir)), cache_dir, profile, optimize,
+                        compact, keep_comments):
+                (input_path, output_path)
+            for input_path, output_path in pairs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            input_path, output_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                summary['failed'] += 1
+                log(f"[{done}/{total}] ERRO {input_path}: {e}")
+                continue
+            if result.get('digest'):
+                manifest[os.path.relpath(output_path, output_dir)] = result['digest']
+            if result['status'] == 'skipped':
+                summary['skipped'] += 1
+                log(f"[{done}/{total}] atualizado, pulado: {input_path}")
+                continue
+            if result['status'] == 'cached':
+                summary['cached'] += 1
+                log(f"[{done}/{total}] {input_path} -> {output_path} (do cache)")
+                continue
+            summary['converted'] += 1
+            if stats is not None:
+                stats.merge(result['stats'])
+            if hole_order is not None:
+                hole_order.merge(result['hole_order'])
+            if compaction is not None:
+                compaction.merge(result['compaction'])
+            summary['lines'] += result['lines']
+            summary['bytes'] += result['bytes']
+            log(f"[{done}/{total}] {input_path} -> {output_path} "
+                f"({result['lines']} linhas em {result['seconds']:.2f}s)")
+
+    if check == 'hash':
+        with atomic_output(manifest_path) as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    elapsed = time.perf_counter() - start
+    summary['seconds'] = elapsed
+    summary['lines_per_s'] = summary['lines'] / elapsed if elapsed else 0.0
+    summary['mb_per_s'] = summary['bytes'] / 1e6 / elapsed if elapsed else 0.0
+    if stats is not None:
+        summary['stats'] = stats
+    if hole_order is not None:
+        summary['hole_order'] = hole_order
+    if compaction is not None:
+        summary['compaction'] = compaction
+    return summary
+
+# --- Serviço de pastas vigiadas (subcomando vigiar) ---
+# Pasta vigiada: os arquivos de G-code que aparecem em input_dir (e subpastas) são
+# convertidos no modo mode para o caminho correspondente em output_dir
+WatchFolder = namedtuple('WatchFolder', 'input_dir output_dir mode')
+_WatchJob = namedtuple('_WatchJob', 'input_path output_path mode signature detected')
+
+# Prioridade na fila: cada MB de entrada adia o arquivo como se ele tivesse chegado 1 s depois
+WATCH_PRIORITY_BYTES_PER_S = 1024 * 1024
+
+class WatchMetrics:
+    """Métricas do serviço de pastas vigiadas: fila, latência e vazão.
+
+    A latência vai do instante em que o arquivo foi visto pela última vez mudando
+    até a saída gravada (inclui a espera pela estabilidade e pela fila); mediana,
+    p95 e máximo saem das últimas LATENCY_SAMPLES conversões. A vazão é a média
+    desde o início do serviço.
+    """
+    LATENCY_SAMPLES = 1000
 
-        if not line_upper:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.queued = 0  # Na fila, esperando um processo
+        self.running = 0
+        self.converted = 0
+        self.cached = 0
+        self.failed = 0
+        self.lines = 0
+        self.bytes = 0
+        self.latencies = deque(maxlen=self.LATENCY_SAMPLES)
+
+    def record(self, result, latency):
+        """Soma uma conversão terminada (resultado de _convert_batch_item)."""
+        if result['status'] == 'cached':
+            self.cached += 1
+        else:
+            self.converted += 1
+            self.lines += result['lines']
+            self.bytes += result['bytes']
+        self.latencies.append(latency)
+
+    def _latency(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[round(fraction * (len(ordered) - 1))]
+
+    def report(self):
+        """Relatório estruturado (só tipos simples, pronto para JSON)."""
+        uptime = time.monotonic() - self.started
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'converted': self.converted,
+            'cached': self.cached,
+            'failed': self.failed,
+            'lines': self.lines,
+            'bytes': self.bytes,
+            'uptime_seconds': uptime,
+            'files_per_min': (self.converted + self.cached) * 60 / uptime if uptime else 0.0,
+            'lines_per_s': self.lines / uptime if uptime else 0.0,
+            'mb_per_s': self.bytes / 1e6 / uptime if uptime else 0.0,
+            'latency_p50': self._latency(0.5),
+            'latency_p95': self._latency(0.95),
+            'latency_max': max(self.latencies, default=None),
+        }
+
+    def format(self):
+        """Relatório em texto, uma informação por linha."""
+        report = self.report()
+        lines = [f"Fila: {report['queued']} aguardando, {report['running']} convertendo; "
+                 f"{report['converted']} convertidos, {report['cached']} do cache, {report['failed']} com erro "
+                 f"em {_format_duration(report['uptime_seconds'])}",
+                 f"Vazão: {report['files_per_min']:.1f} arquivos/min, {report['lines_per_s']:.0f} linhas/s, "
+                 f"{report['mb_per_s']:.2f} MB/s"]
+        if self.latencies:
+            lines.append(f"Latência: mediana {report['latency_p50']:.2f}s, p95 {report['latency_p95']:.2f}s, "
+                         f"máxima {report['latency_max']:.2f}s")
+        return "\n".join(lines)
+
+class WatchService:
+    """Vigia pastas de entrada e converte os arquivos de G-code que aparecem nelas.
+
+    As pastas são varridas a cada interval segundos (sem dependências além da
+    biblioteca padrão). Um arquivo só entra na fila depois de passar settle segundos
+    com o mesmo tamanho e data de modificação, para não converter arquivos ainda
+    sendo copiados, e volta para a fila se mudar depois de convertido. A fila
+    (asyncio) passa os arquivos pequenos à frente dos grandes, sem deixar nenhum
+    esperando para sempre (WATCH_PRIORITY_BYTES_PER_S), para jobs tarefas que
+    convertem um arquivo por vez num ProcessPoolExecutor de jobs processos: um lote
+    de arquivos grandes nunca ocupa mais que jobs CPUs. Cada conversão é a mesma
+    do lote (_convert_batch_item, com o cache de conversões se cache_dir for dado),
+    com a saída gravada de forma atômica. Na partida, arquivos com saída mais nova
+    que a entrada não são convertidos de novo.
+    """
+
+    def __init__(self, folders, jobs=None, interval=1.0, settle=2.0, cache_dir=None, log=print):
+        for folder in folders:
+            if folder.mode not in CONVERTERS:
+                raise ValueError(f"Modo de conversão desconhecido: {folder.mode}")
+            if os.path.abspath(folder.input_dir) == os.path.abspath(folder.output_dir):
+                raise ValueError(f"A pasta de saída precisa ser diferente da de entrada: {folder.input_dir}")
+        self.folders = list(folders)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.interval = interval
+        self.settle = settle
+        self.cache_dir = cache_dir
+        self.log = log
+        self.metrics = WatchMetrics()
+        self._seen = {}  # Entrada -> (tamanho e mtime, instante em que foram vistos pela primeira vez)
+        self._done = {}  # Entrada -> tamanho e mtime já convertidos (ou que falharam)
+        self._pending = set()  # Entradas na fila ou em conversão
+        self._sequence = itertools.count()
+
+    def _iter_folder_files(self, folder):
+        """Pares (entrada, saída) dos arquivos de G-code da pasta, sem arquivos ocultos nem a pasta de saída."""
+        output_dir = os.path.abspath(folder.output_dir)
+        for dirpath, dirnames, filenames in os.walk(folder.input_dir):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.')
+                                 and os.path.abspath(os.path.join(dirpath, name)) != output_dir)
+            for filename in sorted(filenames):
+                # Os temporários de atomic_output (e de muitos programas de cópia) começam com '.'
+                if not filename.startswith('.') and filename.lower().endswith(GCODE_EXTENSIONS):
+                    path = os.path.join(dirpath, filename)
+                    yield path, os.path.join(folder.output_dir, os.path.relpath(path, folder.input_dir))
+
+    def scan(self, now):
+        """Varre as pastas e devolve os arquivos que acabaram de ficar estáveis (_WatchJob)."""
+        ready = []
+        present = set()
+        for folder in self.folders:
+            for path, output_path in self._iter_folder_files(folder):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Apagado ou renomeado durante a varredura
+                present.add(path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                seen = self._seen.get(path)
+                if seen is None or seen[0] != signature:
+                    if seen is None and os.path.exists(output_path) \
+                            and os.stat(output_path).st_mtime_ns >= stat.st_mtime_ns:
+                        self._done[path] = signature
+                    self._seen[path] = (signature, now)
+                    continue
+                if now - seen[1] < self.settle or self._done.get(path) == signature or path in self._pending:
+                    continue
+                ready.append(_WatchJob(path, output_path, folder.mode, signature, seen[1]))
+        for path in [path for path in self._seen if path not in present]:
+            del self._seen[path]
+            self._done.pop(path, None)
+        return ready
+
+    def idle(self):
+        """Se não há nada na fila, em conversão ou esperando ficar estável."""
+        return not self._pending and all(self._done.get(path) == signature
+                                         for path, (signature, _) in self._seen.items())
+
+    async def run(self, once=False, metrics_interval=60.0, metrics_path=None):
+        """Vigia as pastas até ser cancelado; com once, termina quando não houver mais nada a converter.
+
+        A cada metrics_interval segundos (e ao terminar) as métricas vão para log e,
+        com metrics_path, para esse arquivo JSON.
+        """
+        queue = asyncio.PriorityQueue()
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            workers = [asyncio.create_task(self._worker(queue, pool)) for _ in range(self.jobs)]
+            next_report = time.monotonic() + metrics_interval
+            try:
+                while True:
+                    now = time.monotonic()
+                    for job in self.scan(now):
+                        self._pending.add(job.input_path)
+                        self.metrics.queued += 1
+                        priority = job.detected + job.signature[0] / WATCH_PRIORITY_BYTES_PER_S
+                        queue.put_nowait((priority, next(self._sequence), job))
+                    if now >= next_report:
+                        self._report_metrics(metrics_path)
+                        next_report = now + metrics_interval
+                    if once and self.idle():
+                        break
+                    await asyncio.sleep(self.interval)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self._report_metrics(metrics_path)
+
+    async def _worker(self, queue, pool):
+        """Tarefa da fila: converte um arquivo por vez num processo do pool."""
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await queue.get()
+            self.metrics.queued -= 1
+            self.metrics.running += 1
+            try:
+                result = await loop.run_in_executor(pool, _convert_batch_item, job.input_path, job.output_path,
+                                                    job.mode, 'nenhum', None, self.cache_dir)
+            except Exception as e:
+                self.metrics.failed += 1
+                self.log(f"ERRO {job.input_path}: {e}")
+            else:
+                latency = time.monotonic() - job.detected
+                self.metrics.record(result, latency)
+                if result['status'] == 'cached':
+                    self.log(f"{job.input_path} -> {job.output_path} (do cache, latência {latency:.2f}s)")
+                else:
+                    self.log(f"{job.input_path} -> {job.output_path} ({result['lines']} linhas em "
+                             f"{result['seconds']:.2f}s, latência {latency:.2f}s)")
+            finally:
+                self.metrics.running -= 1
+                self._done[job.input_path] = job.signature
+                self._pending.discard(job.input_path)
+                queue.task_done()
+
+    def _report_metrics(self, metrics_path):
+        self.log(self.metrics.format())
+        if metrics_path is not None:
+            with atomic_output(metrics_path) as f:
+                json.dump(self.metrics.report(), f, indent=1)
+
+# --- Medição de desempenho (subcomando desempenho) ---
+def _generate_holes(rng, count):
+    """Matrizes densas de furos G81/G83: uma linha de ciclo seguida de posições X Y modais."""
+    tool = 0
+    while True:
+        tool += 1
+        cycle = 'G83' if tool % 2 == 0 else 'G81'
+        peck = f" Q{rng.uniform(0.5, 3):.1f}" if cycle == 'G83' else ''
+        yield f"T{tool} M6"
+        yield f"M3 S{rng.choice((6000, 8000, 12000))}"
+        yield "G0 Z20"
+        yield 'G99' if rng.random() < 0.5 else 'G98'
+        x0, y0, pitch = rng.uniform(0, 50), rng.uniform(0, 50), rng.choice((2.54, 5.0, 10.0))
+        columns = rng.randint(20, 60)
+        yield f"{cycle} X{x0:.3f} Y{y0:.3f} Z-{rng.uniform(1, 15):.3f} R2.000{peck} F{rng.randint(80, 300)}"
+        for hole in range(1, rng.randint(200, 2000)):
+            row, column = divmod(hole, columns)
+            yield f"X{x0 + column * pitch:.3f} Y{y0 + row * pitch:.3f}"
+        yield "G80"
+
+def _generate_arcs(rng, count):
+    """Gravação com longas sequências de arcos G2/G3 com palavra K (removida no modo mach3)."""
+    while True:
+        x, y = rng.uniform(0, 100), rng.uniform(0, 100)
+        yield "G0 Z5"
+        yield f"G0 X{x:.3f} Y{y:.3f}"
+        yield f"G1 Z-{rng.uniform(0.1, 0.5):.3f} F{rng.randint(100, 400)}"
+        for _ in range(rng.randint(50, 500)):
+            i, j = rng.uniform(-5, 5), rng.uniform(-5, 5)
+            x, y = x + rng.uniform(-3, 3), y + rng.uniform(-3, 3)
+            yield f"{rng.choice(('G2', 'G3'))} X{x:.3f} Y{y:.3f} I{i:.3f} J{j:.3f} K{rng.uniform(-1, 1):.3f}"
+
+def _generate_comments(rng, count):
+    """Programa com muitos comentários acentuados, de linha inteira e ao fim dos movimentos."""
+    words = ('furação', 'contorno', 'acabamento', 'peça', 'fixação', 'desbaste', 'ferramenta')
+    while True:
+        kind = rng.random()
+        if kind < 0.3:
+            yield f"({rng.choice(words).upper()} {rng.randint(1, 99)} - {rng.choice(words)})"
+        elif kind < 0.5:
+            yield f"; {rng.choice(words)} {rng.choice(words)} passo {rng.randint(1, 9)}"
+        else:
+            yield (f"G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} F{rng.randint(200, 2000)} "
+                   f"({rng.choice(words)})")
+
+BENCHMARK_WORKLOADS = {
+    'furos': _generate_holes,
+    'arcos': _generate_arcs,
+    'comentarios': _generate_comments,
+}
+BENCHMARK_MODES = ('parametros', 'linear', 'mach3')  # parametros: parse_gcode_params em todas as linhas
+
+def generate_workload(kind, line_count, path, seed=0):
+    """Grava em path um programa sintético do tipo kind com exatamente line_count linhas."""
+    prologue = ["%", "(PROGRAMA SINTETICO)", "G21 G90 G17", "G0 Z20"]
+    epilogue = ["G0 Z20", "M5", "M30"]
+    rng = random.Random(f"{kind}:{seed}")
+    body = itertools.islice(BENCHMARK_WORKLOADS[kind](rng, line_count),
+                            max(line_count - len(prologue) - len(epilogue), 0))
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for lines in (prologue, body, epilogue):
+            f.writelines(f"{line}\n" for line in lines)
+
+def _peak_rss_mb():
+    """Pico de memória residente do processo, em MB (None se a plataforma não informar)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # bytes no macOS, KB no Linux
+
+def _benchmark_case(input_path, output_path, mode, allocations):
+    """Tarefa de um processo novo: mede um modo sobre um arquivo gerado."""
+    collections = sum(stats['collections'] for stats in gc.get_stats())
+    if allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if mode == 'parametros':
+        with mapped_input(input_path) as (data, encoding):
+            line_count = 0
+            for line_count, line in enumerate(iter_mapped_lines(data, encoding), 1):
+                parse_gcode_params(line)
+    else:
+        line_count = convert_gcode_file(input_path, output_path, mode)
+    seconds = time.perf_counter() - start
+    result = {
+        'seconds': seconds,
+        'lines': line_count,
+        'peak_rss_mb': _peak_rss_mb(),
+        'gc_collections': sum(stats['collections'] for stats in gc.get_stats()) - collections,
+    }
+    if allocations:
+        result['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result
+
+def run_benchmarks(workloads, sizes, modes, repeat=3, allocations=False, log=print):
+    """Mede cada combinação (carga, nº de linhas, modo) e retorna os resultados (formato JSON).
+
+    Cada medição roda num processo novo, para que o pico de memória seja só dela;
+    o tempo considerado é o melhor de repeat execuções. Com allocations, o
+    tracemalloc também registra o pico de memória alocada pelo Python (o que
+    deixa a execução mais lenta, então o tempo não é comparável ao de uma
+    medição sem essa opção).
+    """
+    cases = []
+    with tempfile.TemporaryDirectory(prefix='conversor-desempenho-') as tmp_dir:
+        for kind in workloads:
+            for size in sizes:
+                input_path = os.path.join(tmp_dir, f"{kind}-{size}.nc")
+                generate_workload(kind, size, input_path)
+                size_bytes = os.path.getsize(input_path)
+                for mode in modes:
+                    runs = []
+                    for _ in range(repeat):
+                        with ProcessPoolExecutor(max_workers=1) as pool:
+                            runs.append(pool.submit(_benchmark_case, input_path, os.path.join(tmp_dir, 'saida.nc'),
+                                                    mode, allocations).result())
+                    best = min(runs, key=lambda run: run['seconds'])
+                    case = dict(best, workload=kind, mode=mode, bytes=size_bytes,
+                                lines_per_s=best['lines'] / best['seconds'] if best['seconds'] else 0.0,
+                                mb_per_s=size_bytes / 1e6 / best['seconds'] if best['seconds'] else 0.0)
+                    if case['peak_rss_mb'] is not None:
+                        case['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+                    cases.append(case)
+                    log(f"{kind:<12} {size:>9} linhas  {mode:<10} {case['lines_per_s']:>10.0f} linhas/s "
+                        f"{case['mb_per_s']:>7.2f} MB/s" +
+                        (f"  pico {case['peak_rss_mb']:.0f} MB" if case['peak_rss_mb'] is not None else ""))
+                os.unlink(input_path)
+    return {
+        'converter_version': CONVERTER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': cases,
+    }
+
+def compare_benchmarks(results, baseline, threshold=10.0):
+    """Lista as medições cuja vazão (linhas/s) caiu mais que threshold % em relação à base."""
+    base_cases = {(case['workload'], case['lines'], case['mode']): case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        base = base_cases.get((case['workload'], case['lines'], case['mode']))
+        if base is None or not base['lines_per_s']:
             continue
+        change = 100.0 * (case['lines_per_s'] / base['lines_per_s'] - 1.0)
+        if change < -threshold:
+            regressions.append(f"{case['workload']} {case['lines']} linhas {case['mode']}: "
+                               f"{base['lines_per_s']:.0f} -> {case['lines_per_s']:.0f} linhas/s ({change:+.1f}%)")
+    return regressions
 
-        if 'G98' in line_upper:
-            retract_mode = 'G98'
-        elif 'G99' in line_upper:
-            retract_mode = 'G99'
-        
-        # Tenta capturar a altura Z inicial segura
-        if line_upper.startswith('G0') and 'Z' in line_upper:
-            params = parse_gcode_params(line_upper)
-            if 'Z' in params:
-                # Considera como altura inicial se for um movimento Z isolado ou o primeiro
-                if 'X' not in params and 'Y' not in params:
-                    initial_z = params['Z']
-
-        # --- Conversão do G73 (Furação Pica-Pau de Alta Velocidade) ---
-        if line_upper.startswith('G73'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f, q = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F'), params.get('Q', 1.0)
-            
-            output_lines.append(f"; --- Conversão G73 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            
-            current_depth = r
-            while current_depth > z:
-                next_peck_depth = max(current_depth - q, z)
-                output_lines.append(f"G0 Z{current_depth + 1.0:.6f}\n")  # Retrai ligeiramente
-                output_lines.append(f"G1 Z{next_peck_depth:.6f} F{f:.6f}\n")
-                current_depth = next_peck_depth
-            
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G73 ---\n")
-
-        # --- Conversão do G76 (Mandrilamento Fino) ---
-        elif line_upper.startswith('G76'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            q = params.get('Q', 0.5)  # Deslocamento do fuso
-            
-            output_lines.append(f"; --- Conversão G76 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            output_lines.append(f"; M5 ; Parar fuso (orientado)\n")
-            output_lines.append(f"G0 X{x + q:.6f} Y{y:.6f}\n")  # Deslocamento
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")  # Retorna
-            output_lines.append(f"; M3 ; Religar fuso\n")
-            output_lines.append(f"; --- Fim da conversão G76 ---\n")
-
-        # --- Conversão do G81 (Furação Simples) ---
-        elif line_upper.startswith('G81'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-
-            output_lines.append(f"; --- Conversão G81 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G81 ---\n")
-
-        # --- Conversão do G82 (Furação com Temporização) ---
-        elif line_upper.startswith('G82'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            p = params.get('P', 0.0)  # Tempo de pausa em segundos
-            
-            output_lines.append(f"; --- Conversão G82 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            if p > 0:
-                output_lines.append(f"G4 P{p:.3f} ; Pausa de {p}s\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G82 ---\n")
-
-        # --- Conversão do G83 (Furação Pica-Pau) ---
-        elif line_upper.startswith('G83'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f, q = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F'), params.get('Q')
-            
-            output_lines.append(f"; --- Conversão G83 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            
-            current_depth = r
-            while current_depth > z:
-                next_peck_depth = max(current_depth - q, z)
-                output_lines.append(f"G0 Z{r:.6f}\n")  # Retorna ao plano R
-                output_lines.append(f"G1 Z{next_peck_depth:.6f} F{f:.6f}\n")
-                current_depth = next_peck_depth
-            
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G83 ---\n")
-
-        # --- Conversão do G84 (Rosqueamento com Macho) ---
-        elif line_upper.startswith('G84'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            
-            output_lines.append(f"; --- Conversão G84 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"; M3 ; Fuso horário\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            output_lines.append(f"; M4 ; Fuso anti-horário para retirada\n")
-            output_lines.append(f"G1 Z{r:.6f} F{f:.6f}\n")
-            output_lines.append(f"; M3 ; Fuso horário novamente\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G84 ---\n")
-
-        # --- Conversão do G85 (Mandrilamento/Alargamento) ---
-        elif line_upper.startswith('G85'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            
-            output_lines.append(f"; --- Conversão G85 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            output_lines.append(f"G1 Z{r:.6f} F{f:.6f}\n")  # Retrai com avanço
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G85 ---\n")
-
-        # --- Conversão do G86 (Mandrilamento com Parada) ---
-        elif line_upper.startswith('G86'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            
-            output_lines.append(f"; --- Conversão G86 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            output_lines.append(f"; M5 ; Parar fuso\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; M3 ; Religar fuso\n")
-            output_lines.append(f"; --- Fim da conversão G86 ---\n")
-
-        # --- Conversão do G87 (Mandrilamento Reverso) ---
-        elif line_upper.startswith('G87'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            q = params.get('Q', 0.5)  # Deslocamento
-            
-            output_lines.append(f"; --- Conversão G87 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"; M4 ; Fuso anti-horário\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            output_lines.append(f"; M5 ; Parar fuso\n")
-            output_lines.append(f"G0 X{x + q:.6f} Y{y:.6f}\n")  # Deslocamento
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"; M3 ; Fuso horário\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G87 ---\n")
-
-        # --- Conversão do G88 (Mandrilamento com Parada Manual) ---
-        elif line_upper.startswith('G88'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            p = params.get('P', 0.0)
-            
-            output_lines.append(f"; --- Conversão G88 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            if p > 0:
-                output_lines.append(f"G4 P{p:.3f}\n")
-            output_lines.append(f"; M0 ; Parada programada - retirar ferramenta manualmente\n")
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G88 ---\n")
-
-        # --- Conversão do G89 (Mandrilamento com Temporização) ---
-        elif line_upper.startswith('G89'):
-            params = parse_gcode_params(line_upper)
-            x, y, z, r, f = params.get('X'), params.get('Y'), params.get('Z'), params.get('R'), params.get('F')
-            p = params.get('P', 0.0)
-            
-            output_lines.append(f"; --- Conversão G89 para X{x} Y{y} ---\n")
-            output_lines.append(f"G0 X{x:.6f} Y{y:.6f}\n")
-            output_lines.append(f"G0 Z{r:.6f}\n")
-            output_lines.append(f"G1 Z{z:.6f} F{f:.6f}\n")
-            if p > 0:
-                output_lines.append(f"G4 P{p:.3f}\n")
-            output_lines.append(f"G1 Z{r:.6f} F{f:.6f}\n")  # Retrai com avanço
-            retract_z = initial_z if retract_mode == 'G98' else r
-            output_lines.append(f"G0 Z{retract_z:.6f}\n")
-            output_lines.append(f"; --- Fim da conversão G89 ---\n")
-
-        elif line_upper.startswith('G80'):
-            output_lines.append("; G80 ignorado (ciclo cancelado manualmente)\n")
-        
+def main(argv=None):
+    """Ponto de entrada da linha de comando (sem argumentos, abre a interface gráfica)."""
+    parser = argparse.ArgumentParser(prog='conversor-gcode.py', description="Conversor de G-code sem interface gráfica.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('lote', help="converte vários arquivos em paralelo")
+    batch.add_argument('entradas', nargs='+', help="arquivos (G-code ou .gcir, cujas linhas repassadas saem no texto "
+                            "canônico), globs (ex.: 'cam/**/*.nc') ou diretórios")
+    batch.add_argument('-m', '--modo', choices=sorted(CONVERTERS), default='linear', help="tipo de conversão")
+    batch.add_argument('-o', '--saida', required=True, help="diretório de saída")
+    batch.add_argument('-j', '--jobs', type=int, default=None, help="processos em paralelo (padrão: nº de CPUs)")
+    batch.add_argument('--verificar', choices=('mtime', 'hash', 'nenhum'), default='mtime',
+                       help="como detectar saídas já atualizadas (padrão: mtime)")
+    batch.add_argument('--cache', default=default_cache_dir(),
+                       help="diretório do cache de conversões (padrão: %(default)s)")
+    batch.add_argument('--sem-cache', action='store_true', help="não usa o cache de conversões")
+    batch.add_argument('--estatisticas', action='store_true',
+                       help="mede as etapas da conversão e mostra os contadores por ciclo ao final")
+    batch.add_argument('--otimizar-furos', action='store_true',
+                       help="reordena os furos de cada ciclo para encurtar os deslocamentos rápidos (só linear)")
+    batch.add_argument('--compactar', type=float, nargs='?', const=0.001, default=None, metavar='RESOLUCAO',
+                       help="reduz o tamanho das saídas, arredondando as coordenadas à resolução da máquina "
+                            "em mm (padrão: 0.001)")
+    batch.add_argument('--sem-comentarios', action='store_true', help="com --compactar, remove também os comentários")
+
+    chunked = commands.add_parser('blocos', help="converte um único arquivo grande dividido em blocos paralelos")
+    chunked.add_argument('entrada', help="arquivo de entrada")
+    chunked.add_argument('saida', help="arquivo de saída")
+    chunked.add_argument('-m', '--modo', choices=sorted(CONVERTERS), default='linear', help="tipo de conversão")
+    chunked.add_argument('-j', '--jobs', type=int, default=None, help="processos em paralelo (padrão: nº de CPUs)")
+    chunked.add_argument('--blocos', type=int, default=None, help="número de blocos (padrão: 4 por processo)")
+
+    bench = commands.add_parser('desempenho', help="mede a vazão dos conversores com programas sintéticos")
+    bench.add_argument('--cargas', nargs='+', choices=sorted(BENCHMARK_WORKLOADS), default=sorted(BENCHMARK_WORKLOADS),
+                       help="tipos de programa gerados (padrão: todos)")
+    bench.add_argument('--linhas', nargs='+', type=int, default=[10_000, 100_000],
+                       help="tamanhos em linhas (padrão: 10000 100000; até 10^7)")
+    bench.add_argument('--modos', nargs='+', choices=BENCHMARK_MODES, default=list(BENCHMARK_MODES),
+                       help="o que medir (padrão: todos)")
+    bench.add_argument('-r', '--repeticoes', type=int, default=3, help="execuções por medição; vale a melhor (padrão: 3)")
+    bench.add_argument('--alocacoes', action='store_true',
+                       help="registra também o pico de memória alocada (tracemalloc; deixa a medição mais lenta)")
+    bench.add_argument('--saida', help="grava os resultados neste arquivo JSON")
+    bench.add_argument('--base', help="resultados JSON de referência para detectar regressões")
+    bench.add_argument('--limite', type=float, default=10.0,
+                       help="queda máxima de linhas/s aceita em relação à base, em %% (padrão: 10)")
+
+    timing = commands.add_parser('tempo', help="estima o tempo de ciclo e os percursos de programas (requer NumPy)")
+    timing.add_argument('entradas', nargs='+', help="arquivos de G-code ou programas tokenizados (.gcir)")
+    timing.add_argument('--rapidos', nargs=3, type=float, default=[5000.0, 5000.0, 3000.0], metavar=('X', 'Y', 'Z'),
+                        help="velocidade dos rápidos por eixo em mm/min (padrão: 5000 5000 3000)")
+    timing.add_argument('--aceleracao', type=float, default=500.0, help="aceleração em mm/s² (padrão: 500)")
+    timing.add_argument('--avanco-maximo', type=float, default=None, help="limita os avanços F, em mm/min")
+
+    parsing = commands.add_parser('analisar', help="tokeniza um programa num arquivo binário compacto (.gcir)",
+                                  description="Tokeniza um programa num arquivo binário compacto (.gcir), aceito "
+                                              "também por 'lote' e 'tempo'. Ao converter um .gcir, as linhas "
+                                              "repassadas sem alteração saem no texto canônico do bloco (as "
+                                              "mesmas palavras e valores, com outra formatação: G0 X10 Y5 em "
+                                              "vez de G00X10.000Y5.000).")
+    parsing.add_argument('entrada', help="arquivo de G-code (ou programa já tokenizado)")
+    parsing.add_argument('saida', nargs='?', help="arquivo de saída (padrão: entrada com extensão .gcir)")
+    parsing.add_argument('-m', '--modo', choices=sorted(CONVERTERS), default=None,
+                         help="converte antes de gravar (a saída convertida fica tokenizada; as linhas "
+                              "repassadas ficam no texto canônico)")
+
+    watch = commands.add_parser('vigiar', help="serviço que converte os arquivos que aparecem em pastas vigiadas")
+    watch.add_argument('-p', '--pasta', nargs=3, action='append', required=True, metavar=('ENTRADA', 'SAIDA', 'MODO'),
+                       help="pasta vigiada, pasta de saída e modo (linear ou mach3); repita para vigiar várias")
+    watch.add_argument('-j', '--jobs', type=int, default=None, help="conversões em paralelo (padrão: nº de CPUs)")
+    watch.add_argument('--intervalo', type=float, default=1.0, help="segundos entre as varreduras (padrão: 1)")
+    watch.add_argument('--estabilidade', type=float, default=2.0,
+                       help="segundos sem mudar de tamanho nem de data para um arquivo ser convertido (padrão: 2)")
+    watch.add_argument('--metricas', type=float, default=60.0, help="segundos entre os relatórios de métricas (padrão: 60)")
+    watch.add_argument('--arquivo-metricas', help="grava as métricas neste arquivo JSON a cada relatório")
+    watch.add_argument('--cache', default=default_cache_dir(),
+                       help="diretório do cache de conversões (padrão: %(default)s)")
+    watch.add_argument('--sem-cache', action='store_true', help="não usa o cache de conversões")
+    watch.add_argument('--uma-vez', action='store_true', help="converte o que houver nas pastas e termina")
+
+    verify = commands.add_parser('verificar', help="simula o movimento e verifica o curso da máquina, rápidos e avanços")
+    verify.add_argument('entradas', nargs='+', help="arquivos de G-code (originais ou convertidos) ou programas tokenizados")
+    for axis in 'xyz':
+        verify.add_argument(f'--curso-{axis}', nargs=2, type=float, metavar=('MIN', 'MAX'),
+                            help=f"curso do eixo {axis.upper()} em mm (padrão: sem limite)")
+    verify.add_argument('--z-seguro', type=float, default=0.0,
+                        help="altura mínima dos rápidos em mm (padrão: 0, a superfície da peça)")
+    verify.add_argument('--exemplos', type=int, default=5, help="problemas mostrados por tipo (padrão: 5)")
+    verify.add_argument('--json', help="grava os relatórios neste arquivo JSON")
+
+    args = parser.parse_args(argv)
+    if args.command == 'verificar':
+        for path in args.entradas:
+            if not os.path.isfile(path):
+                parser.error(f"Arquivo não encontrado: {path}")
+        limits = {}
+        for axis in 'XYZ':
+            limit = getattr(args, f'curso_{axis.lower()}')
+            if limit is not None:
+                if limit[0] > limit[1]:
+                    parser.error(f"--curso-{axis.lower()}: o mínimo é maior que o máximo")
+                limits[axis] = tuple(limit)
+        reports = {}
+        for path in args.entradas:
+            verifier = verify_gcode_file(path, limits=limits, safe_z=args.z_seguro, examples=args.exemplos)
+            reports[path] = verifier.report()
+            print(f"{path}:")
+            print(verifier.format())
+        if args.json:
+            with atomic_output(args.json) as f:
+                json.dump(reports, f, indent=1)
+        return 0 if all(report['ok'] for report in reports.values()) else 1
+    if args.command == 'vigiar':
+        for input_dir, output_dir, mode in args.pasta:
+            if not os.path.isdir(input_dir):
+                parser.error(f"Pasta não encontrada: {input_dir}")
+            if mode not in CONVERTERS:
+                parser.error(f"modo inválido para {input_dir}: {mode} (use {' ou '.join(sorted(CONVERTERS))})")
+            if os.path.abspath(input_dir) == os.path.abspath(output_dir):
+                parser.error(f"a pasta de saída precisa ser diferente da de entrada: {input_dir}")
+        service = WatchService([WatchFolder(*folder) for folder in args.pasta], args.jobs, args.intervalo,
+                               args.estabilidade, None if args.sem_cache else args.cache)
+        try:
+            asyncio.run(service.run(args.uma_vez, args.metricas, args.arquivo_metricas))
+        except KeyboardInterrupt:
+            print("\nServiço interrompido")
+        return 1 if args.uma_vez and service.metrics.failed else 0
+    if args.command == 'analisar':
+        if not os.path.isfile(args.entrada):
+            parser.error(f"Arquivo não encontrado: {args.entrada}")
+        output_path = args.saida or os.path.splitext(args.entrada)[0] + PROGRAM_EXTENSION
+        if os.path.abspath(output_path) == os.path.abspath(args.entrada):
+            parser.error("a saída precisa ser diferente da entrada")
+        start = time.perf_counter()
+        if is_program_file(args.entrada):
+            program = ParsedProgram.load(args.entrada)
         else:
-            output_lines.append(line + '\n')
-    
-    # Adiciona rotina de retorno seguro ao final
-    output_lines.append("\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("; Rotina de Retorno Seguro para Home\n")
-    output_lines.append("; ========================================\n")
-    output_lines.append("G0 Z" + f"{initial_z:.6f}" + " ; Sobe Z para altura segura\n")
-    output_lines.append("G0 X0.000000 Y0.000000 ; Move para X0 Y0\n")
-    output_lines.append("; Z permanece em altura segura para evitar colisão\n")
-    output_lines.append("M5 ; Desliga fuso\n")
-    output_lines.append("M30 ; Fim do programa\n")
-    output_lines.append("; ========================================\n")
-            
-    return "".join(output_lines)
+            program = ParsedProgram.from_file(args.entrada)
+        try:
+            result = program if args.modo is None else convert_program(program, args.modo)
+            result.save(output_path)
+        finally:
+            program.close()
+        elapsed = time.perf_counter() - start
+        print(f"{args.entrada} -> {output_path}: {len(result)} blocos em {elapsed:.2f}s "
+              f"({result.nbytes / 1e6:.1f} MB; entrada {os.path.getsize(args.entrada) / 1e6:.1f} MB)")
+        return 0
+    if args.command == 'tempo':
+        if np is None:
+            parser.error("o subcomando tempo precisa do NumPy (pip install numpy)")
+        for path in args.entradas:
+            if not os.path.isfile(path):
+                parser.error(f"Arquivo não encontrado: {path}")
+        for path in args.entradas:
+            start = time.perf_counter()
+            estimate = estimate_gcode_file(path, rapid_rates=args.rapidos, acceleration=args.aceleracao,
+                                           max_feed=args.avanco_maximo)
+            elapsed = time.perf_counter() - start
+            print(f"{path}: {estimate.lines} linhas analisadas em {elapsed:.2f}s")
+            print(estimate.format())
+        return 0
+    if args.command == 'desempenho':
+        results = run_benchmarks(args.cargas, args.linhas, args.modos, args.repeticoes, args.alocacoes)
+        if args.saida:
+            with atomic_output(args.saida) as f:
+                json.dump(results, f, indent=1)
+        if args.base:
+            with open(args.base, 'r') as f:
+                regressions = compare_benchmarks(results, json.load(f), args.limite)
+            for regression in regressions:
+                print(f"REGRESSÃO {regression}")
+            if regressions:
+                return 1
+            print(f"Nenhuma regressão acima de {args.limite:g}% em relação a {args.base}")
+        return 0
+    if args.command == 'blocos':
+        if not os.path.isfile(args.entrada):
+            parser.error(f"Arquivo não encontrado: {args.entrada}")
+        start = time.perf_counter()
+        lines = convert_gcode_file_parallel(args.entrada, args.saida, args.modo, args.jobs, args.blocos)
+        elapsed = time.perf_counter() - start
+        print(f"{args.entrada} -> {args.saida}: {lines} linhas em {elapsed:.2f}s "
+              f"({lines / elapsed if elapsed else 0.0:.0f} linhas/s)")
+        return 0
+    if args.command == 'lote':
+        if args.otimizar_furos and args.modo != 'linear':
+            parser.error("--otimizar-furos só se aplica ao modo linear")
+        if args.sem_comentarios and args.compactar is None:
+            parser.error("--sem-comentarios só se aplica com --compactar")
+        if args.compactar is not None and args.compactar <= 0:
+            parser.error("a resolução de --compactar precisa ser positiva")
+        try:
+            pairs = collect_input_files(args.entradas, args.saida)
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+        summary = convert_batch(pairs, args.saida, args.modo, args.jobs, args.verificar,
+                                cache_dir=None if args.sem_cache else args.cache, profile=args.estatisticas,
+                                optimize=args.otimizar_furos, compact=args.compactar,
+                                keep_comments=not args.sem_comentarios)
+        print(f"\n{summary['converted']} convertidos, {summary['cached']} do cache, {summary['skipped']} pulados, "
+              f"{summary['failed']} com erro em {summary['seconds']:.2f}s "
+              f"({summary['lines_per_s']:.0f} linhas/s, {summary['mb_per_s']:.2f} MB/s)")
+        if args.estatisticas:
+            print("\nEstatísticas dos arquivos convertidos (soma dos processos):")
+            print(summary['stats'].format())
+        if args.otimizar_furos:
+            print(summary['hole_order'].format())
+        if args.compactar is not None:
+            print(summary['compaction'].format())
+        return 1 if summary['failed'] else 0
+
+# --- Tarefas em segundo plano (usadas pela interface gráfica) ---
+class TaskCancelled(Exception):
+    """Levantada dentro de uma BackgroundTask quando o usuário cancela a operação."""
+
+class BackgroundTask:
+    """Roda work(task) numa thread separada, sem nunca tocar nos widgets do Tk.
+
+    A thread só publica o progresso (fraction), o resultado e o erro; a interface
+    consulta esses campos pelo after() no próprio loop de eventos, já que o Tk não
+    pode ser usado a partir de outras threads. work deve chamar task.check() ou
+    task.progress() com frequência para que o cancelamento tenha efeito.
+    """
+
+    def __init__(self, work):
+        self.fraction = None
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+        self._thread.start()
+
+    def _run(self, work):
+        try:
+            self.result = work(self)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        """Interrompe o trabalho com TaskCancelled se o cancelamento foi pedido."""
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def progress(self, fraction):
+        self.check()
+        self.fraction = fraction
+
+def _report_progress(lines, total_chars, progress, every=4096):
+    """Repassa as linhas chamando progress(fração) a cada `every` linhas."""
+    done = 0
+    for count, line in enumerate(lines, 1):
+        done += len(line)
+        if count % every == 0:
+            progress(done / total_chars if total_chars else 0.0)
+        yield line
 
 # --- Interface Gráfica ---
+class LineView(tk.Frame):
+    """Visualizador somente leitura de um LineIndex que desenha só as linhas visíveis.
+
+    O tk.Text interno guarda apenas a janela visível mais MARGIN linhas de cada lado;
+    a barra de rolagem, a roda do mouse e o teclado movem essa janela sobre o índice.
+    on_scroll(top) é chamado quando o usuário rola a visualização.
+    """
+    MARGIN = 100
+
+    def __init__(self, master, on_scroll=None, **text_options):
+        super().__init__(master)
+        self.on_scroll = on_scroll
+        self.index = None
+        self.top = 0  # Primeira linha visível (base 0)
+        self.marked = None  # Linha destacada por "ir para a linha" ou pela busca
+        self._window = (0, 0)  # Linhas [início, fim) presentes no tk.Text
+        
+        self.scrollbar = tk.Scrollbar(self, command=self._scrollbar_command)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(self, wrap=tk.NONE, state=tk.DISABLED, **text_options)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.text.tag_configure('atual', background='#fff3a0')
+        
+        for sequence, lines in (('<Button-4>', -3), ('<Button-5>', 3), ('<Up>', -1), ('<Down>', 1)):
+            self.text.bind(sequence, lambda event, lines=lines: self.scroll_by(lines))
+        self.text.bind('<MouseWheel>', lambda event: self.scroll_by(-3 if event.delta > 0 else 3))
+        self.text.bind('<Prior>', lambda event: self.scroll_by(-self.rows()))
+        self.text.bind('<Next>', lambda event: self.scroll_by(self.rows()))
+        self.text.bind('<Control-Home>', lambda event: self.scroll_to(0))
+        self.text.bind('<Control-End>', lambda event: self.scroll_to(len(self.index or ())))
+        self.text.bind('<Configure>', lambda event: self.refresh())
+
+    def rows(self):
+        """Número de linhas que cabem na altura atual do widget."""
+        height = self.text.winfo_height()
+        if height <= 1:
+            return int(self.text.cget('height'))  # Ainda não desenhado
+        linespace = int(self.text.tk.call('font', 'metrics', self.text.cget('font'), '-linespace'))
+        return max(1, height // linespace)
+
+    def show(self, index):
+        """Passa a exibir index a partir da primeira linha."""
+        self.index = index
+        self.top = 0
+        self.marked = None
+        self._window = (0, 0)
+        self.refresh()
+
+    def clear(self):
+        self.index = None
+        self._window = (0, 0)
+        self.text.config(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.config(state=tk.DISABLED)
+        self.scrollbar.set(0.0, 1.0)
+
+    def scroll_to(self, line, notify=True):
+        """Rola até que line seja a primeira linha visível (limitado ao fim do arquivo)."""
+        if self.index is None:
+            return 'break'
+        self.top = max(0, min(line, len(self.index) - self.rows()))
+        self.refresh()
+        if notify and self.on_scroll is not None:
+            self.on_scroll(self.top)
+        return 'break'
+
+    def scroll_by(self, lines):
+        return self.scroll_to(self.top + lines)
+
+    def mark(self, line):
+        """Destaca line e rola até ela, deixando algumas linhas de contexto acima."""
+        if self.index is None or not len(self.index):
+            return
+        self.marked = max(0, min(line, len(self.index) - 1))
+        self.scroll_to(self.marked - self.rows() // 3)
+
+    def refresh(self):
+        """Redesenha a janela de linhas se a parte visível não estiver toda nela."""
+        if self.index is None:
+            return
+        rows = self.rows()
+        total = len(self.index)
+        first, last = self._window
+        if self.top < first or min(self.top + rows, total) > last:
+            first = max(0, self.top - self.MARGIN)
+            last = min(total, self.top + rows + self.MARGIN)
+            self.text.config(state=tk.NORMAL)
+            self.text.delete('1.0', tk.END)
+            self.text.insert('1.0', '\n'.join(self.index.lines(first, last)))
+            self.text.config(state=tk.DISABLED)
+            self._window = (first, last)
+        self.text.tag_remove('atual', '1.0', tk.END)
+        if self.marked is not None and first <= self.marked < last:
+            self.text.tag_add('atual', f'{self.marked - first + 1}.0', f'{self.marked - first + 2}.0')
+        self.text.yview(f'{self.top - first + 1}.0')
+        estimated = max(self.index.estimated_lines(), 1)
+        self.scrollbar.set(self.top / estimated, min(1.0, (self.top + rows) / estimated))
+
+    def _scrollbar_command(self, action, value, unit=None):
+        if action == 'moveto':
+            return self.scroll_to(int(float(value) * self.index.estimated_lines()) if self.index else 0)
+        step = self.rows() if unit == 'pages' else 1
+        return self.scroll_by(int(value) * step)
+
 class GCodeConverterApp:
+    PREVIEW_DELAY_MS = 300  # Espera após a última edição antes da pré-visualização
+    JOB_SLICE_S = 0.02  # Tempo máximo de cada fatia de conversão entre eventos da interface
+    POLL_MS = 50  # Intervalo de consulta das tarefas em segundo plano
+    INSERT_CHUNK_CHARS = 1 << 18  # Caracteres inseridos num widget por fatia
+    VIEWER_MIN_BYTES = 8 * 1024 * 1024  # Arquivos maiores abrem no visualizador somente leitura
+
     def __init__(self, root):
         self.root = root
         self.root.title("Conversor de G-code")
+        self.cache = ConversionCache()  # Recarregar o mesmo programa não refaz a conversão
         
         # Frame superior para labels
         top_frame = tk.Frame(root)
@@ -375,6 +4346,8 @@ class GCodeConverterApp:
                                width=50, height=25)
         self.text_in.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scroll_left.config(command=self.text_in.yview)
+        self.view_in = LineView(left_frame, on_scroll=self._sync_from_input,
+                                font=('Monaco', 11), width=50, height=25)
         
         # Frame direito com scrollbar
         right_frame = tk.Frame(middle_frame)
@@ -388,6 +4361,19 @@ class GCodeConverterApp:
                                 width=50, height=25)
         self.text_out.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scroll_right.config(command=self.text_out.yview)
+        self.view_out = LineView(right_frame, on_scroll=self._sync_from_output,
+                                 font=('Monaco', 11), width=50, height=25)
+        
+        # Arquivos grandes trocam os tk.Text pelos visualizadores (LineView)
+        self._panes = ((scroll_left, self.text_in, self.view_in), (scroll_right, self.text_out, self.view_out))
+        self.input_index = None  # LineIndex da entrada aberta no visualizador
+        self.output_index = None
+        self.line_map = None  # Linha de saída de cada linha da entrada (convert_gcode_file_mapped)
+        self._output_tmp = None  # Arquivo temporário com a saída exibida no visualizador
+        self._last_search = ''
+        self.encoding = None  # Codificação do arquivo carregado, usada ao salvar (None: a do sistema)
+        root.bind('<Control-g>', lambda event: self.goto_line())
+        root.bind('<Control-f>', lambda event: self.find_text())
         
         # Frame de botões - linha 1
         btn_frame1 = tk.Frame(root)
@@ -439,55 +4425,581 @@ class GCodeConverterApp:
                                           bd=3,
                                           height=3)
         self.convert_mach3_btn.pack(side=tk.LEFT, padx=5, pady=5, fill=tk.BOTH, expand=True)
+        
+        # Linha de status: pré-visualização ao vivo, progresso e cancelamento
+        status_frame = tk.Frame(root)
+        status_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        self.live_preview = tk.BooleanVar(value=False)
+        live_check = tk.Checkbutton(status_frame, text="Pré-visualização ao vivo",
+                                    variable=self.live_preview, command=self._schedule_preview,
+                                    font=('Helvetica', 10))
+        live_check.pack(side=tk.LEFT)
+        
+        self.show_stats = tk.BooleanVar(value=False)
+        stats_check = tk.Checkbutton(status_frame, text="Estatísticas",
+                                     variable=self.show_stats, command=self._toggle_stats,
+                                     font=('Helvetica', 10))
+        stats_check.pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.status = tk.Label(status_frame, text="", font=('Helvetica', 10), anchor='w')
+        self.status.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(10, 0))
+        
+        self.cancel_btn = tk.Button(status_frame, text="Cancelar", command=self.cancel_task,
+                                    font=('Helvetica', 10), state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        self.progress = ttk.Progressbar(status_frame, length=200, maximum=1.0)
+        self.progress.pack(side=tk.RIGHT)
+        
+        # Painel de estatísticas da última conversão (visível só com "Estatísticas" marcado)
+        self.stats_panel = tk.Label(root, text="", font=('Courier', 9), justify=tk.LEFT, anchor='w')
+        
+        # Reconversão incremental: o engine guarda a última conversão e as edições
+        # em text_in são registradas como um intervalo de linhas pendente
+        self.mode = 'linear'  # Modo da última conversão, seguido pela pré-visualização
+        self.engine = None  # IncrementalConverter pronto (None enquanto não houver)
+        self._dirty = None  # Linhas (início, fim) editadas desde o texto guardado no engine
+        self._edits = 0
+        self._out_version = 0
+        self._out_synced = False  # text_out mostra exatamente a saída do engine
+        self._preview_after = None
+        self._track_edits(self.text_in)
+        
+        # Trabalho em andamento: uma BackgroundTask (thread) ou um gerador fatiado pelo after()
+        self._task = None
+        self._job = None
+        self._job_after = None
+        self._busy_label = None
+        self._busy_started = 0.0
+
+    def _track_edits(self, widget):
+        """Intercepta o comando Tcl do widget para registrar as linhas alteradas."""
+        original = widget._w + '_original'
+        self.root.tk.call('rename', widget._w, original)
+        self.root.tk.createcommand(widget._w, lambda *args: self._text_in_command(original, *args))
+
+    def _text_in_command(self, original, *args):
+        call = self.root.tk.call
+        if not args or args[0] not in ('insert', 'delete', 'replace'):
+            return call((original,) + args)
+        if args[0] == 'insert':
+            indexes, chunks = args[1:2], args[2::2]
+        elif args[0] == 'replace':
+            indexes, chunks = args[1:3], args[3::2]
+        else:
+            indexes, chunks = args[1:], ()
+        try:
+            last_line = int(call(original, 'index', 'end-1c').split('.')[0])
+            lines = [min(int(call(original, 'index', index).split('.')[0]), last_line) for index in indexes]
+        except tk.TclError:
+            lines = None
+        if not lines:
+            return call((original,) + args)  # Chamada inválida: o próprio widget reporta o erro
+        result = call((original,) + args)
+        self._mark_dirty(min(lines) - 1, max(lines) - 1, sum(str(chunk).count('\n') for chunk in chunks))
+        return result
+
+    def _mark_dirty(self, first, last, inserted):
+        """Registra que as linhas first..last (base 0) viraram first..first+inserted."""
+        self._edits += 1
+        end = first + inserted + 1
+        if self._dirty is not None:
+            start, old_end = self._dirty
+            if old_end - 1 > last:
+                end = old_end + inserted - (last - first)
+            first = min(start, first)
+        self._dirty = (first, end)
+        self._schedule_preview()
+
+    def _schedule_preview(self):
+        """Reagenda a pré-visualização (debounce) se ela estiver ativa."""
+        if self._preview_after is not None:
+            self.root.after_cancel(self._preview_after)
+            self._preview_after = None
+        if self.live_preview.get():
+            self._preview_after = self.root.after(self.PREVIEW_DELAY_MS, self._preview)
+
+    def _preview(self):
+        """Atualiza a saída com as edições pendentes, em fatias que não travam a interface."""
+        self._preview_after = None
+        if self.input_index is not None:
+            return  # O visualizador de arquivos grandes é somente leitura
+        if self._task is not None or self._job is not None:
+            self._schedule_preview()  # Tenta de novo depois do trabalho em andamento
+            return
+        if not self.text_in.search(r'\S', '1.0', tk.END, regexp=True):
+            return
+        if self.engine is None or self.engine.mode != self.mode:
+            self._run_job(self._build_job(self.mode, show=True))
+        elif self._dirty is not None:
+            self._run_job(self._update_job())
+
+    def _build_job(self, mode, show):
+        """Gerador que reconstrói o engine a partir do texto atual de text_in."""
+        lines = self.text_in.get('1.0', 'end-1c').split('\n')
+        self.engine = None
+        self._dirty = None
+        out_version = self._out_version
+        engine = IncrementalConverter(mode)
+        yield from engine.iter_convert(lines)
+        self.engine = engine
+        if show:
+            yield from self._iter_show_output(engine.output())
+            self._out_synced = True
+        else:
+            self._out_synced = self._out_version == out_version and not self.text_out.edit_modified()
+        if self._dirty is not None:
+            self._schedule_preview()
+
+    def _update_job(self):
+        """Gerador que reconverte só as linhas editadas e corrige os trechos de text_out."""
+        patches = []
+        if self._dirty is not None:
+            start, end = self._dirty
+            total = int(self.text_in.index('end-1c').split('.')[0])
+            end = min(end, total)
+            old_end = end - (total - len(self.engine.lines))
+            if not 0 <= start <= old_end <= len(self.engine.lines):
+                yield from self._build_job(self.engine.mode, show=True)
+                return
+            new_lines = self.text_in.get(f'{start + 1}.0', f'{end}.end').split('\n')
+            edits = self._edits
+            patches = yield from self.engine.iter_update(start, old_end, new_lines)
+            if self._edits == edits:
+                self._dirty = None  # Senão o intervalo continua valendo (é uma cobertura das novas edições)
+
+        if not self._out_synced or self.text_out.edit_modified():
+            yield from self._iter_show_output(self.engine.output())
+            self._out_synced = True
+            return
+        for line, count, text in patches:
+            if count or text:
+                self.text_out.delete(f'{line + 1}.0', f'{line + count + 1}.0')
+                self.text_out.insert(f'{line + 1}.0', text)
+        self.text_out.edit_modified(False)
+
+    def _iter_show_output(self, output_text, stats=None):
+        """Substitui o conteúdo de text_out em blocos, devolvendo a fração já exibida.
+
+        Com stats, o tempo gasto no widget entra na etapa 'interface'.
+        """
+        self.text_out.delete('1.0', tk.END)
+        size = len(output_text)
+        for position in range(0, size, self.INSERT_CHUNK_CHARS):
+            start = time.perf_counter()
+            self.text_out.insert(tk.END, output_text[position:position + self.INSERT_CHUNK_CHARS])
+            if stats is not None:
+                stats.add_time('interface', time.perf_counter() - start)
+            yield (position + self.INSERT_CHUNK_CHARS) / size
+        self.text_out.edit_modified(False)
+        self._out_version += 1
+        self._out_synced = False
+
+    # --- Trabalho em segundo plano (progresso, estimativa de tempo e cancelamento) ---
+    def _set_busy(self, label):
+        """Com label, desabilita os botões e mostra o progresso; com None, volta ao normal."""
+        state = tk.NORMAL if label is None else tk.DISABLED
+        for button in (self.load_btn, self.save_btn, self.clear_btn,
+                       self.convert_linear_btn, self.convert_mach3_btn):
+            button.config(state=state)
+        self.cancel_btn.config(state=tk.DISABLED if label is None else tk.NORMAL)
+        self._busy_label = label
+        self._busy_started = time.monotonic()
+        self.progress['value'] = 0.0
+        self.status.config(text="" if label is None else f"{label}...")
+
+    def _show_progress(self, fraction):
+        """Atualiza a barra e a estimativa de tempo restante."""
+        if self._busy_label is None or fraction is None:
+            return
+        fraction = min(fraction, 1.0)
+        self.progress['value'] = fraction
+        text = f"{self._busy_label}... {fraction:.0%}"
+        elapsed = time.monotonic() - self._busy_started
+        if 0.02 < fraction < 1.0 and elapsed > 0.5:
+            text += f" (restam ~{elapsed * (1.0 - fraction) / fraction:.0f} s)"
+        self.status.config(text=text)
+
+    def _start_task(self, label, work, on_done, on_tick=None, on_cancel=None):
+        """Roda work(task) numa BackgroundTask; o resultado volta para on_done no loop do Tk.
+
+        on_tick(task), se informado, roda a cada consulta no próprio loop do Tk (por
+        exemplo, para inserir no widget o que a thread já leu) e retorna True enquanto
+        ainda houver trabalho pendente do lado da interface.
+        """
+        self._cancel_job()
+        self._set_busy(label)
+        self._task = (BackgroundTask(work), on_done, on_tick, on_cancel)
+        self.root.after(self.POLL_MS, self._poll_task)
+
+    def _poll_task(self):
+        task, on_done, on_tick, on_cancel = self._task
+        pending = on_tick(task) if on_tick is not None else False
+        if not task.done or pending:
+            self._show_progress(task.fraction)
+            self.root.after(self.POLL_MS, self._poll_task)
+            return
+        self._task = None
+        self._set_busy(None)
+        if isinstance(task.error, TaskCancelled):
+            if on_cancel is not None:
+                on_cancel()
+            self.status.config(text="Operação cancelada.")
+        elif task.error is not None:
+            messagebox.showerror("Erro", str(task.error))
+        else:
+            on_done(task.result)
+
+    def _run_job(self, job, label=None, on_done=None):
+        """Executa um gerador em fatias de JOB_SLICE_S pelo after(), sem travar a interface.
+
+        Valores float devolvidos pelo gerador são a fração concluída. Com label, o
+        trabalho usa a barra de progresso e desabilita os botões, como uma tarefa.
+        """
+        self._cancel_job()
+        if label is not None:
+            self._set_busy(label)
+        self._job = (job, label, on_done)
+        self._job_step()
+
+    def _job_step(self):
+        job, label, on_done = self._job
+        deadline = time.perf_counter() + self.JOB_SLICE_S
+        fraction = None
+        try:
+            while time.perf_counter() < deadline:
+                value = next(job)
+                if value is not None:
+                    fraction = value
+        except StopIteration:
+            self._job = self._job_after = None
+            self._set_busy(None)
+            if on_done is not None:
+                on_done()
+            return
+        except Exception as e:
+            self._job = self._job_after = None
+            self._set_busy(None)
+            if label is not None:
+                messagebox.showerror("Erro", str(e))
+            else:
+                self.status.config(text=f"Erro na conversão: {e}")
+            return
+        if label is None:
+            self.status.config(text="Convertendo...")
+        else:
+            self._show_progress(fraction)
+        self._job_after = self.root.after(1, self._job_step)
+
+    def _cancel_job(self):
+        """Interrompe o gerador em andamento (o engine só muda quando um trabalho termina)."""
+        if self._job is not None:
+            self.root.after_cancel(self._job_after)
+            self._job = self._job_after = None
+            self._set_busy(None)
+
+    def cancel_task(self):
+        """Botão Cancelar: interrompe a tarefa ou o trabalho fatiado em andamento."""
+        if self._task is not None:
+            self._task[0].cancel()
+        elif self._job is not None:
+            self._cancel_job()
+            self.status.config(text="Operação cancelada.")
+
+    def _reset_incremental(self):
+        """Descarta o engine e o trabalho em andamento (novo arquivo ou campos limpos)."""
+        self._cancel_job()
+        self.engine = None
+        self._dirty = None
+        self._out_synced = False
+
+    def _convert(self, mode, message):
+        """Converte text_in no modo pedido, só nas linhas editadas se já houver um engine nesse modo."""
+        self._cancel_job()
+        self.mode = mode
+        if self.input_index is not None:
+            self._convert_large_file(mode, message)
+            return
+        stats = ConversionStats() if self.show_stats.get() else None
+        if stats is None and self.engine is not None and self.engine.mode == mode:
+            self._run_job(self._update_job(), "Convertendo", lambda: messagebox.showinfo("Sucesso", message))
+            return
+        
+        # Sem engine (ou medindo): conversão completa numa thread (pelo cache), exibição
+        # em blocos e engine reconstruído em segundo plano para as próximas edições
+        input_text = self.text_in.get('1.0', tk.END)
+
+        def show(output_text):
+            self._run_job(self._iter_show_output(output_text, stats), "Exibindo", shown)
+
+        def shown():
+            self._show_stats(stats)
+            self._run_job(self._build_job(mode, show=False))
+            messagebox.showinfo("Sucesso", message)
+
+        self._start_task("Convertendo",
+                         lambda task: self.cache.convert_text(input_text, mode, task.progress, stats), show)
+
+    def _toggle_stats(self):
+        """Mostra ou esconde o painel de estatísticas abaixo da linha de status."""
+        if self.show_stats.get():
+            self.stats_panel.pack(fill=tk.X, padx=10, pady=(0, 10))
+        else:
+            self.stats_panel.pack_forget()
+
+    def _show_stats(self, stats):
+        """Exibe no painel o relatório da última conversão medida."""
+        if stats is not None:
+            self.stats_panel.config(text=stats.format())
+
+    # --- Arquivos grandes (visualizador somente leitura) ---
+    def _has_input(self):
+        return self.input_index is not None or bool(self.text_in.search(r'\S', '1.0', tk.END, regexp=True))
+
+    def _show_viewers(self, on):
+        """Troca os tk.Text editáveis pelos visualizadores de arquivos grandes, ou o contrário."""
+        for scrollbar, text, view in self._panes:
+            if on:
+                scrollbar.pack_forget()
+                text.pack_forget()
+                view.pack(fill=tk.BOTH, expand=True)
+            else:
+                view.pack_forget()
+                scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+                text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    def _open_large_file(self, filepath):
+        """Abre a entrada no visualizador; a primeira tela aparece antes de o índice terminar."""
+        self._reset_incremental()
+        self.text_in.delete('1.0', tk.END)
+        self.text_out.delete('1.0', tk.END)
+        index = LineIndex(filepath)
+        self.input_index = index
+        self._show_viewers(True)
+        self.view_in.show(index)
+
+        def indexed(_):
+            self.view_in.refresh()
+            self.status.config(text=f"{len(index)} linhas (arquivo grande, somente leitura)")
+
+        def show_indexed_lines(task):
+            self.view_in.refresh()
+            return False
+
+        self._start_task("Indexando", lambda task: index.build(task.progress), indexed,
+                         show_indexed_lines, self._close_large_file)
+
+    def _close_output(self):
+        """Descarta a saída exibida no visualizador e o arquivo temporário dela."""
+        self.view_out.clear()
+        if self.output_index is not None:
+            self.output_index.close()
+            os.unlink(self._output_tmp)
+        self.output_index = self.line_map = self._output_tmp = None
+
+    def _close_large_file(self):
+        """Fecha o visualizador e volta aos campos de texto editáveis."""
+        if self.input_index is None:
+            return
+        self._close_output()
+        self.view_in.clear()
+        self.input_index.close()
+        self.input_index = None
+        self._show_viewers(False)
+
+    def _convert_large_file(self, mode, message):
+        """Converte o arquivo aberto no visualizador para um temporário e o exibe ao lado."""
+        input_path = self.input_index.path
+        fd, output_path = tempfile.mkstemp(prefix='conversor-gcode-', suffix='.nc')
+        os.close(fd)
+
+        stats = ConversionStats() if self.show_stats.get() else None
+
+        def work(task):
+            try:
+                line_map = convert_gcode_file_mapped(input_path, output_path, mode,
+                                                     lambda fraction: task.progress(0.9 * fraction), stats)
+                index = LineIndex(output_path, sidecar=False)
+                try:
+                    index.build(lambda fraction: task.progress(0.9 + 0.1 * fraction))
+                except BaseException:
+                    index.close()
+                    raise
+            except BaseException:
+                os.unlink(output_path)
+                raise
+            return index, line_map
+
+        def converted(result):
+            self._close_output()
+            self.output_index, self.line_map = result
+            self._output_tmp = output_path
+            self.view_out.show(self.output_index)
+            self._sync_from_input(self.view_in.top)
+            self._show_stats(stats)
+            messagebox.showinfo("Sucesso", message)
+
+        self._start_task("Convertendo", work, converted)
+
+    def _copy_output(self, task, filepath):
+        """Tarefa de save_file para arquivos grandes: copia a saída temporária em blocos."""
+        size = max(os.path.getsize(self._output_tmp), 1)
+        with open(self._output_tmp, 'rb') as f_in, atomic_output(filepath, 'wb') as f_out:
+            for chunk in iter(lambda: f_in.read(1 << 20), b''):
+                task.progress(f_in.tell() / size)
+                f_out.write(chunk)
+        return filepath
+
+    def _sync_from_input(self, top):
+        """Rola a saída até a conversão da primeira linha visível da entrada."""
+        if self.line_map:
+            self.view_out.scroll_to(self.line_map[min(top, len(self.line_map) - 1)], notify=False)
+
+    def _sync_from_output(self, top):
+        """Rola a entrada até a linha que gerou a primeira linha visível da saída."""
+        if self.line_map:
+            self.view_in.scroll_to(max(0, bisect.bisect_right(self.line_map, top) - 1), notify=False)
+
+    def goto_line(self):
+        """Ctrl+G: vai para uma linha da entrada (no visualizador, a saída acompanha)."""
+        line = simpledialog.askinteger("Ir para a linha", "Número da linha:", parent=self.root, minvalue=1)
+        if line is None:
+            return
+        if self.input_index is not None:
+            self.view_in.mark(line - 1)
+        else:
+            self.text_in.mark_set(tk.INSERT, f'{line}.0')
+            self.text_in.see(tk.INSERT)
+            self.text_in.focus_set()
+
+    def find_text(self):
+        """Ctrl+F: busca o próximo trecho da entrada que contém o texto (sem diferenciar maiúsculas)."""
+        query = simpledialog.askstring("Buscar", "Texto:", parent=self.root, initialvalue=self._last_search)
+        if not query:
+            return
+        self._last_search = query
+        if self.input_index is not None:
+            start = self.view_in.top if self.view_in.marked is None else self.view_in.marked + 1
+            line = self.input_index.find(query, start)
+            if line is not None:
+                self.view_in.mark(line)
+        else:
+            line = self.text_in.search(query, 'insert+1c', nocase=True) or None
+            if line is not None:
+                self.text_in.tag_remove(tk.SEL, '1.0', tk.END)
+                self.text_in.tag_add(tk.SEL, line, f'{line}+{len(query)}c')
+                self.text_in.mark_set(tk.INSERT, line)
+                self.text_in.see(line)
+        if line is None:
+            self.status.config(text=f"Não encontrado: {query}")
 
     def load_file(self):
         filepath = filedialog.askopenfilename(filetypes=[("G-code files", "*.nc *.gcode *.txt"), ("All files", "*.*")])
         if not filepath:
             return
-        with open(filepath, 'r') as f:
+        self._close_large_file()
+        if os.path.getsize(filepath) >= self.VIEWER_MIN_BYTES:
+            self._open_large_file(filepath)
+            return
+        self._reset_incremental()
+        self.text_in.delete('1.0', tk.END)
+        size = max(os.path.getsize(filepath), 1)
+        chunks = queue.Queue(maxsize=8)
+        inserted = 0
+
+        def work(task):
+            # Decodifica o arquivo mapeado em blocos, na codificação detectada nos bytes,
+            # sem manter uma cópia extra do arquivo inteiro na memória
+            with mapped_input(filepath) as (data, encoding):
+                decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), True)
+                for start in range(0, len(data), 1 << 20):
+                    end = start + (1 << 20)
+                    chunk = decoder.decode(data[start:end], final=end >= len(data))
+                    while chunk:
+                        task.check()
+                        try:
+                            chunks.put(chunk, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+            return encoding
+
+        def insert_chunks(task):
+            # Insere no widget o que a thread já leu, uma fatia de tempo por consulta
+            nonlocal inserted
+            deadline = time.perf_counter() + self.JOB_SLICE_S
+            while time.perf_counter() < deadline:
+                try:
+                    chunk = chunks.get_nowait()
+                except queue.Empty:
+                    return False
+                self.text_in.insert(tk.END, chunk)
+                inserted += len(chunk)  # Caracteres ≈ bytes em G-code (ASCII)
+                task.fraction = min(inserted / size, 1.0)
+            return True
+
+        def loaded(encoding):
+            self.encoding = encoding
+            self._reset_incremental()
+            self._schedule_preview()
+
+        def cancelled():
             self.text_in.delete('1.0', tk.END)
-            self.text_in.insert('1.0', f.read())
+            self._reset_incremental()
+
+        self._start_task("Carregando", work, loaded, insert_chunks, cancelled)
 
     def convert_linear(self):
         """Converte G-code linearizando ciclos G8x."""
-        input_text = self.text_in.get('1.0', tk.END)
-        if not input_text.strip():
+        if not self._has_input():
             messagebox.showwarning("Aviso", "A caixa de texto de entrada está vazia.")
             return
-        output_text = convert_gcode_text(input_text)
-        self.text_out.delete('1.0', tk.END)
-        self.text_out.insert('1.0', output_text)
-        messagebox.showinfo("Sucesso", "Conversão Linear concluída!\nCiclos G8x foram linearizados.")
+        self._convert('linear', "Conversão Linear concluída!\nCiclos G8x foram linearizados.")
     
     def convert_mach3(self):
         """Converte G-code para Mach3: remove parâmetro K e adiciona rotinas de segurança."""
-        input_text = self.text_in.get('1.0', tk.END)
-        if not input_text.strip():
+        if not self._has_input():
             messagebox.showwarning("Aviso", "A caixa de texto de entrada está vazia.")
             return
-        output_text = convert_gcode_for_mach3(input_text)
-        self.text_out.delete('1.0', tk.END)
-        self.text_out.insert('1.0', output_text)
-        messagebox.showinfo("Sucesso", "Conversão Mach3 concluída!\nParâmetro K removido e rotinas de segurança adicionadas.")
+        self._convert('mach3', "Conversão Mach3 concluída!\nParâmetro K removido e rotinas de segurança adicionadas.")
 
     def save_file(self):
-        output_text = self.text_out.get('1.0', tk.END)
-        if not output_text.strip():
+        if self.output_index is None if self.input_index is not None \
+                else not self.text_out.search(r'\S', '1.0', tk.END, regexp=True):
             messagebox.showwarning("Aviso", "A caixa de texto de saída está vazia. Converta primeiro.")
             return
         filepath = filedialog.asksaveasfilename(defaultextension=".nc", filetypes=[("G-code files", "*.nc"), ("All files", "*.*")])
         if not filepath:
             return
-        with open(filepath, 'w') as f:
-            f.write(output_text)
-        messagebox.showinfo("Sucesso", f"Arquivo salvo em:\n{filepath}")
+        if self.input_index is not None:
+            self._start_task("Salvando", lambda task: self._copy_output(task, filepath),
+                             lambda path: messagebox.showinfo("Sucesso", f"Arquivo salvo em:\n{path}"))
+            return
+        output_text = self.text_out.get('1.0', tk.END)
+
+        def work(task):
+            # Grava em blocos num arquivo temporário; cancelar não deixa arquivo pela metade
+            with atomic_output(filepath, encoding=self.encoding) as f:
+                for position in range(0, len(output_text), 1 << 20):
+                    task.progress(position / len(output_text))
+                    f.write(output_text[position:position + (1 << 20)])
+            return filepath
+
+        self._start_task("Salvando", work,
+                         lambda path: messagebox.showinfo("Sucesso", f"Arquivo salvo em:\n{path}"))
 
     def clear_fields(self):
         """Limpa os campos de entrada e saída."""
+        self._close_large_file()
         self.text_in.delete('1.0', tk.END)
         self.text_out.delete('1.0', tk.END)
+        self.encoding = None
+        self._reset_incremental()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
     root = tk.Tk()
     app = GCodeConverterApp(root)
     root.mainloop()
\ No newline at end of file
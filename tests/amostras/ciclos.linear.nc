@@ -0,0 +1,141 @@
+; ========================================
+; Rotina de Inicialização
+; ========================================
+G21 ; Modo métrico (mm)
+G90 ; Modo absoluto
+G94 ; Avanço em mm/min
+G17 ; Plano XY
+M3 S8000 ; Liga spindle a 8000 RPM
+G4 P2.0 ; Aguarda 2 segundos para estabilizar
+; ========================================
+
+%
+(PECA DE EXEMPLO - TODOS OS CICLOS)
+G21 G90 G17
+G0 Z25.0
+T1 M6
+M3 S8000
+G98
+; --- Conversão G81 para X10.0 Y10.0 ---
+G0 X10.000000 Y10.000000
+G0 Z2.000000
+G1 Z-5.000000 F120.000000
+G0 Z25.000000
+; --- Fim da conversão G81 ---
+; --- Conversão G82 para X20.0 Y10.0 ---
+G0 X20.000000 Y10.000000
+G0 Z2.000000
+G1 Z-5.000000 F120.000000
+G4 P0.500 ; Pausa de 0.5s
+G0 Z25.000000
+; --- Fim da conversão G82 ---
+; --- Conversão G83 para X30.0 Y10.0 ---
+G0 X30.000000 Y10.000000
+G0 Z2.000000
+G1 Z-2.000000 F100.000000
+G0 Z2.000000
+G1 Z-6.000000 F100.000000
+G0 Z2.000000
+G1 Z-10.000000 F100.000000
+G0 Z2.000000
+G1 Z-12.000000 F100.000000
+G0 Z25.000000
+; --- Fim da conversão G83 ---
+; --- Conversão G73 para X40.0 Y10.0 ---
+G0 X40.000000 Y10.000000
+G0 Z3.000000
+G1 Z-0.500000 F100.000000
+G0 Z0.500000
+G1 Z-3.000000 F100.000000
+G0 Z-2.000000
+G1 Z-5.500000 F100.000000
+G0 Z-4.500000
+G1 Z-6.000000 F100.000000
+G0 Z25.000000
+; --- Fim da conversão G73 ---
+; G80 ignorado (ciclo cancelado manualmente)
+G99
+; --- Conversão G84 para X10.0 Y20.0 ---
+G0 X10.000000 Y20.000000
+G0 Z3.000000
+; M3 ; Fuso horário
+G1 Z-8.000000 F150.000000
+; M4 ; Fuso anti-horário para retirada
+G1 Z3.000000 F150.000000
+; M3 ; Fuso horário novamente
+G0 Z3.000000
+; --- Fim da conversão G84 ---
+; --- Conversão G85 para X20.0 Y20.0 ---
+G0 X20.000000 Y20.000000
+G0 Z3.000000
+G1 Z-8.000000 F90.000000
+G1 Z3.000000 F90.000000
+G0 Z3.000000
+; --- Fim da conversão G85 ---
+; --- Conversão G86 para X30.0 Y20.0 ---
+G0 X30.000000 Y20.000000
+G0 Z3.000000
+G1 Z-8.000000 F90.000000
+; M5 ; Parar fuso
+G0 Z3.000000
+; M3 ; Religar fuso
+; --- Fim da conversão G86 ---
+; --- Conversão G76 para X40.0 Y20.0 ---
+G0 X40.000000 Y20.000000
+G0 Z3.000000
+G1 Z-8.000000 F60.000000
+; M5 ; Parar fuso (orientado)
+G0 X40.300000 Y20.000000
+G0 Z3.000000
+G0 X40.000000 Y20.000000
+; M3 ; Religar fuso
+; --- Fim da conversão G76 ---
+; --- Conversão G87 para X50.0 Y20.0 ---
+G0 X50.000000 Y20.000000
+G0 Z3.000000
+; M4 ; Fuso anti-horário
+G1 Z-8.000000 F60.000000
+; M5 ; Parar fuso
+G0 X50.400000 Y20.000000
+G0 Z3.000000
+G0 X50.000000 Y20.000000
+; M3 ; Fuso horário
+G0 Z3.000000
+; --- Fim da conversão G87 ---
+; --- Conversão G88 para X60.0 Y20.0 ---
+G0 X60.000000 Y20.000000
+G0 Z3.000000
+G1 Z-8.000000 F60.000000
+G4 P1.000
+; M0 ; Parada programada - retirar ferramenta manualmente
+G0 Z3.000000
+; --- Fim da conversão G88 ---
+; --- Conversão G89 para X70.0 Y20.0 ---
+G0 X70.000000 Y20.000000
+G0 Z3.000000
+G1 Z-8.000000 F60.000000
+G4 P0.500
+G1 Z3.000000 F60.000000
+G0 Z3.000000
+; --- Fim da conversão G89 ---
+; G80 ignorado (ciclo cancelado manualmente)
+; contorno com arcos
+G0 X0 Y0
+G1 Z-1.0 F300
+G2 X10.0 Y0 I5.0 J0 K0.5
+G3 X0 Y0 I-5.0 J0 K-0.5
+G1 X5.0 Y5.0 F400 (fim do contorno)
+G0 Z25.0
+M5
+M30
+%
+
+; ========================================
+; Rotina de Retorno Seguro para Home
+; ========================================
+G0 Z25.000000 ; Sobe Z para altura segura
+G0 X0.000000 Y0.000000 ; Move para X0 Y0
+; Z permanece em altura segura para evitar colisão
+M5 ; Desliga fuso
+M30 ; Fim do programa
+; ========================================
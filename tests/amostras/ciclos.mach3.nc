@@ -0,0 +1,52 @@
+; ========================================
+; Rotina de Inicialização Mach3
+; ========================================
+G21 ; Modo métrico (mm)
+G90 ; Modo absoluto
+G94 ; Avanço em mm/min
+G17 ; Plano XY
+M3 S8000 ; Liga spindle a 8000 RPM
+G4 P2.0 ; Aguarda 2 segundos para estabilizar
+; ========================================
+
+%
+(PECA DE EXEMPLO - TODOS OS CICLOS)
+G21 G90 G17
+G0 Z25.0
+T1 M6
+M3 S8000
+G98
+G81 X10.0 Y10.0 Z-5.0 R2.0 F120.0
+G82 X20.0 Y10.0 Z-5.0 R2.0 P0.5 F120.0
+G83 X30.0 Y10.0 Z-12.0 R2.0 Q4.0 F100.0
+G73 X40.0 Y10.0 Z-6.0 R2.0 Q2.5 F100.0
+G80
+G99
+G84 X10.0 Y20.0 Z-8.0 R3.0 F150.0
+G85 X20.0 Y20.0 Z-8.0 R3.0 F90.0
+G86 X30.0 Y20.0 Z-8.0 R3.0 F90.0
+G76 X40.0 Y20.0 Z-8.0 R3.0 Q0.3 F60.0
+G87 X50.0 Y20.0 Z-8.0 R3.0 Q0.4 F60.0
+G88 X60.0 Y20.0 Z-8.0 R3.0 P1.0 F60.0
+G89 X70.0 Y20.0 Z-8.0 R3.0 P0.5 F60.0
+G80
+; contorno com arcos
+G0 X0 Y0
+G1 Z-1.0 F300
+G2 X10.0 Y0 I5.0 J0
+G3 X0 Y0 I-5.0 J0
+G1 X5.0 Y5.0 F400 (fim do contorno)
+G0 Z25.0
+M5
+M30
+%
+
+; ========================================
+; Rotina de Retorno Seguro para Home
+; ========================================
+G0 Z25.000000 ; Sobe Z para altura segura
+G0 X0.000000 Y0.000000 ; Move para X0 Y0
+; Z permanece em altura segura para evitar colisão
+M5 ; Desliga fuso
+M30 ; Fim do programa
+; ========================================
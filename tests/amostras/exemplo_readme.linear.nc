@@ -0,0 +1,40 @@
+; ========================================
+; Rotina de Inicialização
+; ========================================
+G21 ; Modo métrico (mm)
+G90 ; Modo absoluto
+G94 ; Avanço em mm/min
+G17 ; Plano XY
+M3 S1000 ; Liga spindle a 1000 RPM
+G4 P2.0 ; Aguarda 2 segundos para estabilizar
+; ========================================
+
+G98
+; --- Conversão G83 para X10.0 Y20.0 ---
+G0 X10.000000 Y20.000000
+G0 Z5.000000
+G1 Z2.000000 F100.000000
+G0 Z5.000000
+G1 Z-1.000000 F100.000000
+G0 Z5.000000
+G1 Z-4.000000 F100.000000
+G0 Z5.000000
+G1 Z-7.000000 F100.000000
+G0 Z5.000000
+G1 Z-10.000000 F100.000000
+G0 Z5.000000
+G1 Z-13.000000 F100.000000
+G0 Z5.000000
+G1 Z-15.000000 F100.000000
+G0 Z15.000000
+; --- Fim da conversão G83 ---
+
+; ========================================
+; Rotina de Retorno Seguro para Home
+; ========================================
+G0 Z15.000000 ; Sobe Z para altura segura
+G0 X0.000000 Y0.000000 ; Move para X0 Y0
+; Z permanece em altura segura para evitar colisão
+M5 ; Desliga fuso
+M30 ; Fim do programa
+; ========================================
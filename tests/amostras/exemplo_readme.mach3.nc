@@ -0,0 +1,23 @@
+; ========================================
+; Rotina de Inicialização Mach3
+; ========================================
+G21 ; Modo métrico (mm)
+G90 ; Modo absoluto
+G94 ; Avanço em mm/min
+G17 ; Plano XY
+M3 S1000 ; Liga spindle a 1000 RPM
+G4 P2.0 ; Aguarda 2 segundos para estabilizar
+; ========================================
+
+G98
+G83 X10.0 Y20.0 Z-15.0 R5.0 Q3.0 F100.0
+
+; ========================================
+; Rotina de Retorno Seguro para Home
+; ========================================
+G0 Z15.000000 ; Sobe Z para altura segura
+G0 X0.000000 Y0.000000 ; Move para X0 Y0
+; Z permanece em altura segura para evitar colisão
+M5 ; Desliga fuso
+M30 ; Fim do programa
+; ========================================
@@ -0,0 +1,2 @@
+G98
+G83 X10.0 Y20.0 Z-15.0 R5.0 Q3.0 F100.0
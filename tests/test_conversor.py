@@ -0,0 +1,1044 @@
+"""Testes do conversor: saídas de referência e equivalência entre os caminhos de conversão.
+
+Rodar a partir da raiz do repositório:
+
+    python3 -m unittest discover -s tests
+
+As saídas em amostras/*.linear.nc e amostras/*.mach3.nc foram geradas pela versão
+original do conversor (antes da conversão em fluxo) e não devem ser regeneradas
+pelo código atual: uma diferença nelas é uma mudança de comportamento.
+"""
+import asyncio
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLES_DIR = os.path.join(TESTS_DIR, 'amostras')
+SAMPLES = ('exemplo_readme', 'ciclos')
+WORKLOAD_LINES = 3000
+
+def _load_converter():
+    """Importa conversor-gcode.py, que o hífen no nome impede de importar diretamente."""
+    path = os.path.join(os.path.dirname(TESTS_DIR), 'conversor-gcode.py')
+    spec = importlib.util.spec_from_file_location('conversor_gcode', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # Os processos do lote acham as funções pelo nome do módulo
+    spec.loader.exec_module(module)
+    return module
+
+conversor = _load_converter()
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def _sample(name, suffix='nc'):
+    return _read(os.path.join(SAMPLES_DIR, f"{name}.{suffix}"))
+
+_workload_dir = None
+
+def setUpModule():
+    global _workload_dir
+    _workload_dir = tempfile.TemporaryDirectory(prefix='conversor-testes-')
+    # Os lotes usam ProcessPoolExecutor; sem fork, os processos filhos não acham
+    # pelo nome o módulo carregado de conversor-gcode.py
+    if 'fork' in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method('fork', force=True)
+
+def tearDownModule():
+    _workload_dir.cleanup()
+
+def workload(kind):
+    """Caminho de um programa sintético de generate_workload (gerado uma vez por execução)."""
+    path = os.path.join(_workload_dir.name, f"{kind}.nc")
+    if not os.path.exists(path):
+        conversor.generate_workload(kind, WORKLOAD_LINES, path)
+    return path
+
+class GoldenOutputTests(unittest.TestCase):
+    """As conversões dos exemplos continuam idênticas às da versão original."""
+
+    def test_linear(self):
+        for name in SAMPLES:
+            with self.subTest(name):
+                self.assertEqual(conversor.convert_gcode_text(_sample(name)), _sample(name, 'linear.nc'))
+
+    def test_mach3(self):
+        for name in SAMPLES:
+            with self.subTest(name):
+                self.assertEqual(conversor.convert_gcode_for_mach3(_sample(name)), _sample(name, 'mach3.nc'))
+
+class StreamingTests(unittest.TestCase):
+    """A conversão em fluxo (linha a linha) produz o mesmo texto que a conversão do texto inteiro."""
+
+    def test_iter_gcode_lines_matches_splitlines(self):
+        text = "G0 X1\r\nG1 Y2\n\n(comentário)\rM30"
+        self.assertEqual(list(conversor.iter_gcode_lines(text)), text.splitlines())
+
+    def test_generators_match_text_conversion(self):
+        for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+            text = _read(workload(kind))
+            for mode, convert in (('linear', conversor.convert_gcode_text),
+                                  ('mach3', conversor.convert_gcode_for_mach3)):
+                with self.subTest(kind=kind, mode=mode), open(workload(kind), 'r', encoding='utf-8') as f:
+                    streamed = "".join(conversor.CONVERTERS[mode](conversor.iter_gcode_lines(f)))
+                    self.assertEqual(streamed, convert(text))
+
+    def test_file_matches_text_conversion(self):
+        for name in SAMPLES:
+            for mode, golden in (('linear', 'linear.nc'), ('mach3', 'mach3.nc')):
+                with self.subTest(name=name, mode=mode), tempfile.TemporaryDirectory() as tmp:
+                    output_path = os.path.join(tmp, 'saida.nc')
+                    conversor.convert_gcode_file(os.path.join(SAMPLES_DIR, f"{name}.nc"), output_path, mode)
+                    self.assertEqual(_read(output_path), _sample(name, golden))
+
+def _body(output):
+    """Linhas convertidas de um programa, sem o cabeçalho e o rodapé de segurança."""
+    lines = output.splitlines()
+    start = lines.index('') + 1
+    return lines[start:len(lines) - 1 - lines[::-1].index('')]
+
+class ModalCycleTests(unittest.TestCase):
+    """Ciclos enlatados modais: blocos só com posição viram mais um furo do ciclo ativo."""
+
+    def test_bare_positions_repeat_the_cycle(self):
+        modal = "G0 Z10\nG81 X1 Y1 Z-2 R1 F100\nX2 Y1\nY3\n"
+        explicit = ("G0 Z10\nG81 X1 Y1 Z-2 R1 F100\nG81 X2 Y1 Z-2 R1 F100\n"
+                    "G81 X2 Y3 Z-2 R1 F100\n")
+        self.assertEqual(conversor.convert_gcode_text(modal), conversor.convert_gcode_text(explicit))
+
+    def test_new_words_change_the_definition(self):
+        body = _body(conversor.convert_gcode_text("G99\nG83 X0 Y0 Z-4 R1 Q2 F50\nX5 Z-6\n"))
+        second = body[body.index("; --- Conversão G83 para X5.0 Y0.0 ---"):]
+        self.assertIn("G1 Z-6.000000 F50.000000", second)
+        self.assertEqual(second[-2], "G0 Z1.000000")  # G99: volta ao plano R
+
+    def test_standalone_feed_applies_to_later_holes(self):
+        body = _body(conversor.convert_gcode_text("G81 X1 Y1 Z-2 R1 F100\nF300\nX3 Y1\n"))
+        second = body[body.index("; --- Conversão G81 para X3.0 Y1.0 ---"):]
+        self.assertIn("G1 Z-2.000000 F300.000000", second)
+        self.assertNotIn("G1 Z-2.000000 F100.000000", second)
+
+    def test_g80_and_motion_cancel_the_cycle(self):
+        for cancel in ("G80", "G0 Z10", "G1 X0 Y0 F200"):
+            with self.subTest(cancel):
+                body = _body(conversor.convert_gcode_text(f"G81 X1 Y1 Z-2 R1 F100\n{cancel}\nX9 Y9\n"))
+                self.assertEqual(body[-1], "X9 Y9")
+                self.assertEqual(sum(line.startswith("; --- Conversão G81") for line in body), 1)
+
+    def test_g80_with_other_words_passes_through(self):
+        lines = ["G17 G40 G80 G90", "G91 G28 Z0 G80", "G90 G80 G0 X10 Y10 Z50"]
+        program = "G81 X1 Y1 Z-2 R1 F100\n" + "\n".join(lines) + "\nX9 Y9\nG80\n"
+        body = _body(conversor.convert_gcode_text(program))
+        self.assertEqual(body[-5:], lines + ["X9 Y9", "; G80 ignorado (ciclo cancelado manualmente)"])
+        self.assertEqual(sum(line.startswith("; --- Conversão G81") for line in body), 1)
+        profiled = conversor.convert_gcode_text(program, stats=conversor.ConversionStats())
+        self.assertEqual(profiled, conversor.convert_gcode_text(program))
+
+    def test_incremental_repeats(self):
+        body = _body(conversor.convert_gcode_text("G0 X10 Y10\nG91\nG81 X5 Y0 Z-3 R-8 L3 F100\n"))
+        holes = [line for line in body if line.startswith("; --- Conversão G81")]
+        self.assertEqual(holes, [f"; --- Conversão G81 para X{x:.1f} Y10.0 ---" for x in (15, 20, 25)])
+        # Em G91, R é relativo à altura inicial (15) e Z ao plano R
+        self.assertIn("G0 Z7.000000", body)
+        self.assertIn("G1 Z4.000000 F100.000000", body)
+
+requires_fork = unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),
+                                    "os processos do lote precisam de fork para achar o módulo")
+
+def _cancel(fraction):
+    raise conversor.TaskCancelled()
+
+class AtomicOutputTests(unittest.TestCase):
+    """Saídas gravadas por atomic_output: ou o arquivo completo, ou nada (nem temporários)."""
+
+    def test_error_inside_leaves_nothing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'saida.nc')
+            with self.assertRaises(RuntimeError):
+                with conversor.atomic_output(path) as f:
+                    f.write("G0 X1\n")
+                    raise RuntimeError("falha no meio")
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_open_error_is_not_hidden(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'nao-existe', 'saida.nc')
+            with self.assertRaises(FileNotFoundError) as raised:
+                with conversor.atomic_output(path):
+                    pass
+            self.assertIsNone(raised.exception.__context__)
+
+    def test_cancelled_conversion_leaves_no_output(self):
+        text = _read(workload('furos')) * 3  # Mais que as 4096 linhas entre duas chamadas de progress
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'entrada.nc')
+            _write(input_path, text)
+            with self.assertRaises(conversor.TaskCancelled):
+                conversor.convert_gcode_file_mapped(input_path, os.path.join(tmp, 'saida.nc'), progress=_cancel)
+            cache = conversor.ConversionCache(os.path.join(tmp, 'cache'))
+            with self.assertRaises(conversor.TaskCancelled):
+                cache.convert_text(text, 'linear', progress=_cancel)
+            self.assertEqual(os.listdir(tmp), ['entrada.nc'])
+
+    @requires_fork
+    def test_cancelled_watch_service_leaves_no_partial_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_dir, output_dir = os.path.join(tmp, 'entrada'), os.path.join(tmp, 'saida')
+            os.makedirs(input_dir)
+            text = _read(workload('furos')) * 20
+            for index in range(4):
+                _write(os.path.join(input_dir, f'peca{index}.nc'), text)
+            service = conversor.WatchService([conversor.WatchFolder(input_dir, output_dir, 'linear')], jobs=1,
+                                             interval=0.01, settle=0, log=lambda message: None)
+
+            async def cancel_while_converting():
+                task = asyncio.create_task(service.run())
+                while service.metrics.running == 0 and not task.done():
+                    await asyncio.sleep(0.005)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            asyncio.run(cancel_while_converting())
+            expected = conversor.convert_gcode_text(text)
+            outputs = os.listdir(output_dir) if os.path.isdir(output_dir) else []
+            self.assertLess(len(outputs), 4)  # A fila foi interrompida antes do fim
+            for name in outputs:
+                self.assertRegex(name, r'^peca\d\.nc$')  # Nenhum temporário esquecido
+                self.assertEqual(_read(os.path.join(output_dir, name)), expected)
+
+    @requires_fork
+    def test_failed_batch_item(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            good, bad = os.path.join(tmp, 'bom.nc'), os.path.join(tmp, 'ruim.nc')
+            _write(good, _sample('ciclos'))
+            _write(bad, "G0 Z10\nG81 X1 Y1 Z-2 F100\n")  # Sem R
+            output_dir = os.path.join(tmp, 'saida')
+            messages = []
+            summary = conversor.convert_batch(conversor.collect_input_files([good, bad], output_dir), output_dir,
+                                              jobs=1, check='nenhum', log=messages.append)
+            self.assertEqual((summary['converted'], summary['failed']), (1, 1))
+            self.assertEqual(os.listdir(output_dir), ['bom.nc'])
+            self.assertEqual(_read(os.path.join(output_dir, 'bom.nc')), _sample('ciclos', 'linear.nc'))
+            self.assertTrue(any('ERRO' in message and 'Linha 2' in message for message in messages))
+
+def _applied_state(text):
+    """Estado modal depois de aplicar as linhas uma a uma, como na conversão serial."""
+    state = conversor.ModalState()
+    for block in conversor.tokenize_gcode(text.splitlines()):
+        cycle = state.apply(block)
+        if cycle is not None and cycle != 80:
+            state.holes(block)
+    return state
+
+# Linhas que a passada de estado da conversão em blocos lê sem tokenizar, ou quase
+TRICKY_PROGRAM = """\
+(CABEÇALHO X99 Y99 F1)
+G21 G90 G17
+G0 Z20
+g0 x1 y2 ; X50 F9
+G01 X3 Y4 F250 (Y77
+G2 X5 Y5 I1 J0 K0.5 R3
+Z-1 Q2
+G99 G81 X10 Y10 Z-2 R1 F100
+X11 (X90)
+F300
+Y12
+x13 y14
+L2 X15
+G80
+G91
+G1 X1 Y1 F90
+G90 G0 Z12
+G83 X20 Y20 Z-5 R1 Q1.5 F80
+G91 X1
+G90
+X21 Y21
+G0 X0 Y0
+"""
+
+class ParallelConversionTests(unittest.TestCase):
+    """Conversão em blocos paralelos: a mesma saída, byte a byte, que a conversão serial."""
+
+    @requires_fork
+    def test_matches_serial_conversion(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            serial, parallel = os.path.join(tmp, 'serial.nc'), os.path.join(tmp, 'blocos.nc')
+            for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+                for mode in ('linear', 'mach3'):
+                    with self.subTest(kind=kind, mode=mode):
+                        conversor.convert_gcode_file(workload(kind), serial, mode)
+                        conversor.convert_gcode_file_parallel(workload(kind), parallel, mode, jobs=2, chunk_count=7)
+                        with open(serial, 'rb') as a, open(parallel, 'rb') as b:
+                            self.assertEqual(a.read(), b.read())
+
+    def test_scan_tracks_the_serial_state(self):
+        texts = [_read(workload(kind)) for kind in sorted(conversor.BENCHMARK_WORKLOADS)]
+        texts += [TRICKY_PROGRAM, TRICKY_PROGRAM.replace('\n', '\r\n'), TRICKY_PROGRAM.replace('G80\n', 'G80\x0c\n')]
+        for index, text in enumerate(texts):
+            lines = text.splitlines(keepends=True)
+            for size in (1, 3, 500, len(lines)):
+                with self.subTest(text=index, size=size):
+                    state = conversor.ModalState()
+                    line_count = 0
+                    for start in range(0, len(lines), size):
+                        line_count += state.scan("".join(lines[start:start + size]), line_count + 1)
+                    self.assertEqual(line_count, len(text.splitlines()))
+                    self.assertEqual(vars(state), vars(_applied_state(text)))
+
+    def test_scan_reports_errors_at_the_same_line(self):
+        text = "G0 Z10\nG81 X1 Y1 Z-2 R1 F100\nX2\nG0 X0 Y0\nG83 X1 Y1 Z-2 R1 F100\n"
+        with self.assertRaisesRegex(ValueError, "^Linha 5: ciclo G83 sem Q"):
+            conversor.ModalState().scan(text)
+        with self.assertRaisesRegex(ValueError, "^Linha 1: posição X/Y do furo não definida"):
+            conversor.ModalState().scan("G81 X1 Z-2 R1 F100\nY2\n")
+
+class ConversionCacheTests(unittest.TestCase):
+    """Cache de conversões: acerto, erro e invalidação quando CONVERTER_VERSION muda."""
+
+    def test_text_cache_hit_and_version_invalidation(self):
+        text = _sample('ciclos')
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = conversor.ConversionCache(tmp)
+            for mode in ('linear', 'mach3'):
+                expected = _sample('ciclos', f'{mode}.nc')
+                self.assertEqual(cache.convert_text(text, mode), expected)
+                self.assertEqual(cache.convert_text(text, mode), expected)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            with mock.patch.object(conversor, 'CONVERTER_VERSION', conversor.CONVERTER_VERSION + '-teste'):
+                self.assertEqual(cache.convert_text(text, 'linear'), _sample('ciclos', 'linear.nc'))
+            self.assertEqual((cache.hits, cache.misses), (2, 3))
+            self.assertEqual(len(os.listdir(tmp)), 3)
+
+    def test_digests_depend_on_version_and_mode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'entrada.nc')
+            _write(path, _sample('ciclos'))
+            digests = {conversor.file_digest(path, 'linear'), conversor.file_digest(path, 'mach3'),
+                       conversor.text_digest(_sample('ciclos'), 'linear')}
+            with mock.patch.object(conversor, 'CONVERTER_VERSION', conversor.CONVERTER_VERSION + '-teste'):
+                digests |= {conversor.file_digest(path, 'linear'), conversor.text_digest(_sample('ciclos'), 'linear')}
+            self.assertEqual(len(digests), 5)
+
+    @requires_fork
+    def test_batch_reuses_and_invalidates_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path, cache_dir = os.path.join(tmp, 'ciclos.nc'), os.path.join(tmp, 'cache')
+            _write(input_path, _sample('ciclos'))
+
+            def run(output_dir):
+                summary = conversor.convert_batch(conversor.collect_input_files([input_path], output_dir),
+                                                  output_dir, jobs=1, check='nenhum', log=lambda message: None,
+                                                  cache_dir=cache_dir)
+                self.assertEqual(_read(os.path.join(output_dir, 'ciclos.nc')), _sample('ciclos', 'linear.nc'))
+                return summary['converted'], summary['cached']
+
+            self.assertEqual(run(os.path.join(tmp, 'a')), (1, 0))
+            self.assertEqual(run(os.path.join(tmp, 'b')), (0, 1))
+            # Os processos do lote nascem por fork já com a versão trocada
+            with mock.patch.object(conversor, 'CONVERTER_VERSION', conversor.CONVERTER_VERSION + '-teste'):
+                self.assertEqual(run(os.path.join(tmp, 'c')), (1, 0))
+
+def _patched(text, patches):
+    """Aplica as correções de IncrementalConverter.update ao texto convertido anterior."""
+    lines = text.splitlines(keepends=True)
+    for start, count, new_text in patches:
+        lines[start:start + count] = new_text.splitlines(keepends=True)
+    return "".join(lines)
+
+# Edições que mexem no estado modal das linhas seguintes
+EDITS = ('G91', 'G90', 'F777', 'G98', 'G99', 'G0 Z30', 'G80', 'G81 X1 Y2 Z-3 R2 F120', 'X5 Y6', '(comentário)',
+         'G83 X3 Y3 Z-9 R1 Q2 F60', 'Z-4', 'S12000 M3')
+
+class IncrementalConverterTests(unittest.TestCase):
+    """Reconversão incremental: depois de cada edição, a saída é a da conversão completa."""
+
+    def check_edits(self, kind, mode, seed):
+        generator = random.Random(seed)
+        lines = _read(workload(kind)).splitlines()
+        converter = conversor.IncrementalConverter(mode)
+        converter.update(0, 0, lines)
+        output = converter.output()
+        for _ in range(25):
+            start = generator.randrange(len(lines) + 1)
+            old_end = min(len(lines), start + generator.choice((0, 0, 1, 3, 40)))
+            new_lines = [generator.choice(EDITS) for _ in range(generator.choice((0, 1, 1, 2)))]
+            try:
+                patches = converter.update(start, old_end, new_lines)
+            except ValueError:
+                self.assertEqual(converter.output(), output)  # Edição inválida: nada muda
+                continue
+            lines[start:old_end] = new_lines
+            expected = "".join(conversor.CONVERTERS[mode](lines))
+            self.assertEqual(converter.output(), expected)
+            self.assertEqual(_patched(output, patches), expected)
+            output = expected
+
+    def test_edits_match_full_conversion(self):
+        for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+            for mode in ('linear', 'mach3'):
+                with self.subTest(kind=kind, mode=mode):
+                    self.check_edits(kind, mode, seed=len(kind))
+
+    def test_failed_edit_changes_nothing(self):
+        converter = conversor.IncrementalConverter('linear')
+        converter.update(0, 0, _sample('ciclos').splitlines())
+        output = converter.output()
+        with self.assertRaises(ValueError):
+            converter.update(0, 0, ['G81 X1 Y1 Z-2 F100'])
+        self.assertEqual(converter.output(), output)
+        self.assertEqual(converter.output(), _sample('ciclos', 'linear.nc'))
+
+class MappedInputTests(unittest.TestCase):
+    """Entrada por mmap (LineIndex e convert_gcode_file_mapped): a mesma saída da conversão em fluxo."""
+
+    def test_mapped_matches_file_conversion(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            streamed, mapped = os.path.join(tmp, 'fluxo.nc'), os.path.join(tmp, 'mmap.nc')
+            for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+                for mode in ('linear', 'mach3'):
+                    with self.subTest(kind=kind, mode=mode):
+                        conversor.convert_gcode_file(workload(kind), streamed, mode)
+                        line_map = conversor.convert_gcode_file_mapped(workload(kind), mapped, mode)
+                        with open(streamed, 'rb') as a, open(mapped, 'rb') as b:
+                            self.assertEqual(a.read(), b.read())
+                        self.assertEqual(len(line_map), len(_read(workload(kind)).splitlines()))
+                        self.assertEqual(list(line_map), sorted(line_map))
+
+    def test_latin1_input_keeps_its_encoding(self):
+        text = "(Furação da peça)\n" + _sample('ciclos')
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'entrada.nc')
+            with open(input_path, 'wb') as f:
+                f.write(text.encode('latin-1'))
+            for mode in ('linear', 'mach3'):
+                with self.subTest(mode=mode):
+                    expected = "".join(conversor.CONVERTERS[mode](conversor.iter_gcode_lines(text))).encode('latin-1')
+                    for convert in (conversor.convert_gcode_file, conversor.convert_gcode_file_mapped):
+                        output_path = os.path.join(tmp, f'{convert.__name__}.nc')
+                        convert(input_path, output_path, mode)
+                        with open(output_path, 'rb') as f:
+                            self.assertEqual(f.read(), expected)
+
+    def test_line_index(self):
+        text = _read(workload('comentarios'))
+        lines = text.splitlines()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'entrada.nc')
+            _write(path, text)
+            index = conversor.LineIndex(path).build()
+            try:
+                self.assertEqual(len(index), len(lines))
+                self.assertEqual(index.lines(0, len(index)), lines)
+                self.assertEqual(index.lines(100, 105), lines[100:105])
+                self.assertEqual(index.line_of(index.offsets[42] + 1), 42)
+                self.assertEqual(index.find(lines[2000].strip().upper(), 1500), 2000)
+            finally:
+                index.close()
+            reloaded = conversor.LineIndex(path).build()  # Do arquivo auxiliar .idx
+            try:
+                self.assertEqual(list(reloaded.offsets), list(index.offsets))
+            finally:
+                reloaded.close()
+
+def _cycle_heights(text):
+    """Altura inicial, retração e avanço que o ModalState usa em cada bloco de ciclo."""
+    state = conversor.ModalState()
+    heights = []
+    for block in conversor.tokenize_gcode(text.splitlines()):
+        cycle = state.apply(block)
+        if cycle is not None and cycle != 80:
+            heights.append((block.params.get('X'), state.initial_z, state.retract_z(), state.cycle_params['F']))
+    return heights
+
+def _motion_summary(text):
+    """O que a compactação não pode mudar: alturas dos ciclos, percursos e a verificação."""
+    estimate = conversor.estimate_gcode_text(text).report()
+    verify = conversor.verify_gcode_text(text, examples=10 ** 6).report()
+    return {
+        'cycles': _cycle_heights(text),
+        'distances': [round(estimate[key], 6) for key in ('rapid_distance', 'feed_distance', 'arc_distance')],
+        'dwell': estimate['dwell_seconds'],
+        'unfed': estimate['unfed_moves'],
+        'holes': verify['holes'],
+        'envelope': verify['envelope'],
+        # Rápidos juntados num só contam uma vez: só as mensagens distintas são comparadas
+        'issues': {kind: sorted({message for _, message in issues}) for kind, issues in verify['issues'].items()},
+    }
+
+# Rápidos só em Z, com e sem G0 explícito, entre ciclos em G98 (a retração é a altura inicial)
+HEIGHT_PROGRAM = """\
+G90 G98
+G0 X0 Y0 Z17
+G0 Z17
+G81 X1 Y1 Z-2 R1 F100
+X2
+G80
+G0 X5 Z30
+G0 X5 Y0 Z22
+G81 X1 Y1 Z-2 R1
+G80
+G0 Z12
+Z40
+G81 X3 Y3 Z-2 R1
+G1 X3 Y3 Z40 F50
+G80
+G0 X6 Y6 Z2
+G0 Z8
+G0 Z9
+G82 X4 Y4 Z-1 R2 P0.5 F80
+G80
+"""
+
+class OutputCompactorTests(unittest.TestCase):
+    """Saída compactada, lida de novo (tempo, verificar, ModalState): o mesmo movimento da original."""
+
+    def assert_same_motion(self, text, resolution=0.001):
+        compacted = "".join(conversor.OutputCompactor(resolution).compact([text]))
+        self.assertEqual(_motion_summary(compacted), _motion_summary(text))
+        return compacted
+
+    def test_converted_workloads(self):
+        for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+            text = _read(workload(kind))
+            for mode in ('linear', 'mach3'):
+                with self.subTest(kind=kind, mode=mode):
+                    self.assert_same_motion("".join(conversor.CONVERTERS[mode](conversor.iter_gcode_lines(text))))
+
+    def test_samples(self):
+        for name in SAMPLES:
+            for suffix in ('nc', 'linear.nc', 'mach3.nc'):
+                with self.subTest(name=name, suffix=suffix):
+                    self.assert_same_motion(_sample(name, suffix))
+
+    def test_isolated_rapids_keep_g0(self):
+        compacted = self.assert_same_motion(HEIGHT_PROGRAM).splitlines()
+        self.assertEqual(compacted[:3], ['G90 G98', 'G0 X0 Y0 Z17', 'G0 Z17'])
+        self.assertIn('G0 Z12', compacted)
+        self.assertNotIn('G0 Z8', compacted)  # G0 Z isolados seguidos se juntam no último
+        self.assertIn('G0 Z9', compacted)
+        for line in compacted:
+            if line.startswith('G0 Z') or line.startswith('Z'):
+                self.assertIn(line, HEIGHT_PROGRAM.splitlines())
+
+def _reparsed(text):
+    """Códigos G, palavras e comentário de cada bloco do texto, sem a formatação."""
+    return [(block.g_codes, block.params, block.comment)
+            for block in conversor.ParsedProgram.from_lines(text.splitlines()).blocks()]
+
+class ParsedProgramTests(unittest.TestCase):
+    """Programa tokenizado (.gcir): a conversão dele é a do texto canônico dos seus blocos.
+
+    Em relação ao texto de origem, só muda a formatação das linhas repassadas.
+    """
+
+    def programs(self):
+        for kind in sorted(conversor.BENCHMARK_WORKLOADS):
+            yield kind, conversor.ParsedProgram.from_file(workload(kind))
+        for name in SAMPLES:
+            yield name, conversor.ParsedProgram.from_lines(_sample(name).splitlines())
+
+    def test_conversion_matches_canonical_text(self):
+        for name, program in self.programs():
+            canonical = [block.text for block in program.blocks()]
+            for mode in ('linear', 'mach3'):
+                with self.subTest(name=name, mode=mode):
+                    expected = "".join(conversor.CONVERTERS[mode](canonical))
+                    self.assertEqual("".join(conversor.iter_convert_program(program, mode)), expected)
+                    converted = conversor.convert_program(program, mode)
+                    reparsed = conversor.ParsedProgram.from_lines(expected.splitlines())
+                    self.assertEqual([block.text for block in converted.blocks()],
+                                     [block.text for block in reparsed.blocks()])
+
+    def test_conversion_matches_source(self):
+        # Muda só a formatação das linhas repassadas: relidas, as duas saídas têm os mesmos blocos
+        sources = [(name, _sample(name)) for name in SAMPLES]
+        sources.append(('arcos com K', "G0 Z10\nG2 X1 Y1 I1 J0 K2\nG3X1Y1I1K2\nG03 X1 Y0 I1 K-.5\n"
+                                       "N5 G00X10.000Y5.000 (a) ; b\n%\n"))
+        for name, text in sources:
+            program = conversor.ParsedProgram.from_lines(text.splitlines())
+            for mode in ('linear', 'mach3'):
+                with self.subTest(name=name, mode=mode):
+                    expected = "".join(conversor.CONVERTERS[mode](text.splitlines()))
+                    output = "".join(conversor.iter_convert_program(program, mode))
+                    self.assertEqual(len(output.splitlines()), len(expected.splitlines()))
+                    self.assertEqual(_reparsed(output), _reparsed(expected))
+                    if name == 'arcos com K' and mode == 'mach3':
+                        self.assertIn("G3X1Y1I1K2\n", output)  # O K sem espaço fica, como no texto
+                        self.assertIn("G03 X1 Y0 I1 K-.5\n", output)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, program in self.programs():
+                with self.subTest(name=name):
+                    path = os.path.join(tmp, name + conversor.PROGRAM_EXTENSION)
+                    program.save(path)
+                    loaded = conversor.ParsedProgram.load(path)
+                    try:
+                        self.assertEqual(len(loaded), len(program))
+                        for ours, theirs in zip(program.blocks(), loaded.blocks()):
+                            self.assertEqual((theirs.line_number, theirs.g_codes, theirs.params, theirs.text),
+                                             (ours.line_number, ours.g_codes, ours.params, ours.text))
+                        for mode in ('linear', 'mach3'):
+                            output_path = os.path.join(tmp, f'{name}.{mode}.nc')
+                            conversor.convert_gcode_file(path, output_path, mode)
+                            self.assertEqual(_read(output_path),
+                                             "".join(conversor.iter_convert_program(program, mode)))
+                    finally:
+                        loaded.close()
+
+class CycleErrorTests(unittest.TestCase):
+    """Ciclos incompletos: a conversão para na linha do ciclo com o parâmetro que falta."""
+
+    CASES = (
+        ("G81 X1 Y1 Z-2 F100", "ciclo G81 sem R"),
+        ("G82 X1 Y1 R1 P0.5 F100", "ciclo G82 sem Z"),
+        ("G85 X1 Y1 Z-2 R1", "ciclo G85 sem avanço F"),
+        ("G83 X1 Y1 Z-2 R1 F100", "ciclo G83 sem Q"),
+        ("G73 X1 Y1 Z-2 R1 Q0 F100", "ciclo G73 com Q0: a bicada precisa ser positiva"),
+    )
+
+    def test_linear_conversion_rejects_incomplete_cycles(self):
+        for cycle, message in self.CASES:
+            text = f"G90\nG0 Z10\n{cycle}\n"
+            with self.subTest(cycle=cycle):
+                with self.assertRaisesRegex(ValueError, f"^Linha 3: {message}"):
+                    conversor.convert_gcode_text(text)
+                with self.assertRaisesRegex(ValueError, f"^Linha 3: {message}"):
+                    conversor.convert_program(conversor.ParsedProgram.from_lines(text.splitlines()))
+
+    def test_missing_word_in_a_later_definition(self):
+        # R, Z e F continuam modais na troca de ciclo; o G81 não tinha Q
+        text = "G0 Z10\nG81 X1 Y1 Z-2 R1 F100\nX2\nG83 X3 Y3\n"
+        with self.assertRaisesRegex(ValueError, "^Linha 4: ciclo G83 sem Q"):
+            conversor.convert_gcode_text(text)
+
+    def test_g73_without_q_pecks_1mm(self):
+        # Como na versão original: sem Q, o G73 faz bicadas de 1 mm
+        text = "G0 Z10\nG73 X1 Y1 Z-2.5 R1 F100\nG80\n"
+        output = conversor.convert_gcode_text(text)
+        pecks = [line for line in _body(output) if line.startswith("G1 Z")]
+        self.assertEqual(pecks, ["G1 Z0.000000 F100.000000", "G1 Z-1.000000 F100.000000",
+                                 "G1 Z-2.000000 F100.000000", "G1 Z-2.500000 F100.000000"])
+        self.assertEqual(output, conversor.convert_gcode_text(text.replace("F100", "Q1 F100")))
+        self.assertEqual("".join(conversor.iter_convert_program(conversor.ParsedProgram.from_lines(text.splitlines()))),
+                         output)
+        verifier = conversor.verify_gcode_text(text)
+        self.assertTrue(verifier.ok)
+        self.assertIn((2, "ciclo G73 sem Q: bicadas de 1 mm (padrão)"), verifier.issues['aviso'])
+
+    def test_verifier_reports_incomplete_cycles(self):
+        for cycle, message in self.CASES:
+            with self.subTest(cycle=cycle):
+                verifier = conversor.verify_gcode_text(f"G90\nG0 Z10\n{cycle}\n")
+                self.assertFalse(verifier.ok)
+                self.assertEqual(verifier.issues['ciclo'][0][0], 3)
+                self.assertTrue(verifier.issues['ciclo'][0][1].startswith(message))
+
+def _footer_z(output):
+    """Altura do retorno seguro no rodapé de uma conversão."""
+    return next(line.split()[1] for line in output.splitlines() if 'Sobe Z' in line)
+
+# Rápidos a 100 mm/s em X e Y e 50 mm/s em Z, aceleração de 1000 mm/s²: cada trecho
+# leva distância / velocidade + velocidade / aceleração (ou 2 * sqrt(distância / aceleração)
+# quando é curto demais para chegar à velocidade)
+ESTIMATE_OPTIONS = {'rapid_rates': (6000.0, 6000.0, 3000.0), 'acceleration': 1000.0}
+ESTIMATE_PROGRAM = """\
+G0 X0 Y0 Z10
+G0 X30 Y40
+G1 Z0 F600
+
+G1 X60
+G2 X80 Y40 I10 J0
+G3 X60 Y40 R10
+G4 P2.5
+G0 Z10
+G0 X60.5
+"""
+
+class CycleTimeEstimateTests(unittest.TestCase):
+    """Percursos e tempos conhecidos, e os mesmos números pelo texto, pelo arquivo e pelo programa tokenizado."""
+
+    def test_known_program(self):
+        report = conversor.estimate_gcode_text(ESTIMATE_PROGRAM, **ESTIMATE_OPTIONS).report()
+        expected = {
+            'lines': 10,
+            'segments': 8,  # O primeiro G0 parte de posição desconhecida e não conta distância
+            'rapid_distance': 50.0 + 10.0 + 0.5,
+            'feed_distance': 10.0 + 30.0 + 20 * math.pi,
+            'arc_distance': 20 * math.pi,  # Dois meios círculos de raio 10 (por I/J e por R)
+            # X30 Y40: o eixo mais lento manda (Y, 0.5s); Z10 a 50 mm/s; 0.5 mm não chega à velocidade
+            'rapid_seconds': 0.5 + (10.0 / 50 + 50 / 1000.0) + 2 * math.sqrt(0.5 / 1000.0),
+            # F600 = 10 mm/s, com 0.01s de aceleração e frenagem em cada trecho
+            'feed_seconds': (1.0 + 0.01) + (3.0 + 0.01) + 2 * (math.pi + 0.01),
+            'dwell_seconds': 2.5,
+            'unfed_moves': 0,
+        }
+        expected['total_seconds'] = expected['rapid_seconds'] + expected['feed_seconds'] + expected['dwell_seconds']
+        self.assertEqual(report.keys(), expected.keys())
+        for key, value in expected.items():
+            with self.subTest(key):
+                self.assertAlmostEqual(report[key], value, places=9)
+
+    def test_feed_limits(self):
+        text = "G0 X0 Y0 Z0\nG1 X30 F600\nG1 X40\nG2 X40 Y0 I0.01 J0\n"
+        limited = conversor.estimate_gcode_text(text, max_feed=300.0, acceleration=1000.0).report()
+        # 5 mm/s no máximo; no círculo de raio 0.01 a aceleração centrípeta limita a sqrt(1000 * 0.01)
+        speed = math.sqrt(10.0)
+        circle = 2 * math.pi * 0.01
+        self.assertAlmostEqual(limited['feed_seconds'], (6.0 + 0.005) + (2.0 + 0.005) +
+                               (circle / speed + speed / 1000.0), places=9)
+        unfed = conversor.estimate_gcode_text("G0 X0 Y0 Z0\nG1 X10\nG1 X20 F600\n").report()
+        self.assertEqual(unfed['unfed_moves'], 1)
+        self.assertAlmostEqual(unfed['feed_distance'], 20.0)
+        self.assertAlmostEqual(unfed['feed_seconds'], 1.0 + 0.02)
+
+    def test_canned_cycles_are_expanded(self):
+        text = "G0 X0 Y0\nG0 Z10\nG81 X10 Y0 R1 Z-2 F600\nG80\n"
+        expanded = conversor.estimate_gcode_text(text, **ESTIMATE_OPTIONS).report()
+        # Até o furo, desce ao R, fura até Z-2 e volta à altura inicial (G98)
+        self.assertAlmostEqual(expanded['rapid_distance'], 10.0 + 9.0 + 12.0)
+        self.assertAlmostEqual(expanded['feed_distance'], 3.0)
+        self.assertAlmostEqual(expanded['feed_seconds'], 0.3 + 0.01)
+        body = "\n".join(_body(conversor.convert_gcode_text(text))) + "\n"
+        self.assertEqual(conversor.estimate_gcode_text(body, **ESTIMATE_OPTIONS).report(), expanded)
+
+    def assert_same_estimate(self, estimate, expected):
+        report = estimate.report()
+        expected = expected.report()
+        self.assertEqual(report['lines'], expected['lines'])
+        for key in expected:
+            self.assertAlmostEqual(report[key], expected[key], places=6, msg=key)
+
+    def test_program_matches_text(self):
+        texts = [('estimativa', ESTIMATE_PROGRAM)]
+        for name in SAMPLES:
+            texts += [(name, _sample(name)), (name + '.linear', _sample(name, 'linear.nc')),
+                      (name + '.mach3', _sample(name, 'mach3.nc'))]
+        texts += [(kind, _read(workload(kind))) for kind in sorted(conversor.BENCHMARK_WORKLOADS)]
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, text in texts:
+                with self.subTest(name):
+                    expected = conversor.estimate_gcode_text(text, **ESTIMATE_OPTIONS)
+                    program = conversor.ParsedProgram.from_lines(conversor.iter_gcode_lines(text))
+                    self.assert_same_estimate(conversor.estimate_program(program, **ESTIMATE_OPTIONS), expected)
+                    path = os.path.join(tmp, name + '.nc')
+                    _write(path, text)
+                    self.assert_same_estimate(conversor.estimate_gcode_file(path, **ESTIMATE_OPTIONS), expected)
+                    program.save(path + conversor.PROGRAM_EXTENSION)
+                    self.assert_same_estimate(
+                        conversor.estimate_gcode_file(path + conversor.PROGRAM_EXTENSION, **ESTIMATE_OPTIONS),
+                        expected)
+
+class TokenizerTests(unittest.TestCase):
+    """Onde a leitura por palavras diverge do conversor original (que comparava o texto da linha).
+
+    Cada caso registra o resultado do original e o atual; as amostras de GoldenOutputTests
+    não passam por nenhum deles.
+    """
+
+    # Linha, altura do rodapé no original, altura atual
+    INITIAL_Z = (
+        ("G0 Z5", "Z5.000000", "Z5.000000"),
+        ("G00 Z7", "Z7.000000", "Z7.000000"),
+        ("N10 G0 Z5", "Z15.000000", "Z5.000000"),  # O original só olhava linhas começadas por G0
+        ("G90 G0 Z8", "Z15.000000", "Z8.000000"),
+        ("G0 Z-.5", "Z15.000000", "Z-0.500000"),  # Números sem o zero ou com sinal +
+        ("G0 Z+5", "Z15.000000", "Z5.000000"),
+        ("G0 Z 3", "Z15.000000", "Z3.000000"),
+        ("G0 Z9 (X1)", "Z15.000000", "Z9.000000"),  # X/Y de comentários não contam
+        ("G01 Z-1", "Z-1.000000", "Z15.000000"),  # O original tomava o mergulho G01 como altura segura
+    )
+
+    # Linha, saída Mach3 no original, saída atual
+    ARC_K = (
+        ("G2 X1 Y1 I1 J0 K2", "G2 X1 Y1 I1 J0", "G2 X1 Y1 I1 J0"),
+        ("G02 X1 Y1 I1 J0 K2", "G02 X1 Y1 I1 J0 K2", "G02 X1 Y1 I1 J0"),  # O original procurava "G2" no texto
+        ("G20 X1 K2", "G20 X1", "G20 X1 K2"),
+        ("G28 X0 K1", "G28 X0", "G28 X0 K1"),
+    )
+
+    def test_initial_z_detection(self):
+        for line, _, expected in self.INITIAL_Z:
+            text = f"{line}\nG0 X1 Y1\n"
+            with self.subTest(line):
+                self.assertEqual(_footer_z(conversor.convert_gcode_text(text)), expected)
+                self.assertEqual(_footer_z(conversor.convert_gcode_for_mach3(text)), expected)
+
+    def test_mach3_removes_k_only_from_arcs(self):
+        for line, _, expected in self.ARC_K:
+            with self.subTest(line):
+                self.assertEqual(_body(conversor.convert_gcode_for_mach3(line + "\n")), [expected])
+
+class ConversionStatsTests(unittest.TestCase):
+    """Contadores e tempos por etapa de ConversionStats."""
+
+    CYCLES = "G0 Z10\nG81 X1 Y1 R1 Z-2 F100\nX2 Y2\nG80\nG83 X0 Y0 R1 Z-5 Q1 F100\nG80\n"
+    # Só as palavras K efetivamente removidas contam
+    ARCS = "G0 Z10\nG2 X1 Y1 I1 J0 K2\nG3X1Y1I1K2\nG21 K1\nG03 X1 Y0 I1 K-0.5\n"
+
+    def test_cycle_counters(self):
+        stats = conversor.ConversionStats()
+        output = conversor.convert_gcode_text(self.CYCLES, stats=stats)
+        self.assertEqual(output, conversor.convert_gcode_text(self.CYCLES))
+        self.assertEqual(stats.cycles, {'G81': {'blocks': 2, 'holes': 2, 'output_lines': 12},
+                                        'G83': {'blocks': 1, 'holes': 1, 'output_lines': 16}})
+        self.assertEqual(stats.k_words_removed, 0)
+        self.assertEqual((stats.conversions, stats.input_lines, stats.input_bytes),
+                         (1, 6, len(self.CYCLES.encode('utf-8'))))
+        self.assertEqual((stats.output_lines, stats.output_bytes), (output.count('\n'), len(output.encode('utf-8'))))
+
+    def test_stage_timings(self):
+        stats = conversor.ConversionStats()
+        conversor.convert_gcode_text(self.CYCLES, stats=stats)
+        self.assertEqual(set(stats.stage_seconds), {'tokenizacao', 'estado modal', 'modelos', 'formatacao'})
+        self.assertTrue(all(seconds >= 0 for seconds in stats.stage_seconds.values()))
+        self.assertLessEqual(sum(stats.stage_seconds.values()), stats.total_seconds)
+        stats = conversor.ConversionStats()
+        conversor.convert_gcode_for_mach3(self.ARCS, stats=stats)
+        self.assertEqual(set(stats.stage_seconds), {'tokenizacao'})
+        self.assertEqual(stats.cycles, {})
+
+    def test_k_words_removed(self):
+        stats = conversor.ConversionStats()
+        output = conversor.convert_gcode_for_mach3(self.ARCS, stats=stats)
+        self.assertEqual(stats.k_words_removed, 2)
+        self.assertEqual(_body(output).count("G3X1Y1I1K2"), 1)  # Sem espaço antes do K, fica como no original
+        self.assertIn("Palavras K removidas: 2", stats.format())
+
+    def test_merge_and_report(self):
+        first = conversor.ConversionStats()
+        conversor.convert_gcode_text(self.CYCLES, stats=first)
+        second = conversor.ConversionStats()
+        conversor.convert_gcode_for_mach3(self.ARCS, stats=second)
+        total = conversor.ConversionStats()
+        for stats in (first, second, first):
+            total.merge(json.loads(json.dumps(stats.report())))  # Como chega de outro processo
+        report = total.report()
+        self.assertEqual(report['conversions'], 3)
+        self.assertEqual(report['cycles']['G81'], {'blocks': 4, 'holes': 4, 'output_lines': 24})
+        self.assertEqual(report['k_words_removed'], 2)
+        self.assertEqual(report['input_lines'], 2 * first.input_lines + second.input_lines)
+        self.assertEqual(report['output_bytes'], 2 * first.output_bytes + second.output_bytes)
+        self.assertAlmostEqual(report['stages']['tokenizacao'],
+                               2 * first.stage_seconds['tokenizacao'] + second.stage_seconds['tokenizacao'])
+        self.assertAlmostEqual(report['amplification'], report['output_bytes'] / report['input_bytes'])
+
+def _hole_lines(output):
+    """Comentários de início de cada furo expandido, na ordem da saída."""
+    return [line for line in output.splitlines() if line.startswith("; --- Conversão G")]
+
+class HoleOrderOptimizerTests(unittest.TestCase):
+    """Ordem dos furos: uma permutação, com o último furo no lugar, nunca mais longa que a original."""
+
+    def assert_valid_order(self, points, start=None):
+        optimizer = conversor.HoleOrderOptimizer()
+        order = optimizer.optimize(points, start)
+        self.assertEqual(sorted(order), list(range(len(points))))
+        if points:
+            self.assertEqual(order[-1], len(points) - 1)
+            if start is None:
+                self.assertEqual(order[0], 0)
+        before = conversor._path_length(points, list(range(len(points))), start)
+        after = conversor._path_length(points, order, start)
+        self.assertLessEqual(after, before + 1e-9)
+        self.assertEqual(optimizer.report()['holes'], len(points))
+        self.assertAlmostEqual(optimizer.rapid_before, before)
+        self.assertAlmostEqual(optimizer.rapid_after, after)
+        return order
+
+    def test_random_groups(self):
+        rng = random.Random(7)
+        for count in (3, 4, 10, 200):
+            points = [(rng.uniform(0, 100), rng.uniform(0, 100)) for _ in range(count)]
+            for start in (None, (0.0, 0.0), (50.0, 50.0)):
+                with self.subTest(count=count, start=start):
+                    self.assert_valid_order(points, start)
+
+    def test_grid_gets_shorter(self):
+        # Uma grade em ordem aleatória: o percurso cai a menos da metade
+        points = [(x, y) for x in range(10) for y in range(10)]
+        random.Random(3).shuffle(points)
+        order = self.assert_valid_order(points, (0.0, 0.0))
+        self.assertLess(conversor._path_length(points, order, (0.0, 0.0)),
+                        conversor._path_length(points, list(range(len(points))), (0.0, 0.0)) / 2)
+
+    def test_degenerate_groups(self):
+        cases = {
+            'nenhum furo': [],
+            'um furo': [(1.0, 1.0)],
+            'dois furos': [(5.0, 5.0), (0.0, 0.0)],
+            'mesmo ponto': [(2.0, 2.0)] * 5,
+            'pontos repetidos': [(0.0, 0.0), (9.0, 9.0), (0.0, 0.0), (9.0, 9.0), (1.0, 1.0), (1.0, 1.0)],
+        }
+        for name, points in cases.items():
+            for start in (None, (3.0, 3.0)):
+                with self.subTest(name, start=start):
+                    order = self.assert_valid_order(points, start)
+                    if len(points) <= 2:
+                        self.assertEqual(order, list(range(len(points))))
+
+    def test_conversion_keeps_every_hole(self):
+        text = _read(workload('furos'))
+        optimizer = conversor.HoleOrderOptimizer()
+        optimized = conversor.convert_gcode_text(text, optimizer=optimizer)
+        original = conversor.convert_gcode_text(text)
+        self.assertEqual(sorted(_hole_lines(optimized)), sorted(_hole_lines(original)))
+        self.assertEqual(_footer_z(optimized), _footer_z(original))
+        self.assertGreater(optimizer.groups, 0)
+        self.assertLessEqual(optimizer.rapid_after, optimizer.rapid_before)
+        self.assertLessEqual(conversor.estimate_gcode_text(optimized).report()['rapid_distance'],
+                             conversor.estimate_gcode_text(original).report()['rapid_distance'] + 1e-6)
+
+class CycleTemplateCacheTests(unittest.TestCase):
+    """Cache LRU dos modelos de ciclo: acertos, erros e descarte do usado há mais tempo."""
+
+    PARAMS = {'R': 1.0, 'Z': -2.0, 'F': 100.0}
+
+    def test_hits_and_misses(self):
+        cache = conversor.CycleTemplateCache()
+        render = cache.get(81, self.PARAMS, 10.0)
+        self.assertIs(cache.get(81, self.PARAMS, 10.0), render)  # Mesmo dicionário do ModalState
+        self.assertIs(cache.get(81, dict(self.PARAMS), 10.0), render)  # Definição igual, outro dicionário
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        cache.get(81, dict(self.PARAMS, F=200.0), 10.0)
+        cache.get(81, self.PARAMS, 1.0)  # Outra retração (G99)
+        cache.get(85, self.PARAMS, 10.0)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertIsNot(cache.get(81, self.PARAMS, 10.0), render)
+
+    def test_lru_eviction(self):
+        cache = conversor.CycleTemplateCache(maxsize=2)
+        a, b, c = ({'R': 1.0, 'Z': -depth, 'F': 100.0} for depth in (1.0, 2.0, 3.0))
+        cache.get(81, a, 10.0)
+        cache.get(81, b, 10.0)
+        cache.get(81, dict(a), 10.0)  # a passa a ser o usado mais recentemente
+        cache.get(81, c, 10.0)  # Descarta b
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.get(81, dict(a), 10.0)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        cache.get(81, dict(b), 10.0)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_render_matches_the_template(self):
+        for cycle in sorted(conversor.CYCLE_TEMPLATES):
+            params = dict(self.PARAMS, Q=0.5, P=1.0)
+            with self.subTest(cycle=cycle):
+                cache = conversor.CycleTemplateCache()
+                cache.get(cycle, params, 10.0)
+                render = cache.get(cycle, dict(params), 10.0)
+                output = render(3.0, 4.0)
+                self.assertIn("X3.000000 Y4.000000", output)
+                self.assertEqual(output, conversor.CycleTemplateCache().get(cycle, params, 10.0)(3.0, 4.0))
+                converted = conversor.convert_gcode_text(f"G0 Z10\nG{cycle:g} X3 Y4 R1 Z-2 Q0.5 P1 F100\n")
+                self.assertIn(output, converted)
+
+class CollectInputFilesTests(unittest.TestCase):
+    """Entradas do lote: globs e diretórios preservam as subpastas, sem duas entradas na mesma saída."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cam = os.path.join(self.tmp.name, 'cam')
+        for folder in ('a', 'b'):
+            os.makedirs(os.path.join(self.cam, folder))
+            _write(os.path.join(self.cam, folder, 'p.nc'), _sample('ciclos'))
+        self.output_dir = os.path.join(self.tmp.name, 'saida')
+
+    def test_glob_keeps_subfolders(self):
+        pairs = conversor.collect_input_files([os.path.join(self.cam, '**', '*.nc')], self.output_dir)
+        self.assertEqual(pairs, [(os.path.join(self.cam, folder, 'p.nc'), os.path.join(self.output_dir, folder, 'p.nc'))
+                                 for folder in ('a', 'b')])
+        self.assertEqual(sorted(conversor.collect_input_files([self.cam], self.output_dir)), pairs)
+        flat = conversor.collect_input_files([os.path.join(self.cam, 'a', '*.nc')], self.output_dir)
+        self.assertEqual(flat, [(os.path.join(self.cam, 'a', 'p.nc'), os.path.join(self.output_dir, 'p.nc'))])
+
+    def test_same_output_is_rejected(self):
+        files = [os.path.join(self.cam, folder, 'p.nc') for folder in ('a', 'b')]
+        with self.assertRaisesRegex(ValueError, "mesma saída"):
+            conversor.collect_input_files(files, self.output_dir)
+        with self.assertRaisesRegex(ValueError, "mesma saída"):
+            conversor.collect_input_files([os.path.dirname(path) for path in files], self.output_dir)
+
+    @requires_fork
+    def test_batch_converts_both_files(self):
+        pairs = conversor.collect_input_files([os.path.join(self.cam, '**', '*.nc')], self.output_dir)
+        summary = conversor.convert_batch(pairs, self.output_dir, jobs=1, log=lambda message: None)
+        self.assertEqual((summary['converted'], summary['skipped']), (2, 0))
+        for folder in ('a', 'b'):
+            self.assertEqual(_read(os.path.join(self.output_dir, folder, 'p.nc')), _sample('ciclos', 'linear.nc'))
+
+def _bench_results(*rates):
+    """Resultados no formato de run_benchmarks, um caso por (carga, linhas, modo, linhas/s)."""
+    return {'cases': [{'workload': kind, 'lines': lines, 'mode': mode, 'lines_per_s': rate}
+                      for kind, lines, mode, rate in rates]}
+
+class BenchmarkTests(unittest.TestCase):
+    """Comparação com os resultados de referência e a saída da linha de comando 'desempenho'."""
+
+    BASE = _bench_results(('furos', 1000, 'linear', 1000.0), ('arcos', 1000, 'mach3', 2000.0))
+
+    def test_within_threshold(self):
+        results = _bench_results(('furos', 1000, 'linear', 901.0), ('arcos', 1000, 'mach3', 2500.0))
+        self.assertEqual(conversor.compare_benchmarks(results, self.BASE), [])
+
+    def test_regression_above_threshold(self):
+        results = _bench_results(('furos', 1000, 'linear', 899.0), ('arcos', 1000, 'mach3', 2000.0))
+        self.assertEqual(conversor.compare_benchmarks(results, self.BASE),
+                         ["furos 1000 linhas linear: 1000 -> 899 linhas/s (-10.1%)"])
+        self.assertEqual(conversor.compare_benchmarks(results, self.BASE, threshold=20.0), [])
+
+    def test_cases_without_reference_are_ignored(self):
+        results = _bench_results(('furos', 5000, 'linear', 1.0), ('comentarios', 1000, 'linear', 1.0),
+                                 ('furos', 1000, 'mach3', 1.0))
+        self.assertEqual(conversor.compare_benchmarks(results, self.BASE), [])
+        zero = _bench_results(('furos', 1000, 'linear', 0.0))
+        self.assertEqual(conversor.compare_benchmarks(results, zero), [])
+
+    def _main(self, results, base):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base_path = os.path.join(tmp_dir, 'base.json')
+            _write(base_path, json.dumps(base))
+            output = io.StringIO()
+            with mock.patch.object(conversor, 'run_benchmarks', return_value=results), redirect_stdout(output):
+                status = conversor.main(['desempenho', '--base', base_path])
+        return status, output.getvalue()
+
+    def test_cli_exit_status(self):
+        status, output = self._main(_bench_results(('furos', 1000, 'linear', 500.0)), self.BASE)
+        self.assertEqual(status, 1)
+        self.assertIn("REGRESSÃO furos 1000 linhas linear", output)
+        status, output = self._main(_bench_results(('furos', 1000, 'linear', 1000.0)), self.BASE)
+        self.assertEqual(status, 0)
+        self.assertIn("Nenhuma regressão acima de 10%", output)
+
+    @requires_fork
+    def test_run_benchmarks(self):
+        results = conversor.run_benchmarks(['furos'], [200], ['parametros', 'linear'], repeat=1, log=lambda line: None)
+        self.assertEqual([(case['workload'], case['mode']) for case in results['cases']],
+                         [('furos', 'parametros'), ('furos', 'linear')])
+        for case in results['cases']:
+            self.assertEqual(case['lines'], 200)
+            self.assertGreater(case['lines_per_s'], 0)
+        self.assertEqual(results['converter_version'], conversor.CONVERTER_VERSION)
+        self.assertEqual(conversor.compare_benchmarks(results, results), [])
+        json.dumps(results)  # Os resultados são gravados em JSON com --saida
+
+if __name__ == '__main__':
+    unittest.main()